@@ -17,3 +17,26 @@ class R4sAuthFailed(Exception):
     Happens when the key is not registered on a device yet.
     """
     pass
+
+
+class R4sCommandError(Exception):
+    """Exception when a device reports an error for a command."""
+    pass
+
+
+class R4sQueueFull(Exception):
+    """Exception when a device command queue can't take or keep a request.
+
+    Raised on submit if the queue is full, or set on the future of a dropped request.
+    """
+    pass
+
+
+class R4sBrokerError(Exception):
+    """Exception when the broker fails a remote call."""
+    pass
+
+
+class R4sWatchdogTimeout(Exception):
+    """Exception when a peripheral operation exceeds its wall-clock limit."""
+    pass
@@ -0,0 +1,165 @@
+"""Light animation streaming to a group of devices."""
+import logging
+import threading
+import time
+
+import r4s.manager
+from r4s import R4sUnexpectedResponse, R4sWatchdogTimeout
+from r4s.protocol.redmond.command.lights import Cmd56, Cmd57
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _device_errors():
+    """Errors of a failed frame or mode switch. The BLE error class is looked up on the manager at call time."""
+    return r4s.manager.BTLEException, R4sUnexpectedResponse, R4sWatchdogTimeout
+
+
+class _DeviceStream:
+    """Sends the latest frame to a device. Frames not sent in time are replaced."""
+
+    def __init__(self, device):
+        self.device = device
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lag = 0.0  # Seconds from frame creation to the end of the write. Last frame.
+        self.lag_total = 0.0
+        self._frame = None
+        self._cond = threading.Condition()
+        self._is_running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._is_running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def put(self, cmd):
+        """Replaces the pending frame."""
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = (time.monotonic(), cmd)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._frame is None and self._is_running:
+                    self._cond.wait()
+                if not self._is_running:
+                    return
+                created, cmd = self._frame
+                self._frame = None
+            try:
+                self.device.send_nowait(cmd)
+            except _device_errors():
+                _LOGGER.exception('failed to send frame to %s', self.device.bt_attrs.name)
+                self.errors += 1
+                continue
+            self.lag = time.monotonic() - created
+            self.lag_total += self.lag
+            self.sent += 1
+
+
+class LightAnimation:
+    """Streams color frames to devices at a target frame rate.
+
+    The frame function is called with the device index and seconds since start
+    and returns (red, green, blue) or (red, green, blue, brightness).
+    When a device falls behind, its stale frames are dropped instead of queued.
+    """
+
+    def __init__(self, devices, fps=20):
+        if fps <= 0:
+            raise ValueError('Incorrect frame rate')
+        self.devices = list(devices)
+        self.fps = fps
+        self._streams = []
+        self._started = None
+        self._stopped = None
+        self._ticks = 0
+
+    def run(self, frame_fn, duration):
+        """Streams frames for duration seconds."""
+        self.start()
+        try:
+            period = 1.0 / self.fps
+            next_tick = time.monotonic()
+            while time.monotonic() - self._started < duration:
+                elapsed = time.monotonic() - self._started
+                for i, stream in enumerate(self._streams):
+                    stream.put(Cmd56(*frame_fn(i, elapsed)))
+                self._ticks += 1
+                next_tick += period
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Skip the ticks we are late for.
+                    next_tick = time.monotonic()
+        finally:
+            self.stop()
+        return self.stats()
+
+    def start(self):
+        """Enables disco mode and starts device streams.
+
+        If a device fails, disco mode is disabled on the devices already switched.
+        """
+        switched = []
+        try:
+            for device in self.devices:
+                device.do_command(Cmd57(True))
+                switched.append(device)
+        except _device_errors():
+            for device in switched:
+                self._disable(device)
+            raise
+        self._streams = [_DeviceStream(device) for device in self.devices]
+        for stream in self._streams:
+            stream.start()
+        self._started = time.monotonic()
+        self._stopped = None
+        self._ticks = 0
+
+    def stop(self):
+        """Stops device streams and disables disco mode."""
+        for stream in self._streams:
+            stream.stop()
+        self._stopped = time.monotonic()
+        for device in self.devices:
+            self._disable(device)
+
+    @staticmethod
+    def _disable(device):
+        """Disables disco mode. A failure doesn't stop other devices."""
+        try:
+            device.do_command(Cmd57(False))
+        except _device_errors():
+            _LOGGER.exception('failed to disable disco mode of %s', device.bt_attrs.name)
+
+    def stats(self):
+        """Returns achieved frame rates and lags."""
+        elapsed = max((self._stopped or time.monotonic()) - self._started, 1e-9)
+        devices = []
+        for stream in self._streams:
+            devices.append({
+                'name': stream.device.bt_attrs.name,
+                'sent': stream.sent,
+                'dropped': stream.dropped,
+                'errors': stream.errors,
+                'fps': stream.sent / elapsed,
+                'lag': stream.lag,
+                'avg_lag': stream.lag_total / stream.sent if stream.sent else 0.0,
+            })
+        return {
+            'target_fps': self.fps,
+            'fps': self._ticks / elapsed,
+            'devices': devices,
+        }
@@ -0,0 +1,288 @@
+"""Broker daemon owning the adapters and the DeviceManager.
+
+Application processes talk to the broker with BrokerClient over a Unix socket
+and share its connections, caches and auth sessions.
+Every message is a 4 byte big-endian length followed by compact JSON:
+request {"id", "mac", "method", "args"} and response {"id", "result"} or {"id", "error"}.
+
+Anyone who can write to the socket controls the devices, so the socket is accessible by its owner only
+and lives in $XDG_RUNTIME_DIR when it's set. Clients must run as the user of the broker.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+import r4s
+import r4s.manager
+from r4s import R4sBrokerError
+from r4s.discovery import DeviceDiscovery, DeviceDiscoveryYml
+from r4s.keystore import KeyStore, KeyStoreYml
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.response.common import RedmondResponse
+
+_LOGGER = logging.getLogger(__name__)
+
+SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', 'r4s.sock')
+MAX_MESSAGE = 1 << 20
+
+_HEADER = struct.Struct('>I')
+
+# Device attributes available to clients. Properties are read, methods are called.
+DEVICE_METHODS = frozenset({
+    'firmware_version', 'fetch_firmware', 'send_sync', 'ensure_sync',
+    'status', 'fetch_status', 'set_mode', 'switch_on', 'switch_off',
+    'stats_ten', 'stats_times', 'fetch_statistics', 'fetch_lights', 'set_lights',
+})
+# Fields readable from the cache of a device with METHOD_CACHED.
+CACHED_FIELDS = frozenset({'firmware_version', 'status', 'stats_ten', 'stats_times'})
+# Calls served by the broker itself.
+METHOD_CONNECT = 'connect'
+METHOD_CACHED = 'cached'
+
+
+def encode(message) -> bytes:
+    """Frames a message."""
+    payload = json.dumps(message, separators=(',', ':'), default=_encode_value).encode()
+    return _HEADER.pack(len(payload)) + payload
+
+
+def decode_value(value):
+    """Restores responses in a decoded message."""
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, dict):
+        resp_cls = value.get('resp')
+        if resp_cls is not None and resp_cls.startswith('r4s.protocol.'):
+            module, name = resp_cls.rsplit('.', 1)
+            return getattr(importlib.import_module(module), name).from_bytes(value['data'])
+        return {key: decode_value(item) for key, item in value.items()}
+    return value
+
+
+def _encode_value(value):
+    if isinstance(value, RedmondResponse):
+        return {'resp': '{}.{}'.format(type(value).__module__, type(value).__name__), 'data': value.to_arr()}
+    if isinstance(value, (bytes, bytearray)):
+        return list(value)
+    raise TypeError('{} is not serializable.'.format(type(value).__name__))
+
+
+class Broker:
+    """Serves device calls of clients with one DeviceManager.
+
+    Calls block on BLE, so they run in the default executor.
+    Calls to one device are serialized by its lock, different devices are served in parallel.
+    """
+
+    def __init__(self, manager: DeviceManager, path=SOCKET_PATH):
+        self.manager = manager
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        """Starts listening on the socket."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_client, path=self.path)
+        os.chmod(self.path, 0o600)
+        _LOGGER.debug('Broker listens on %s.', self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """Stops listening."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def call(self, mac, method, args):
+        """Runs a call of a client."""
+        if method == METHOD_CACHED:
+            field, = args
+            if field not in CACHED_FIELDS:
+                raise AttributeError('Field {} is not available.'.format(field))
+            device = self.manager.get_cached(mac)
+            return None if device is None else device.cached(field)
+        # The live connection is shared, it's established again only if it was closed or lost.
+        device = self.manager.get_cached(mac)
+        if device is None or not device.is_connected:
+            device = self.manager.connect(mac)
+        if method == METHOD_CONNECT:
+            return device.bt_attrs.name
+        if method not in DEVICE_METHODS or not hasattr(device, method):
+            raise AttributeError('Method {} is not available.'.format(method))
+        value = getattr(device, method)
+        try:
+            return value(*args) if callable(value) else value
+        except r4s.manager.BTLEException:
+            # The link may be lost, the next call connects again.
+            device.disconnect()
+            raise
+
+    async def _serve_client(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_HEADER.size)
+                    size, = _HEADER.unpack(header)
+                    if size > MAX_MESSAGE:
+                        raise ValueError('Message of {} bytes is too large.'.format(size))
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    break
+                # Requests are pipelined, a slow device doesn't hold the others.
+                task = asyncio.ensure_future(self._respond(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, ValueError):
+            _LOGGER.exception('client failed')
+        finally:
+            writer.close()
+
+    async def _respond(self, request, writer):
+        loop = asyncio.get_event_loop()
+        response = {'id': request.get('id')}
+        try:
+            response['result'] = await loop.run_in_executor(
+                None, self.call, request['mac'], request['method'], request.get('args', []))
+        except Exception as err:
+            response['error'] = {'type': type(err).__name__, 'message': str(err)}
+        try:
+            data = encode(response)
+        except TypeError as err:
+            data = encode({'id': response['id'], 'error': {'type': 'TypeError', 'message': str(err)}})
+        writer.write(data)
+        await writer.drain()
+
+
+class BrokerClient:
+    """Client of the broker. Calls are thread safe and run one at a time."""
+
+    def __init__(self, path=SOCKET_PATH, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def call(self, mac, method, *args):
+        """Calls a device method in the broker and returns the result.
+
+        Errors of r4s are raised with their own types, other errors as R4sBrokerError.
+        """
+        with self._lock:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.settimeout(self.timeout)
+                self._sock.connect(self.path)
+            self._next_id += 1
+            try:
+                self._sock.sendall(encode({'id': self._next_id, 'mac': mac, 'method': method, 'args': args}))
+                size, = _HEADER.unpack(self._recv(_HEADER.size))
+                response = json.loads(self._recv(size))
+            except OSError:
+                self._sock.close()
+                self._sock = None
+                raise
+
+        if 'error' in response:
+            error = response['error']
+            err_cls = getattr(r4s, error['type'], None)
+            if not (isinstance(err_cls, type) and issubclass(err_cls, Exception)):
+                err_cls = R4sBrokerError
+            raise err_cls('{}: {}'.format(error['type'], error['message']))
+        return decode_value(response['result'])
+
+    def connect(self, mac):
+        """Connects the device in the broker. Returns the model name."""
+        return self.call(mac, METHOD_CONNECT)
+
+    def cached(self, mac, field):
+        """Returns the cached field of a connected device without any BLE traffic."""
+        return self.call(mac, METHOD_CACHED, field)
+
+    def device(self, mac):
+        return RemoteDevice(self, mac)
+
+    def _recv(self, size):
+        chunks = []
+        while size:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                raise ConnectionError('The broker closed the connection.')
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+class RemoteDevice:
+    """Device proxy. Properties of the device are called as methods, e.g. status()."""
+
+    def __init__(self, client: BrokerClient, mac):
+        self._client = client
+        self.mac = mac
+
+    def __getattr__(self, method):
+        if method not in DEVICE_METHODS:
+            raise AttributeError(method)
+
+        def call(*args):
+            return self._client.call(self.mac, method, *args)
+
+        return call
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='R4S BLE broker.')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='Unix socket path.')
+    parser.add_argument('--key', help='Common auth key, 8 bytes in hex. Random keys per device by default.')
+    parser.add_argument('--keys', help='Yml file to store auth keys per device. Required without --key.')
+    parser.add_argument('--iface', type=int, default=0, help='HCI interface number.')
+    parser.add_argument('--discovery', help='Yml file to cache discovered devices.')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args(argv)
+    if args.key is None and args.keys is None:
+        # Random keys of paired devices would be lost on restart.
+        parser.error('--keys is required without --key.')
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    discovery = DeviceDiscoveryYml(args.discovery) if args.discovery else DeviceDiscovery()
+    keystore = KeyStoreYml(args.keys) if args.keys else KeyStore()
+    key = list(bytes.fromhex(args.key)) if args.key else None
+    manager = DeviceManager(key, discovery, iface=args.iface, keystore=keystore)
+    broker = Broker(manager, args.socket)
+    try:
+        asyncio.run(broker.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
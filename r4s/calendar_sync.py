@@ -0,0 +1,124 @@
+import logging
+import time
+
+from r4s import R4sCommandError
+from r4s.devices.base import RedmondDevice
+from r4s.protocol.redmond.command.calendar import Cmd112, Cmd113, Cmd115, Cmd116DeleteEvent
+from r4s.protocol.redmond.response.calendar import EventInCalendarResponse, CalendarInfoResponse
+from r4s.snapshot import FieldState, encode_value, decode_value
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CalendarSync:
+    """Synchronizes the device calendar with a desired schedule.
+
+    The events of the device are read once and cached by uid.
+    The cache is trusted while the device reports the same number of events.
+    On sync only deleted, added or changed events are sent.
+    """
+
+    def __init__(self, device: RedmondDevice):
+        self._device = device
+        self.info = None  # Last CalendarInfoResponse.
+        self.events = {}  # Known device events by uid.
+        self._is_loaded = False
+        self._loaded_at = None
+
+    def invalidate(self):
+        """Forgets the known events."""
+        self.events = {}
+        self._is_loaded = False
+        self._loaded_at = None
+
+    def dump_state(self):
+        """Returns the known events for a snapshot."""
+        if not self._is_loaded:
+            return []
+        return [FieldState('calendar_event', self._loaded_at, encode_value(event)) for event in self.events.values()]
+
+    def load_state(self, states):
+        """Restores the known events. They are still checked against the event count on sync."""
+        events = {}
+        loaded_at = None
+        for field, fetched_at, data in states:
+            if field == 'calendar_event':
+                event = decode_value(data, EventInCalendarResponse)
+                events[event.uid] = event
+                loaded_at = fetched_at
+        if loaded_at is not None:
+            self.events = events
+            self._is_loaded = True
+            self._loaded_at = loaded_at
+
+    def fetch_info(self) -> CalendarInfoResponse:
+        self.info = self._device.do_command(Cmd115())
+        return self.info
+
+    def load(self, force=False):
+        """Reads device events unless the cache is still valid."""
+        info = self.fetch_info()
+        if self._is_loaded and not force and len(self.events) == info.curr_task_count:
+            return self.events
+
+        self.events = {}
+        for uid in range(info.max_task_count):
+            if len(self.events) >= info.curr_task_count:
+                break
+            event = self._device.do_command(Cmd112(uid))
+            if event.uid == uid and event.timestamp != 0:
+                self.events[uid] = event
+        self._is_loaded = True
+        self._loaded_at = time.time()
+        return self.events
+
+    def diff(self, desired):
+        """Compares desired events with the known ones.
+
+        Returns uids to delete and events to add. A changed event is deleted and added again,
+        overwriting an event in place by Cmd113 is not verified on a device.
+        """
+        desired = self._by_uid(desired)
+        to_delete = [uid for uid, event in self.events.items() if desired.get(uid) != event]
+        to_add = [event for uid, event in desired.items() if self.events.get(uid) != event]
+        return to_delete, to_add
+
+    def sync(self, desired):
+        """Brings the device calendar to the desired events.
+
+        Returns the number of sent frames.
+        """
+        desired = self._by_uid(desired)
+        self.load()
+        if self.info is not None and len(desired) > self.info.max_task_count:
+            raise ValueError('The device supports only {} events.'.format(self.info.max_task_count))
+
+        to_delete, to_add = self.diff(desired.values())
+        if to_add:
+            # Events are scheduled by the device clock.
+            self._device.ensure_sync()
+        for uid in to_delete:
+            resp = self._device.do_command(Cmd116DeleteEvent(uid))
+            if resp.err:
+                raise R4sCommandError('Failed to delete event {}: {}'.format(uid, resp.err))
+            del self.events[uid]
+
+        for event in to_add:
+            resp = self._device.do_command(Cmd113(event))
+            if resp.err:
+                raise R4sCommandError('Failed to add event {}: {}'.format(event.uid, resp.err))
+            self.events[event.uid] = event
+
+        _LOGGER.debug('Calendar synced: %s deleted, %s added.', len(to_delete), len(to_add))
+        return len(to_delete) + len(to_add)
+
+    @staticmethod
+    def _by_uid(events):
+        if isinstance(events, dict):
+            return events
+        result = {}
+        for event in events:
+            if not isinstance(event, EventInCalendarResponse):
+                raise ValueError('Incorrect event {}.'.format(event))
+            result[event.uid] = event
+        return result
@@ -0,0 +1,117 @@
+"""Binary capture of the frames exchanged with peripherals.
+
+A capture is a stream of records. The stream starts with a header, then every MAC address is declared once
+and the following frames refer to it by an index. A frame stores the direction, the timestamp, the handle
+and the raw bytes, so a field session can be inspected or replayed offline.
+"""
+import struct
+import threading
+import time
+from collections import namedtuple
+
+CAPTURE_MAGIC = b'R4SC'
+CAPTURE_VERSION = 1
+
+DIRECTION_WRITE = 0x57  # Frame written to a peripheral, 'W'.
+DIRECTION_NOTIFY = 0x4e  # Notification received from a peripheral, 'N'.
+
+_RECORD_MAC = 0x4d  # MAC declaration record, 'M'.
+
+_HEADER = struct.Struct('<4sB')  # Magic, version.
+_MAC = struct.Struct('<HB')  # MAC index, MAC length.
+_FRAME = struct.Struct('<dHHH')  # Timestamp, MAC index, handle, data length.
+
+Frame = namedtuple('Frame', ['direction', 'timestamp', 'mac', 'handle', 'data'])
+
+
+class FrameRecorder:
+    """Writes frames to a binary stream.
+
+    The recorder may be shared by several devices, the writes are serialized.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._macs = {}
+        self._lock = threading.Lock()
+        self._stream.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+
+    @classmethod
+    def open(cls, filename):
+        """Creates a recorder writing to a file."""
+        return cls(open(filename, 'wb'))
+
+    def record(self, direction, mac, handle, data, timestamp=None):
+        """Appends a frame to the capture."""
+        if timestamp is None:
+            timestamp = time.time()
+        data = bytes(data)
+        with self._lock:
+            if mac not in self._macs:
+                self._declare_mac(mac)
+            self._stream.write(bytes([direction]))
+            self._stream.write(_FRAME.pack(timestamp, self._macs[mac], handle, len(data)))
+            self._stream.write(data)
+
+    def record_write(self, mac, handle, data):
+        """Appends a frame written to a peripheral."""
+        self.record(DIRECTION_WRITE, mac, handle, data)
+
+    def record_notify(self, mac, handle, data):
+        """Appends a notification received from a peripheral."""
+        self.record(DIRECTION_NOTIFY, mac, handle, data)
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            self._stream.close()
+
+    def _declare_mac(self, mac):
+        """Writes MAC declaration record. Must be called under the lock."""
+        index = len(self._macs)
+        encoded = str(mac).encode('utf-8')
+        self._stream.write(bytes([_RECORD_MAC]))
+        self._stream.write(_MAC.pack(index, len(encoded)))
+        self._stream.write(encoded)
+        self._macs[mac] = index
+
+
+def read_frames(stream):
+    """Iterates over frames of a capture stream."""
+    magic, version = _HEADER.unpack(read_exact(stream, _HEADER.size))
+    if magic != CAPTURE_MAGIC:
+        raise ValueError('Not a r4s capture.')
+    if version != CAPTURE_VERSION:
+        raise ValueError('Unsupported capture version {}.'.format(version))
+
+    macs = {}
+    while True:
+        record_type = stream.read(1)
+        if not record_type:
+            return
+        record_type = record_type[0]
+        if record_type == _RECORD_MAC:
+            index, length = _MAC.unpack(read_exact(stream, _MAC.size))
+            macs[index] = read_exact(stream, length).decode('utf-8')
+        elif record_type in (DIRECTION_WRITE, DIRECTION_NOTIFY):
+            timestamp, index, handle, length = _FRAME.unpack(read_exact(stream, _FRAME.size))
+            yield Frame(record_type, timestamp, macs[index], handle, read_exact(stream, length))
+        else:
+            raise ValueError('Unknown capture record {}.'.format(record_type))
+
+
+def load_capture(filename, mac=None):
+    """Reads all frames of a capture file, optionally only for one device."""
+    with open(filename, 'rb') as stream:
+        return [frame for frame in read_frames(stream) if mac is None or frame.mac == mac]
+
+
+def read_exact(stream, size, name='capture'):
+    """Reads exactly size bytes or fails on truncated stream. The name of the format is used in the error."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated {}.'.format(name))
+    return data
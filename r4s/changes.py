@@ -0,0 +1,45 @@
+"""Field-level change detection of device statuses."""
+import threading
+from collections import namedtuple
+
+# Changes of these fields are ignored while they stay within the band, e.g. temperature jitter.
+DEFAULT_DEADBANDS = {
+    'curr_temp': 1,
+}
+
+StatusDelta = namedtuple('StatusDelta', ['mac', 'changes'])  # Changes are field to new value.
+
+
+class StatusChangeDetector:
+    """Compares statuses field by field with the last reported values.
+
+    The first status is reported as a whole. A numeric field with a deadband is reported
+    when it moves away from the reported value by more than the band, so slow drifts are not lost.
+    """
+
+    def __init__(self, deadbands=None):
+        self.deadbands = DEFAULT_DEADBANDS if deadbands is None else deadbands
+        self._reported = {}  # Field to the last reported value.
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forgets the reported values, the next status is reported as a whole."""
+        with self._lock:
+            self._reported = {}
+
+    def update(self, status) -> dict:
+        """Returns changed fields of the status with their new values."""
+        changes = {}
+        with self._lock:
+            for field, value in vars(status).items():
+                if field in self._reported and not self._is_changed(field, self._reported[field], value):
+                    continue
+                changes[field] = value
+            self._reported.update(changes)
+        return changes
+
+    def _is_changed(self, field, old, new):
+        band = self.deadbands.get(field)
+        if band is None or old is None or new is None:
+            return old != new
+        return abs(new - old) > band
@@ -0,0 +1,158 @@
+"""Statistics time series.
+
+The counters of every device are stored in a file as a header with the first sample
+followed by fixed width records of deltas to the previous sample.
+"""
+import asyncio
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+
+import r4s.manager
+from r4s import UnsupportedDeviceException, R4sAuthFailed, R4sUnexpectedResponse, R4sWatchdogTimeout
+
+_LOGGER = logging.getLogger(__name__)
+
+STATS_MAGIC = b'R4SS'
+STATS_VERSION = 1
+
+# Stored columns. Counters are 4 bytes on the device and wrap modulo 2^32.
+COLUMNS = ('timestamp', 'work_time', 'spent_power', 'relay_turn_on_amount', 'turning_on_amount')
+COUNTER_MOD = 1 << 32
+
+_HEADER = struct.Struct('<4sB5q')  # Magic, version, first sample.
+_RECORD = struct.Struct('<5i')  # Deltas to the previous sample.
+
+
+def counter_increase(old, new):
+    """Counter increase between samples, element-wise for arrays.
+
+    A decreasing counter is a wraparound if it was in the upper half of its range,
+    otherwise the device was reset and the new value is counted from zero.
+    """
+    old = np.asarray(old, dtype=np.int64)
+    new = np.asarray(new, dtype=np.int64)
+    wrapped = np.where(old >= COUNTER_MOD // 2, new + COUNTER_MOD - old, new)
+    return np.where(new >= old, new - old, wrapped)
+
+
+class StatisticsStore:
+    """Delta encoded statistics storage. One file per device."""
+
+    def __init__(self, path):
+        self.path = path
+        self._last = {}  # Last stored sample by MAC.
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, mac):
+        return os.path.join(self.path, str(mac).replace(':', '').lower() + '.r4sstats')
+
+    def append(self, mac, timestamp, work_time, spent_power, relay_turn_on_amount, turning_on_amount):
+        """Stores a sample of device counters."""
+        sample = (int(timestamp), work_time, spent_power, relay_turn_on_amount, turning_on_amount)
+        filename = self.filename(mac)
+        if mac not in self._last and os.path.exists(filename):
+            columns = self.query(mac)
+            if len(columns['timestamp']):
+                self._last[mac] = tuple(int(columns[name][-1]) for name in COLUMNS)
+
+        if mac not in self._last:
+            with open(filename, 'wb') as stream:
+                stream.write(_HEADER.pack(STATS_MAGIC, STATS_VERSION, *sample))
+        else:
+            prev = self._last[mac]
+            if sample[0] < prev[0]:
+                raise ValueError('Samples must be appended in time order.')
+            deltas = [sample[0] - prev[0]]
+            deltas.extend(self._wrap(new - old) for new, old in zip(sample[1:], prev[1:]))
+            with open(filename, 'ab') as stream:
+                stream.write(_RECORD.pack(*deltas))
+        self._last[mac] = sample
+
+    def append_responses(self, mac, timestamp, stats_ten, stats_times):
+        """Stores a sample from TenInformationResponse and TurningOnCountResponse."""
+        self.append(mac, timestamp, stats_ten.work_time, stats_ten.spent_power, stats_ten.relay_turn_on_amount,
+                    stats_times.turning_on_amount)
+
+    def query(self, mac, start=None, end=None):
+        """Returns the samples in [start, end) as columns of NumPy arrays."""
+        with open(self.filename(mac), 'rb') as stream:
+            header = stream.read(_HEADER.size)
+            body = stream.read()
+        if len(header) != _HEADER.size:
+            raise ValueError('Truncated statistics file.')
+        magic, version, *first = _HEADER.unpack(header)
+        if magic != STATS_MAGIC or version != STATS_VERSION:
+            raise ValueError('Not a r4s statistics file.')
+
+        width = len(COLUMNS)
+        deltas = np.frombuffer(body, dtype='<i4', count=len(body) // _RECORD.size * width).reshape(-1, width)
+        samples = np.empty((len(deltas) + 1, width), dtype=np.int64)
+        samples[0] = first
+        np.cumsum(deltas, axis=0, dtype=np.int64, out=samples[1:])
+        samples[1:] += samples[0]
+        samples[:, 1:] %= COUNTER_MOD
+        columns = {name: np.ascontiguousarray(samples[:, i]) for i, name in enumerate(COLUMNS)}
+
+        if start is None and end is None:
+            return columns
+        timestamps = columns['timestamp']
+        lo = 0 if start is None else np.searchsorted(timestamps, start)
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, end)
+        return {name: values[lo:hi] for name, values in columns.items()}
+
+    def aggregate(self, mac, start=None, end=None):
+        """Returns counter increase and number of samples in [start, end). See counter_increase."""
+        columns = self.query(mac, start, end)
+        result = {'samples': len(columns['timestamp'])}
+        for name in COLUMNS[1:]:
+            values = columns[name]
+            result[name] = int(counter_increase(values[:-1], values[1:]).sum())
+        return result
+
+    @staticmethod
+    def _wrap(delta):
+        """Fits counter delta to the signed 4 byte record."""
+        delta %= COUNTER_MOD
+        return delta - COUNTER_MOD if delta >= COUNTER_MOD // 2 else delta
+
+
+class StatisticsCollector:
+    """Samples statistics of the fleet on schedule."""
+
+    def __init__(self, manager, store: StatisticsStore, macs, interval=3600):
+        self._manager = manager
+        self._store = store
+        self.macs = list(macs)
+        self.interval = interval
+
+    def sample(self, mac):
+        """Fetches and stores statistics of a device."""
+        device = self._manager.connect(mac)
+        device.fetch_statistics()
+        self._store.append_responses(mac, time.time(), device.stats_ten, device.stats_times)
+
+    def sample_all(self):
+        """Samples all devices. Returns MACs that failed."""
+        failed = []
+        for mac in self.macs:
+            # The BLE error class is looked up on the manager, which may use bluepy or the test helper.
+            try:
+                self.sample(mac)
+            except (r4s.manager.BTLEException, R4sAuthFailed, R4sUnexpectedResponse, R4sWatchdogTimeout,
+                    UnsupportedDeviceException):
+                _LOGGER.exception('failed to collect statistics of %s', mac)
+                failed.append(mac)
+        return failed
+
+    async def run(self):
+        """Samples all devices every interval seconds."""
+        loop = asyncio.get_event_loop()
+        while True:
+            started = time.monotonic()
+            await loop.run_in_executor(None, self.sample_all)
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
@@ -0,0 +1,168 @@
+"""Per-device prioritized command queue."""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from r4s import R4sQueueFull
+from r4s.protocol.redmond.command.common import RedmondCommand
+
+_LOGGER = logging.getLogger(__name__)
+
+# Priority classes. Lower runs first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CONTROL = 1
+PRIORITY_POLLING = 2
+PRIORITY_STATISTICS = 3
+
+MAX_DEPTH = 32
+
+
+class _Request:
+    __slots__ = ('priority', 'fn', 'key', 'future', 'deadline', 'entry')
+
+    def __init__(self, fn, key, deadline):
+        self.priority = None
+        self.fn = fn
+        self.key = key
+        self.deadline = deadline
+        self.future = Future()
+        self.entry = None  # Heap entry [priority, seq, request or None if removed].
+
+
+class CommandQueue:
+    """Runs requests to one device in a worker thread by priority.
+
+    A request is a RedmondCommand or a callable receiving the device.
+    Requests with the same key are merged while pending. When the queue is full,
+    the newest request of a lower priority class is dropped for the new one.
+    Requests waiting longer than their ttl are failed instead of being sent.
+    """
+
+    def __init__(self, device, max_depth=MAX_DEPTH):
+        self.device = device
+        self.max_depth = max_depth
+        self._heap = []
+        self._pending = 0
+        self._keys = {}  # Merge key to pending request.
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._is_closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return self._pending
+
+    def submit(self, request, priority=PRIORITY_CONTROL, key=None, ttl=None) -> Future:
+        """Queues a request and returns its future."""
+        with self._cond:
+            if self._is_closed:
+                raise R4sQueueFull('The queue is closed.')
+
+            if key is not None and key in self._keys:
+                merged = self._keys[key]
+                if priority < merged.priority:
+                    # Move the request to the higher priority class.
+                    self._remove(merged)
+                    self._push(merged, priority)
+                    self._keys[key] = merged
+                return merged.future
+
+            if self._pending >= self.max_depth:
+                self._drop_for(priority)
+
+            deadline = time.monotonic() + ttl if ttl is not None else None
+            item = _Request(request, key, deadline)
+            self._push(item, priority)
+            if key is not None:
+                self._keys[key] = item
+            self._cond.notify()
+            return item.future
+
+    async def async_submit(self, request, priority=PRIORITY_CONTROL, key=None, ttl=None):
+        """Queues a request and waits for its result."""
+        return await asyncio.wrap_future(self.submit(request, priority, key, ttl))
+
+    def close(self, wait=True):
+        """Stops the worker. Pending requests are failed."""
+        with self._cond:
+            self._is_closed = True
+            for _, _, item in self._heap:
+                if item is not None:
+                    self._fail(item, R4sQueueFull('The queue is closed.'))
+            self._heap = []
+            self._pending = 0
+            self._keys = {}
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+
+    def _push(self, item, priority):
+        """Adds the request to the heap. Must be called under the lock."""
+        item.priority = priority
+        item.entry = [priority, next(self._seq), item]
+        heapq.heappush(self._heap, item.entry)
+        self._pending += 1
+
+    def _remove(self, item):
+        """Marks the request removed, it is skipped when popped. Must be called under the lock."""
+        item.entry[2] = None
+        self._pending -= 1
+        if item.key is not None and self._keys.get(item.key) is item:
+            del self._keys[item.key]
+
+    def _drop_for(self, priority):
+        """Drops the newest request of a lower priority class. Must be called under the lock."""
+        candidates = [entry for entry in self._heap if entry[2] is not None and entry[0] > priority]
+        if not candidates:
+            raise R4sQueueFull('The queue of {} is full.'.format(self.device.bt_attrs.name))
+        victim = max(candidates)[2]
+        self._remove(victim)
+        self._fail(victim, R4sQueueFull('Dropped for a higher priority request.'))
+
+    @staticmethod
+    def _fail(item, err):
+        """Fails a queued request unless its caller has cancelled it."""
+        if not item.future.cancelled():
+            item.future.set_exception(err)
+
+    def _pop(self):
+        """Waits for the next request."""
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    item = heapq.heappop(self._heap)[2]
+                    self._pending -= 1
+                    if item.key is not None and self._keys.get(item.key) is item:
+                        del self._keys[item.key]
+                    return item
+                if self._is_closed:
+                    return None
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            item = self._pop()
+            if item is None:
+                return
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            if item.deadline is not None and time.monotonic() > item.deadline:
+                item.future.set_exception(R4sQueueFull('The request expired in the queue.'))
+                continue
+            try:
+                if isinstance(item.fn, RedmondCommand):
+                    result = self.device.do_command(item.fn)
+                else:
+                    result = item.fn(self.device)
+            except BaseException as err:
+                item.future.set_exception(err)
+            else:
+                item.future.set_result(result)
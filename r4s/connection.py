@@ -0,0 +1,84 @@
+"""Connection parameters of BLE links.
+
+Intervals are in units of 1.25 ms, the supervision timeout in units of 10 ms, as in the
+Peripheral Preferred Connection Parameters characteristic and HCI commands.
+"""
+import logging
+import re
+import struct
+import subprocess
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+INTERVAL_UNIT = 1.25e-3  # Seconds.
+DEFAULT_MTU = 23  # ATT MTU before negotiation.
+MAX_MTU = 247  # ATT MTU requested on connect, fits a data length extended packet.
+
+_CONN_PARAMS = struct.Struct('<4H')
+_HCITOOL_HANDLE = re.compile(r'LE\s+([0-9A-Fa-f:]{17})\s+handle\s+(\d+)')
+
+ConnParams = namedtuple('ConnParams', ['min_interval', 'max_interval', 'latency', 'timeout'])
+
+# Short interval for bursts of commands, 7.5-15 ms.
+PROFILE_INTERACTIVE = ConnParams(6, 12, 0, 200)
+# Long interval while the device is only polled, 100-200 ms.
+PROFILE_IDLE = ConnParams(80, 160, 4, 600)
+
+
+def conn_params_from_bytes(data) -> ConnParams:
+    return ConnParams(*_CONN_PARAMS.unpack(bytes(data)))
+
+
+def conn_params_to_bytes(params: ConnParams) -> bytes:
+    return _CONN_PARAMS.pack(*params)
+
+
+def interval_seconds(params: ConnParams):
+    """Returns the longest interval the link may use."""
+    return params.max_interval * INTERVAL_UNIT
+
+
+class ConnectionUpdater:
+    """Requests connection parameters of a connected device.
+
+    Bluepy doesn't expose the connection update, so the base class keeps the parameters picked by the stack.
+    Inherit the class to use a platform tool.
+    """
+
+    def update(self, mac, params: ConnParams) -> bool:
+        """Requests the parameters. Returns whether the controller accepted them."""
+        return False
+
+
+class HcitoolConnectionUpdater(ConnectionUpdater):
+    """Updates connection parameters with hcitool lecup. Requires root or CAP_NET_ADMIN."""
+
+    def __init__(self, iface=0, hcitool='hcitool', timeout=5):
+        self.iface = iface
+        self.hcitool = hcitool
+        self.timeout = timeout
+
+    def update(self, mac, params: ConnParams) -> bool:
+        try:
+            handle = self._handle(mac)
+            if handle is None:
+                _LOGGER.debug('No connection handle of %s.', mac)
+                return False
+            self._run('lecup', '--handle', handle, '--min', params.min_interval, '--max', params.max_interval,
+                      '--latency', params.latency, '--timeout', params.timeout)
+        except (OSError, subprocess.SubprocessError):
+            _LOGGER.exception('connection update failed')
+            return False
+        return True
+
+    def _handle(self, mac):
+        """Finds the connection handle of a MAC."""
+        for found_mac, handle in _HCITOOL_HANDLE.findall(self._run('con')):
+            if found_mac.upper() == mac.upper():
+                return int(handle)
+        return None
+
+    def _run(self, *args):
+        cmd = [self.hcitool, '-i', 'hci{}'.format(self.iface), *[str(arg) for arg in args]]
+        return subprocess.run(cmd, check=True, capture_output=True, timeout=self.timeout, text=True).stdout
@@ -1,10 +1,19 @@
 import logging
+import threading
+import time
+from contextlib import contextmanager
 
 from r4s.manager import Peripheral
+from r4s.connection import DEFAULT_MTU, ConnParams, PROFILE_IDLE, PROFILE_INTERACTIVE, interval_seconds
 from r4s.discovery import DeviceBTAttrs
+from r4s.frame_log import FrameLogSampler, LazyHex, LazyTypeName
 from r4s import R4sUnexpectedResponse
-from r4s.protocol.redmond.command.common import CmdAuth, CmdFw, RedmondCommand
-from r4s.protocol.redmond.response.common import SuccessResponse, VersionResponse
+from r4s.singleflight import SingleFlight
+from r4s.snapshot import FieldState, encode_value, decode_value
+from r4s.tracing import tracer
+from r4s.metrics import DIRECTION_IN, DIRECTION_OUT, TIMEOUTS, UNEXPECTED_RESPONSES, CONN_INTERVAL
+from r4s.protocol.redmond.command.common import CmdAuth, CmdFw, CmdSync, RedmondCommand
+from r4s.protocol.redmond.response.common import SuccessResponse, VersionResponse, ErrorResponse
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -16,9 +25,23 @@ class RedmondDevice:
     Base class for r4s device connection.
 
     The class handles basic commands and provides layer to communicate with a peripheral.
+    Commands are serialized by the device lock, so the instance may be shared by threads.
+    Cached fields are replaced as a whole by handlers and may be read without the lock.
     """
     status_resp_cls = NotImplemented
     set_program_cls = NotImplemented
+    # Sampling of logged frames, shared by all devices.
+    frame_log_sampler = FrameLogSampler()
+    # Max age in seconds of lazily fetched fields. None means once per session.
+    lazy_max_age = {
+        'firmware_version': None,
+        'sync': None,
+    }
+    # Fields kept in snapshots with the response class of the value. None keeps a list of bytes.
+    state_fields = {
+        'firmware_version': None,
+        'sync': None,
+    }
 
     def __init__(self, key: bytearray, peripheral: Peripheral, conn_args: tuple, bt_attrs: DeviceBTAttrs):
         # Bluetooth config.
@@ -29,16 +52,30 @@ class RedmondDevice:
 
         self._is_auth = False  # Is authenticated to make requests.
         self._firmware_version = None  # Device firmware.
+        self._fetched_at = {}  # Update time of lazily fetched fields.
         self._key = key  # Key to auth.
         self._counter = 0  # Command counter. Used on every request.
         self._curr_cmd = None  # Last command requested.
         self._data = None  # Command response notification data.
+        self._waiting = False  # Whether a command response is awaited.
+        self.recorder = None  # Frame recorder to capture the traffic.
+        self.time_sync = None  # Time sync manager. Without it the time is synced once per session.
+        self.metrics = None  # Optional r4s.metrics.Metrics.
+        self._flight = SingleFlight()  # Coalesces concurrent identical reads.
+        self.lock = threading.RLock()  # Serializes the peripheral usage. DeviceManager shares it per MAC.
+        self.conn_updater = None  # Optional r4s.connection.ConnectionUpdater.
+        self.link_params = None  # Connection parameters accepted for the current link.
+        self._interactive_depth = 0  # Number of running interactive bursts.
+        self.mtu = DEFAULT_MTU  # ATT MTU of the current link.
 
         # Command handlers to update instance data.
         self._cmd_handlers = {
             CmdAuth.CODE: self.handler_cmd_auth,
             CmdFw.CODE: self.handler_cmd_fw,
+            CmdSync.CODE: self.handler_cmd_sync,
         }
+        # Handlers of notifications pushed by the device without request.
+        self._push_handlers = {}
 
     def __enter__(self):
         return self
@@ -51,87 +88,259 @@ class RedmondDevice:
 
     def connect(self):
         """Connects to a peripheral."""
-        self._peripheral.connect(*self._conn_args)
+        with self.lock:
+            self._peripheral.connect(*self._conn_args)
+
+    @property
+    def is_connected(self):
+        """Whether the device is connected and authenticated. A dropped link is noticed on the next command."""
+        return self._is_auth
 
     def disconnect(self):
         """Disconnects from a peripheral and sets related vars."""
         try:
-            self._is_auth = False
-            self._peripheral.disconnect()
+            with self.lock:
+                self._is_auth = False
+                self.start_session()
+                self._peripheral.disconnect()
         except AttributeError:
             # Sometimes called from __del__.
             pass
 
+    @property
+    def firmware_version(self):
+        return self._lazy('firmware_version', self.fetch_firmware)
+
+    def fetch_firmware(self):
+        self._flight.do(CmdFw.CODE, self.do_command, CmdFw())
+
+    def send_sync(self):
+        """Syncs device time with the host."""
+        cmd = CmdSync()
+        resp = self.do_command(cmd)
+        if not resp.err and self.time_sync is not None:
+            self.time_sync.record(self._conn_args[0], cmd.now, cmd.tmz)
+
+    def ensure_sync(self):
+        """Syncs device time if it may be inaccurate."""
+        if self.time_sync is not None:
+            if self.time_sync.needs_sync(self._conn_args[0]):
+                self.send_sync()
+        elif self.is_stale('sync'):
+            self.send_sync()
+
+    def start_session(self):
+        """Forgets the fields fetched once per session."""
+        for field, max_age in self.lazy_max_age.items():
+            if max_age is None:
+                self._fetched_at.pop(field, None)
+
+    def is_stale(self, field):
+        """Whether the lazily fetched field must be fetched again."""
+        fetched_at = self._fetched_at.get(field)
+        if fetched_at is None:
+            return True
+        max_age = self.lazy_max_age[field]
+        return max_age is not None and time.time() - fetched_at > max_age
+
+    def _lazy(self, field, fetch):
+        """Returns the field value, fetches it before if it's stale."""
+        if self.is_stale(field):
+            fetch()
+        return getattr(self, '_' + field)
+
+    def cached(self, field):
+        """Returns the last fetched value of the field without fetching or locking."""
+        return getattr(self, '_' + field)
+
+    def dump_state(self):
+        """Returns the fetched fields for a snapshot."""
+        return [FieldState(field, fetched_at, encode_value(getattr(self, '_' + field, None)))
+                for field, fetched_at in list(self._fetched_at.items()) if field in self.state_fields]
+
+    def owns_state(self, field):
+        """Whether the snapshot field is dumped and loaded by the device."""
+        return field in self.state_fields
+
+    def load_state(self, states):
+        """Restores fields of a snapshot. They are fresh or stale by the time they were fetched."""
+        for field, fetched_at, data in states:
+            if field not in self.state_fields:
+                continue
+            if hasattr(self, '_' + field):
+                setattr(self, '_' + field, decode_value(data, self.state_fields[field]))
+            self._fetched_at[field] = fetched_at
+
+    def _touch(self, field):
+        """Marks the field as fetched now."""
+        self._fetched_at[field] = time.time()
+
+    def idle_link_params(self) -> ConnParams:
+        """Connection parameters while the device is only polled. The device preference wins."""
+        if self.bt_attrs.conn_params:
+            return ConnParams(*self.bt_attrs.conn_params)
+        return PROFILE_IDLE
+
+    def set_link_params(self, params: ConnParams):
+        """Requests connection parameters. Returns whether they are in use."""
+        if self.conn_updater is None:
+            return False
+        with self.lock:
+            if params == self.link_params:
+                return True
+            if not self.conn_updater.update(self._conn_args[0], params):
+                return False
+            self.link_params = params
+            if self.metrics is not None:
+                # Only accepted requests are reported.
+                self.metrics.set_gauge(CONN_INTERVAL, self._conn_args[0], interval_seconds(params))
+        return True
+
+    @contextmanager
+    def interactive(self):
+        """Keeps a short connection interval for a burst of commands."""
+        with self.lock:
+            self._interactive_depth += 1
+            if self._interactive_depth == 1:
+                self.set_link_params(PROFILE_INTERACTIVE)
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._interactive_depth -= 1
+                if self._interactive_depth == 0:
+                    self.set_link_params(self.idle_link_params())
+
     def enable_notifications(self):
         """Sets client characteristics to receive notifications."""
         data = bytes(_GATT_ENABLE_NOTIFICATION)
-        self._write_handle(self.bt_attrs.ccc, data)
+        self._write_handle(self.bt_attrs.ccc, data, True)
 
     def try_auth(self):
-        if self._is_auth:
-            # Already authenticated.
-            return True
-        self._is_auth = False
-        self._counter = 0
-        self.enable_notifications()
-        self.do_command(CmdAuth(self._key))
-        if self._is_auth:
-            return True
-
-        return False
+        with self.lock:
+            if self._is_auth:
+                # Already authenticated.
+                return True
+            mac = self._conn_args[0]
+            with tracer.span('auth', mac=mac, model=self.bt_attrs.name) as span:
+                self._is_auth = False
+                self._counter = 0
+                with tracer.span('enable_notifications', mac=mac, model=self.bt_attrs.name):
+                    self.enable_notifications()
+                self.do_command(CmdAuth(self._key))
+                span.set('ok', self._is_auth)
+            if self._is_auth:
+                return True
+
+            return False
 
     def do_command(self, cmd):
         """Send request and handle response."""
         # TODO: Catch disconnect and try to reconnect.
-        resp = self._send_cmd(cmd)
-        if resp is None:
-            raise R4sUnexpectedResponse()
-        parsed = cmd.parse_resp(resp)
-        if cmd.CODE in self._cmd_handlers:
-            self._cmd_handlers[cmd.CODE](parsed)
-        return parsed
+        with self.lock:
+            with tracer.span('command', mac=self._conn_args[0], model=self.bt_attrs.name, cmd=type(cmd).__name__):
+                resp = self._send_cmd(cmd)
+            if resp is None:
+                raise R4sUnexpectedResponse()
+            parsed = cmd.parse_resp(resp)
+            if cmd.CODE in self._cmd_handlers:
+                self._cmd_handlers[cmd.CODE](parsed)
+            return parsed
 
     def do_commands(self, cmds: list):
         """Handle multiple commands."""
         for cmd in cmds:
             self.do_command(cmd)
 
-    def _write_handle(self, handle, data):
+    def _write_handle(self, handle, data, with_response=False):
         """Helper function send data to a peripheral."""
-        self._peripheral.writeCharacteristic(handle, data)
+        if self.recorder is not None:
+            self.recorder.record_write(self._conn_args[0], handle, data)
+        if self.metrics is not None:
+            self.metrics.observe_frame(DIRECTION_OUT, len(data))
+        if len(data) > self.mtu - 3:
+            _LOGGER.debug('Frame of %s bytes exceeds MTU %s.', len(data), self.mtu)
+        self._peripheral.writeCharacteristic(handle, data, with_response)
 
     def _send_cmd(self, cmd: RedmondCommand):
         """Send command and handle notification."""
         # Save cmd to compare on notification handle.
         self._curr_cmd = cmd
+        self._data = None
 
         # Write and wait for response in self.handleNotification.
-        self._write_handle(self.bt_attrs.cmd, cmd.wrapped(self._counter))
-        success = self._peripheral.waitForNotifications(1)
-
-        if not success or self._data is None:
+        self._waiting = True
+        started = time.perf_counter()
+        try:
+            self._write_handle(self.bt_attrs.cmd, cmd.wrapped(self._counter), cmd.write_with_response)
+            # The device may push notifications before the response.
+            while self._data is None:
+                if not self._peripheral.waitForNotifications(1):
+                    break
+        finally:
+            self._waiting = False
+
+        if self._data is None:
+            if self.metrics is not None:
+                self.metrics.inc(TIMEOUTS, self._conn_args[0])
             return None
+        if self.metrics is not None:
+            self.metrics.observe_latency(cmd.CODE, self._conn_args[0], time.perf_counter() - started)
 
         # Update counter on success.
         self._inc_counter()
 
         return self._data
 
+    def send_nowait(self, cmd: RedmondCommand):
+        """Sends command without waiting for the response.
+
+        The response is dropped when it arrives. Used to stream frames.
+        """
+        with self.lock:
+            self._push_handlers.setdefault(cmd.CODE, self._drop_notification)
+            self._write_handle(self.bt_attrs.cmd, cmd.wrapped(self._counter), cmd.write_with_response)
+            self._inc_counter()
+
+    def wait_for_push(self, timeout):
+        """Waits for notifications pushed by the device without request.
+
+        Returns True if a notification was handled.
+        """
+        with self.lock:
+            return self._peripheral.waitForNotifications(timeout)
+
     def handleNotification(self, handle, raw_data):
         """Gets called by the bluepy backend when using waitForNotifications."""
-        self._data = None
         if raw_data is None:
             return
-        _LOGGER.debug('Received result for cmd "%s" on handle %s: %s', type(self._curr_cmd).__name__,
-                      handle, self._format_bytes(raw_data))
+        if self.recorder is not None:
+            self.recorder.record_notify(self._conn_args[0], handle, raw_data)
+        if self.metrics is not None:
+            self.metrics.observe_frame(DIRECTION_IN, len(raw_data))
+        if _LOGGER.isEnabledFor(logging.DEBUG) and self.frame_log_sampler.sample():
+            _LOGGER.debug('Received result for cmd "%s" on handle %s: %s', LazyTypeName(self._curr_cmd),
+                          handle, LazyHex(raw_data))
 
         i, cmd, data = RedmondCommand.unwrap(raw_data)
-        if i != self._counter or self._curr_cmd.CODE != cmd:
-            # It is not the response for the request.
-            raise R4sUnexpectedResponse()
+        if self._waiting and i == self._counter and self._curr_cmd.CODE == cmd:
+            # Save data to process in parent callback.
+            self._data = data
+            return
 
-        # Save data to process in parent callback.
-        self._data = data
+        if cmd in self._push_handlers:
+            # The device notifies about its state on its own.
+            self._push_handlers[cmd](data)
+            return
+
+        # It is not the response for the request.
+        if self.metrics is not None:
+            self.metrics.inc(UNEXPECTED_RESPONSES, self._conn_args[0])
+        raise R4sUnexpectedResponse()
+
+    def _drop_notification(self, data):
+        """Push handler for responses nobody waits for."""
+        pass
 
     def handler_cmd_auth(self, resp: SuccessResponse):
         """Response handler for auth command."""
@@ -140,6 +349,12 @@ class RedmondDevice:
     def handler_cmd_fw(self, resp: VersionResponse):
         """Response handler for firmware command."""
         self._firmware_version = resp.version
+        self._touch('firmware_version')
+
+    def handler_cmd_sync(self, resp: ErrorResponse):
+        """Response handler for sync command."""
+        if not resp.err:
+            self._touch('sync')
 
     def _inc_counter(self):
         """Helper method for command counter."""
@@ -150,6 +365,4 @@ class RedmondDevice:
     @staticmethod
     def _format_bytes(raw_data):
         """Pretty print a byte array."""
-        if raw_data is None:
-            return 'None'
-        return ' '.join([format(c, "02x") for c in raw_data]).upper()
+        return str(LazyHex(raw_data))
@@ -1,13 +1,25 @@
+import asyncio
+import time
+
 from bluepy.btle import Peripheral
 
+from r4s import R4sCommandError
+from r4s.changes import StatusChangeDetector, StatusDelta
 from r4s.devices.base import RedmondDevice
 from r4s.discovery import DeviceBTAttrs
-from r4s.protocol.redmond.command.common import CmdFw, Cmd5SetProgram, Cmd3On, Cmd6Status, Cmd4Off, CmdSync
+from r4s.snapshot import FieldState, encode_value, decode_value
+from r4s.protocol.redmond.command.common import Cmd5SetProgram, Cmd3On, Cmd6Status, Cmd4Off
 from r4s.protocol.redmond.command.kettle import FullKettle200Program
+from r4s.protocol.redmond.command.lights import Cmd50SetLights, Cmd51GetLights
 from r4s.protocol.redmond.command.statistics import Cmd71StatsUsage, Cmd80StatsTimes
 from r4s.protocol.redmond.response.kettle import MODE_BOIL, BOIL_TEMP, BOIL_TIME_MAX, KettleResponse, Kettle200Response
+from r4s.protocol.redmond.response.lights import ColorSchemeResponse
 from r4s.protocol.redmond.response.statistics import TenInformationResponse, TurningOnCountResponse
 
+STATUS_POLL_INTERVAL = 60  # Seconds without pushed status before falling back to a status request.
+STATUS_MAX_AGE = 10  # Seconds the known status is used without a request.
+STATS_MAX_AGE = 3600  # Seconds the known statistics are used without a request.
+
 
 class RedmondKettle200(RedmondDevice):
     """"
@@ -15,35 +27,69 @@ class RedmondKettle200(RedmondDevice):
     """
 
     status_resp_cls = Kettle200Response
+    lazy_max_age = {
+        **RedmondDevice.lazy_max_age,
+        'status': STATUS_MAX_AGE,
+        'stats_ten': STATS_MAX_AGE,
+        'stats_times': STATS_MAX_AGE,
+    }
+    state_fields = {
+        **RedmondDevice.state_fields,
+        'status': Kettle200Response,
+        'stats_ten': TenInformationResponse,
+        'stats_times': TurningOnCountResponse,
+    }
 
     def __init__(self, key: bytearray, peripheral: Peripheral, conn_args: tuple, bt_attrs: DeviceBTAttrs):
         super().__init__(key, peripheral, conn_args, bt_attrs)
 
-        self.status = None
-        self.stats_ten = None
-        self.stats_times = None
+        self._status = None
+        self._stats_ten = None
+        self._stats_times = None
+        self.lights = {}  # Last known color scheme by light type.
+        self._lights_fetched_at = {}  # Time each scheme was read or written, by light type.
         self._cmd_handlers.update({
+            Cmd51GetLights.CODE: self.handler_cmd_51_lights,
             Cmd71StatsUsage.CODE: self.handler_cmd_71_stats,
             Cmd80StatsTimes.CODE: self.handler_cmd_80_stats,
             Cmd6Status.CODE: self.handler_cmd_6_status,
         })
+        self._push_handlers.update({
+            Cmd6Status.CODE: self.handler_push_6_status,
+        })
+        self._status_callbacks = []
+
+    @property
+    def status(self):
+        return self._lazy('status', self.fetch_status)
+
+    @property
+    def stats_ten(self):
+        return self._lazy('stats_ten', self.fetch_statistics)
+
+    @property
+    def stats_times(self):
+        return self._lazy('stats_times', self.fetch_statistics)
 
     def first_connect(self):
-        # Clear known.
-        self._firmware_version = None
-        self.status = None
-        self.stats_ten = None
+        """Starts a new session.
+
+        Nothing is requested here, the data is fetched on first access. See warm_up.
+        """
+        self.start_session()
 
+    def warm_up(self):
+        """Fetches all device data at once."""
         self.fetch_firmware()
-        self.send_sync()
+        self.ensure_sync()
         self.fetch_statistics()
         self.fetch_status()
 
     def set_mode(self, mode=MODE_BOIL, temp=BOIL_TEMP, boil_time=None):
         if boil_time is None:
             # Get status to get boil time.
-            self.fetch_status()
-            boil_time = self.status.boil_time if self.status else -BOIL_TIME_MAX
+            status = self.status
+            boil_time = status.boil_time if status else -BOIL_TIME_MAX
         # Set program.
         program = FullKettle200Program(mode, temp, boil_time)
         self.do_command(Cmd5SetProgram(program))
@@ -58,31 +104,140 @@ class RedmondKettle200(RedmondDevice):
         self.fetch_status()
 
     def fetch_status(self):
-        self.do_commands([
+        # Concurrent callers share one request.
+        self._flight.do(Cmd6Status.CODE, self.do_commands, [
             Cmd6Status(self.status_resp_cls),
         ])
 
-    def send_sync(self):
-        self.do_command(CmdSync())
+    def subscribe_status(self, callback):
+        """Registers a callback called with every new status.
+
+        Returns a function to cancel the subscription.
+        """
+        self._status_callbacks.append(callback)
+
+        def unsubscribe():
+            if callback in self._status_callbacks:
+                self._status_callbacks.remove(callback)
+
+        return unsubscribe
+
+    def subscribe_changes(self, callback, deadbands=None):
+        """Registers a callback called with StatusDelta only when status fields change.
+
+        Deadbands map fields to ignored jitter, see r4s.changes.DEFAULT_DEADBANDS.
+        Returns a function to cancel the subscription.
+        """
+        detector = StatusChangeDetector(deadbands)
+        mac = self._conn_args[0]
+
+        def on_status(status):
+            changes = detector.update(status)
+            if changes:
+                callback(StatusDelta(mac, changes))
 
-    def fetch_firmware(self):
-        self.do_command(CmdFw())
+        return self.subscribe_status(on_status)
+
+    def watch_status(self, duration, poll_interval=STATUS_POLL_INTERVAL, listen_timeout=1.0):
+        """Listens to pushed statuses for duration seconds.
+
+        The status is requested only if the device didn't push anything for poll_interval seconds.
+        """
+        deadline = time.monotonic() + duration
+        last_update = time.monotonic()
+        while time.monotonic() < deadline:
+            if self.wait_for_push(min(listen_timeout, max(deadline - time.monotonic(), 0))):
+                last_update = time.monotonic()
+            elif time.monotonic() - last_update >= poll_interval:
+                self.fetch_status()
+                last_update = time.monotonic()
+
+    async def status_updates(self, poll_interval=STATUS_POLL_INTERVAL, listen_timeout=1.0):
+        """Async iterator over statuses pushed by the device.
+
+        The status is requested only if the device didn't push anything for poll_interval seconds.
+        """
+        loop = asyncio.get_event_loop()
+        updates = []
+        unsubscribe = self.subscribe_status(updates.append)
+        last_update = time.monotonic()
+        try:
+            while True:
+                if not updates:
+                    await loop.run_in_executor(None, self.wait_for_push, listen_timeout)
+                if not updates and time.monotonic() - last_update >= poll_interval:
+                    await loop.run_in_executor(None, self.fetch_status)
+                while updates:
+                    last_update = time.monotonic()
+                    yield updates.pop(0)
+        finally:
+            unsubscribe()
 
     def fetch_statistics(self):
         cmds = [
             Cmd71StatsUsage(),
             Cmd80StatsTimes(),
         ]
-        self.do_commands(cmds)
+        self._flight.do(Cmd71StatsUsage.CODE, self.do_commands, cmds)
+
+    def fetch_lights(self, light_type):
+        return self.do_command(Cmd51GetLights(light_type))
+
+    def set_lights(self, light_type, colors):
+        """Sets the palette of the light.
+
+        Colors are 3 stops of (percent, brightness, red, green, blue).
+        The write is skipped if the palette is already set. Returns whether the palette was written.
+        """
+        scheme = ColorSchemeResponse(light_type, *colors)
+        if self.lights.get(light_type) == scheme:
+            return False
+        resp = self.do_command(Cmd50SetLights(light_type, scheme))
+        if resp.err:
+            self.lights.pop(light_type, None)
+            self._lights_fetched_at.pop(light_type, None)
+            raise R4sCommandError('Failed to set lights {}: {}'.format(light_type, resp.err))
+        self._set_scheme(scheme)
+        return True
+
+    def dump_state(self):
+        """Returns the fetched fields and the known color schemes for a snapshot."""
+        return super().dump_state() + [FieldState('lights', self._lights_fetched_at[light_type], encode_value(scheme))
+                                       for light_type, scheme in list(self.lights.items())]
+
+    def owns_state(self, field):
+        return field == 'lights' or super().owns_state(field)
+
+    def load_state(self, states):
+        super().load_state(states)
+        for field, fetched_at, data in states:
+            if field == 'lights':
+                self._set_scheme(decode_value(data, ColorSchemeResponse), fetched_at)
+
+    def _set_scheme(self, scheme: ColorSchemeResponse, fetched_at=None):
+        """Caches the color scheme of a light with the time it was known to be set."""
+        self.lights[scheme.id] = scheme
+        self._lights_fetched_at[scheme.id] = time.time() if fetched_at is None else fetched_at
+
+    def handler_cmd_51_lights(self, resp: ColorSchemeResponse):
+        self._set_scheme(resp)
 
     def handler_cmd_71_stats(self, resp: TenInformationResponse):
-        self.stats_ten = resp
+        self._stats_ten = resp
+        self._touch('stats_ten')
 
     def handler_cmd_80_stats(self, resp: TurningOnCountResponse):
-        self.stats_times = resp
+        self._stats_times = resp
+        self._touch('stats_times')
 
     def handler_cmd_6_status(self, resp: KettleResponse):
-        self.status = resp
+        self._status = resp
+        self._touch('status')
+        for callback in list(self._status_callbacks):
+            callback(resp)
+
+    def handler_push_6_status(self, data):
+        self.handler_cmd_6_status(self.status_resp_cls.from_bytes(data))
 
 
 kettles = {
@@ -3,6 +3,8 @@ import yaml
 from bluepy.btle import Peripheral, UUID
 
 from r4s import UnsupportedDeviceException
+from r4s.connection import conn_params_from_bytes
+from r4s.tracing import tracer
 
 UUID_SRV_R4S = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"  # GATT Service Custom: R4S custom service.
 UUID_SRV_GENERIC = 0x1800  # GATT Service: Generic Access.
@@ -17,11 +19,13 @@ UUID_CHAR_RSP = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"  # GATT Characteristics C
 class DeviceBTAttrs:
     """Device bluetooth attributes container."""
 
-    def __init__(self, name=None, cmd=None, ccc=None, unsupported=False):
+    def __init__(self, name=None, cmd=None, ccc=None, unsupported=False, conn_params=None):
         self.name = name
         self.ccc = ccc
         self.cmd = cmd
         self.unsupported = unsupported
+        # Preferred connection parameters, list of 4 ints. Empty if the device has none, None if not read yet.
+        self.conn_params = conn_params
 
     def is_complete(self):
         """Whether the instance has all required fields."""
@@ -35,6 +39,7 @@ class DeviceBTAttrs:
             'ccc': self.ccc,
             'cmd': self.cmd,
             'unsupported': self.unsupported,
+            'conn_params': self.conn_params,
         }
 
     def get_class(self):
@@ -69,7 +74,9 @@ class DeviceDiscovery:
         if mac not in self._discovered:
             self._discovered[mac] = DeviceBTAttrs()
 
-        self._discover_device(self._discovered[mac], peripheral)
+        with tracer.span('discover', mac=mac) as span:
+            self._discover_device(self._discovered[mac], peripheral)
+            span.set('model', self._discovered[mac].name)
         # This section is reached only if previous didn't raise any errors.
         self._on_success(mac, self._discovered[mac])
 
@@ -98,18 +105,28 @@ class DeviceDiscovery:
 
         r4s_service = services[UUID(UUID_SRV_R4S)]
         generic_srv = services[UUID(UUID_SRV_GENERIC)]
+        # Services keep the unwrapped peripheral, the requests are made on the given one to keep watchdog limits.
         # Main characteristics.
         if attrs.name is None:
-            device_name_char = generic_srv.getCharacteristics(UUID_CHAR_GENERIC)[0]
+            device_name_char = peripheral.getCharacteristics(generic_srv.hndStart, generic_srv.hndEnd,
+                                                             uuid=UUID_CHAR_GENERIC)[0]
             # Generic params.
             attrs.name = peripheral.readCharacteristic(device_name_char.valHandle).decode("utf-8")
+        if attrs.conn_params is None:
+            # The characteristic is optional, its absence is remembered too.
+            conn_chars = peripheral.getCharacteristics(generic_srv.hndStart, generic_srv.hndEnd, uuid=UUID_CHAR_CONN)
+            attrs.conn_params = []
+            if conn_chars:
+                attrs.conn_params = list(conn_params_from_bytes(peripheral.readCharacteristic(conn_chars[0].valHandle)))
 
         # R4S characteristics.
         if attrs.cmd is None:
-            cmd_char = r4s_service.getCharacteristics(UUID_CHAR_CMD)[0]
+            cmd_char = peripheral.getCharacteristics(r4s_service.hndStart, r4s_service.hndEnd, uuid=UUID_CHAR_CMD)[0]
             attrs.cmd = cmd_char.valHandle
         if attrs.ccc is None:
-            cccd = r4s_service.getDescriptors(UUID_CCCD)[0]
+            # The descriptors are not filtered by the peripheral. The service declaration is skipped like in bluepy.
+            cccd = [desc for desc in peripheral.getDescriptors(r4s_service.hndStart + 1, r4s_service.hndEnd)
+                    if desc.uuid == UUID(UUID_CCCD)][0]
             attrs.ccc = cccd.handle
 
 
@@ -0,0 +1,161 @@
+"""Energy accounting from cumulative TEN statistics.
+
+Counter samples of the fleet are kept in NumPy columns. Consumption is computed per interval
+between consecutive samples of a device and aggregated by device, model and time bucket.
+"""
+import threading
+
+import numpy as np
+
+from r4s.collector import counter_increase
+
+BY_DEVICE = 'device'
+BY_MODEL = 'model'
+BUCKET_MONTH = 'month'
+BUCKET_DAY = 86400
+
+_COLUMNS = (('device', np.int32), ('model', np.int32), ('timestamp', np.int64),
+            ('spent_power', np.int64), ('work_time', np.int64))
+
+
+class EnergyLedger:
+    """Columnar store of counter samples with fleet aggregates.
+
+    Wraparounds and resets of the counters are told apart by r4s.collector.counter_increase.
+    """
+
+    def __init__(self, capacity=1024):
+        self.macs = []  # Device index to MAC.
+        self.models = []  # Model index to name.
+        self._mac_index = {}
+        self._model_index = {}
+        self._size = 0
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in _COLUMNS}
+        self._intervals = None  # Cached result of intervals().
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, mac, model, timestamp, spent_power, work_time):
+        """Adds a counter sample of a device."""
+        with self._lock:
+            if self._size == len(self._columns['timestamp']):
+                self._grow()
+            row = self._size
+            columns = self._columns
+            columns['device'][row] = self._index(self._mac_index, self.macs, mac)
+            columns['model'][row] = self._index(self._model_index, self.models, model)
+            columns['timestamp'][row] = timestamp
+            columns['spent_power'][row] = spent_power
+            columns['work_time'][row] = work_time
+            self._size += 1
+            self._intervals = None
+
+    def add_response(self, mac, model, timestamp, stats_ten):
+        """Adds a sample from TenInformationResponse."""
+        self.add(mac, model, timestamp, stats_ten.spent_power, stats_ten.work_time)
+
+    def add_store(self, store, mac, model, start=None, end=None):
+        """Adds the samples of a device from r4s.collector.StatisticsStore."""
+        columns = store.query(mac, start, end)
+        for timestamp, spent_power, work_time in zip(columns['timestamp'], columns['spent_power'],
+                                                     columns['work_time']):
+            self.add(mac, model, timestamp, spent_power, work_time)
+
+    def intervals(self):
+        """Returns consumption between consecutive samples of every device as columns.
+
+        Columns are device and model indexes, start and end timestamps, spent_power and work_time.
+        """
+        with self._lock:
+            if self._intervals is None:
+                self._intervals = self._compute_intervals()
+            return self._intervals
+
+    def aggregate(self, by=BY_DEVICE, bucket=None, start=None, end=None):
+        """Sums consumption of intervals ending in [start, end).
+
+        Groups by device MAC, model name or nothing if by is None, and by bucket of the interval end:
+        a number of seconds or BUCKET_MONTH. Keys are the group, the bucket start or a tuple of both.
+        Values are dicts of spent_power, work_time and the number of intervals.
+        """
+        intervals = self.intervals()
+        selected = np.ones(len(intervals['end']), dtype=bool)
+        if start is not None:
+            selected &= intervals['end'] >= start
+        if end is not None:
+            selected &= intervals['end'] < end
+
+        keys = []
+        labels = []
+        if by is not None:
+            groups = intervals[by][selected]
+            keys.append(groups)
+            labels.append(self.macs if by == BY_DEVICE else self.models)
+        if bucket is not None:
+            keys.append(self._buckets(intervals['end'][selected], bucket))
+            labels.append(None)
+        if not keys:
+            keys.append(np.zeros(selected.sum(), dtype=np.int64))
+            labels.append(None)
+
+        stacked = np.stack(keys, axis=1)
+        unique, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        sums = {name: np.bincount(inverse, weights=intervals[name][selected], minlength=len(unique))
+                for name in ('spent_power', 'work_time')}
+        counts = np.bincount(inverse, minlength=len(unique))
+
+        result = {}
+        for i, key in enumerate(unique):
+            key = tuple(int(value) if names is None else names[value] for value, names in zip(key, labels))
+            if by is None and bucket is None:
+                key = None
+            elif len(key) == 1:
+                key = key[0]
+            result[key] = {
+                'spent_power': int(sums['spent_power'][i]),
+                'work_time': int(sums['work_time'][i]),
+                'intervals': int(counts[i]),
+            }
+        return result
+
+    def _compute_intervals(self):
+        size = self._size
+        columns = {name: values[:size] for name, values in self._columns.items()}
+        order = np.lexsort((columns['timestamp'], columns['device']))
+        device = columns['device'][order]
+        same = device[1:] == device[:-1]
+        result = {
+            'device': device[1:][same],
+            'model': columns['model'][order][1:][same],
+            'start': columns['timestamp'][order][:-1][same],
+            'end': columns['timestamp'][order][1:][same],
+        }
+        for name in ('spent_power', 'work_time'):
+            values = columns[name][order]
+            result[name] = counter_increase(values[:-1], values[1:])[same]
+        return result
+
+    @staticmethod
+    def _buckets(timestamps, bucket):
+        """Returns bucket start timestamps."""
+        if bucket == BUCKET_MONTH:
+            months = timestamps.astype('datetime64[s]').astype('datetime64[M]')
+            return months.astype('datetime64[s]').astype(np.int64)
+        return timestamps - timestamps % bucket
+
+    @staticmethod
+    def _index(indexes, names, name):
+        index = indexes.get(name)
+        if index is None:
+            index = indexes[name] = len(names)
+            names.append(name)
+        return index
+
+    def _grow(self):
+        for name, values in self._columns.items():
+            grown = np.zeros(len(values) * 2, dtype=values.dtype)
+            grown[:len(values)] = values
+            self._columns[name] = grown
@@ -0,0 +1,128 @@
+"""Boil ETA estimation from status samples.
+
+Recent temperature samples of every heating kettle are kept in fixed size rows of NumPy arrays.
+The heating curve is fitted by least squares over the row window, so the fit follows the curve
+as heating slows down near the target. All devices are fitted at once.
+"""
+import threading
+import time
+
+import numpy as np
+
+from r4s.protocol.redmond.response.kettle import KettleResponse, MODE_BOIL, MODE_HEAT, STATE_ON
+
+BOIL_POINT = 100  # Celsius degrees reached in boil mode.
+WINDOW = 8  # Samples per device used by the fit.
+MIN_SAMPLES = 3  # Samples required for an estimate.
+MIN_RATE = 0.01  # Celsius degrees per second, slower heating has no estimate.
+
+
+class BoilEtaEstimator:
+    """Predicts when heating kettles reach their target temperature."""
+
+    def __init__(self, window=WINDOW, capacity=64):
+        self.window = window
+        self._rows = {}  # MAC to row index.
+        self._times = np.full((capacity, window), np.nan)
+        self._temps = np.full((capacity, window), np.nan)
+        self._targets = np.full(capacity, np.nan)
+        self._next = np.zeros(capacity, dtype=np.int64)  # Next sample slot of the row.
+        self._lock = threading.Lock()
+
+    def track(self, kettle):
+        """Feeds statuses of a kettle. Returns a function to stop it."""
+        mac = kettle._conn_args[0]
+        return kettle.subscribe_status(lambda status: self.add(mac, status))
+
+    def add(self, mac, status: KettleResponse, timestamp=None):
+        """Adds a status sample. A kettle which doesn't heat is forgotten."""
+        if timestamp is None:
+            timestamp = time.time()
+        target = self._target(status)
+        with self._lock:
+            row = self._row(mac)
+            if target is None or target != self._targets[row]:
+                # Heating started, stopped or the target changed.
+                self._times[row] = np.nan
+                self._temps[row] = np.nan
+                self._targets[row] = np.nan if target is None else target
+                self._next[row] = 0
+            if target is None:
+                return
+            slot = self._next[row] % self.window
+            self._times[row, slot] = timestamp
+            self._temps[row, slot] = status.curr_temp
+            self._next[row] += 1
+
+    def estimate(self, macs=None) -> dict:
+        """Returns MAC to the predicted timestamp of reaching the target for devices with an estimate."""
+        with self._lock:
+            if macs is None:
+                macs = list(self._rows)
+            rows = np.array([self._rows[mac] for mac in macs if mac in self._rows], dtype=np.int64)
+            macs = [mac for mac in macs if mac in self._rows]
+            done_at = self._fit(self._times[rows], self._temps[rows], self._targets[rows])
+        return {mac: float(value) for mac, value in zip(macs, done_at) if not np.isnan(value)}
+
+    def eta(self, mac, now=None):
+        """Returns seconds left to reach the target or None."""
+        done_at = self.estimate([mac]).get(mac)
+        if done_at is None:
+            return None
+        return max(done_at - (time.time() if now is None else now), 0.0)
+
+    def next_poll_delay(self, mac, default=5.0, min_delay=1.0, max_delay=60.0, now=None):
+        """Seconds to the next status read, close to the predicted completion."""
+        eta = self.eta(mac, now)
+        if eta is None:
+            return default
+        return min(max(eta, min_delay), max_delay)
+
+    @staticmethod
+    def _fit(times, temps, targets):
+        """Fits lines to rows of samples. Returns predicted timestamps, NaN without an estimate."""
+        mask = ~np.isnan(times)
+        count = mask.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Time relative to the last sample keeps the numbers small.
+            last = np.nanmax(np.where(mask, times, -np.inf), axis=1)
+            t = np.where(mask, times - last[:, None], 0.0)
+            y = np.where(mask, temps, 0.0)
+            mean_t = t.sum(axis=1) / count
+            mean_y = y.sum(axis=1) / count
+            dt = np.where(mask, t - mean_t[:, None], 0.0)
+            dy = np.where(mask, y - mean_y[:, None], 0.0)
+            rate = (dt * dy).sum(axis=1) / (dt * dt).sum(axis=1)
+            current = mean_y - rate * mean_t  # Fitted temperature at the last sample.
+            done_at = last + np.maximum(targets - current, 0.0) / rate
+        valid = (count >= MIN_SAMPLES) & (rate > MIN_RATE)
+        return np.where(valid, done_at, np.nan)
+
+    @staticmethod
+    def _target(status):
+        if status.state != STATE_ON:
+            return None
+        if status.program == MODE_BOIL:
+            return BOIL_POINT
+        if status.program == MODE_HEAT:
+            return status.trg_temp
+        return None
+
+    def _row(self, mac):
+        """Provides the row of a device. Must be called under the lock."""
+        row = self._rows.get(mac)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self._targets):
+                self._grow()
+            self._rows[mac] = row
+        return row
+
+    def _grow(self):
+        capacity = len(self._targets) * 2
+        self._times = np.resize(self._times, (capacity, self.window))
+        self._temps = np.resize(self._temps, (capacity, self.window))
+        self._times[capacity // 2:] = np.nan
+        self._temps[capacity // 2:] = np.nan
+        self._targets = np.concatenate([self._targets, np.full(capacity // 2, np.nan)])
+        self._next = np.concatenate([self._next, np.zeros(capacity // 2, dtype=np.int64)])
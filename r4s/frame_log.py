@@ -0,0 +1,38 @@
+"""Helpers to log frames without formatting cost when the record is not emitted."""
+import itertools
+
+
+class LazyHex:
+    """Formats a byte array as hex only when converted to a string."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        if self.data is None:
+            return 'None'
+        return bytes(self.data).hex(' ').upper()
+
+
+class LazyTypeName:
+    """Returns the type name of an object only when converted to a string."""
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return type(self.obj).__name__
+
+
+class FrameLogSampler:
+    """Lets through every n-th frame. Used to log high volume traffic."""
+
+    def __init__(self, every=1):
+        self.every = every
+        self._counter = itertools.count()
+
+    def sample(self):
+        """Whether the current frame must be logged."""
+        return self.every == 1 or next(self._counter) % self.every == 0
@@ -0,0 +1,151 @@
+"""Journal of intents for devices out of range.
+
+Intents are merged per device like in the reconciler and delivered as one batch on the next connection.
+"""
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from r4s.protocol.redmond.response.kettle import MODE_BOIL, BOIL_TEMP, KettleResponse
+from r4s.reconciler import Kettle200Reconciler
+
+_LOGGER = logging.getLogger(__name__)
+
+INTENT_TTL = 3600  # Seconds an intent waits for the device.
+
+
+class CommandJournal:
+    """Keeps pending intents per MAC with expiry.
+
+    A newer intent supersedes the older one for the same fields.
+    The implementation stores the intents in memory, inherit the class to persist them.
+    """
+
+    def __init__(self, ttl=INTENT_TTL):
+        self.ttl = ttl
+        self._intents = {}  # MAC to field to (value, expiry timestamp).
+        self._lock = threading.Lock()
+
+    def switch_on(self, mac, ttl=None):
+        self.record(mac, {'on': True}, ttl)
+
+    def switch_off(self, mac, ttl=None):
+        self.record(mac, {'on': False}, ttl)
+
+    def set_mode(self, mac, mode=MODE_BOIL, temp=BOIL_TEMP, boil_time=None, ttl=None):
+        """Requests the program. The boil time is kept if not specified."""
+        if not KettleResponse.is_allowed_temp(mode, temp):
+            raise ValueError('Incorrect temp')
+        desired = {'program': mode, 'trg_temp': temp}
+        if boil_time is not None:
+            desired['boil_time'] = boil_time
+        with self._lock:
+            if boil_time is None:
+                self._intents.get(mac, {}).pop('boil_time', None)
+        self.record(mac, desired, ttl)
+
+    def record(self, mac, desired: dict, ttl=None):
+        """Merges target fields of a device."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            intents = self._intents.setdefault(mac, {})
+            for field, value in desired.items():
+                intents[field] = (value, expires_at)
+        self._on_change()
+
+    def pending(self, mac, now=None) -> dict:
+        """Returns not expired target fields of a device."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return {field: value for field, (value, expires_at) in self._intents.get(mac, {}).items()
+                    if expires_at > now}
+
+    def has_pending(self, mac):
+        return bool(self.pending(mac))
+
+    def discard(self, mac):
+        """Forgets intents of a device."""
+        with self._lock:
+            removed = self._intents.pop(mac, None)
+        if removed:
+            self._on_change()
+
+    @staticmethod
+    def supports(device):
+        """Whether intents can be delivered to the device."""
+        from r4s.devices.kettles import RedmondKettle200
+        return isinstance(device, RedmondKettle200)
+
+    def flush(self, kettle):
+        """Delivers pending intents to a connected kettle as one batch.
+
+        Returns the list of sent commands. Failed intents are kept unless newer ones were recorded.
+        """
+        mac = kettle._conn_args[0]
+        with self._lock:
+            intents = self._intents.pop(mac, {})
+        now = time.time()
+        desired = {field: value for field, (value, expires_at) in intents.items() if expires_at > now}
+        if not intents:
+            return []
+        self._on_change()
+        if not desired:
+            return []
+
+        reconciler = Kettle200Reconciler(kettle)
+        reconciler.apply(desired)
+        try:
+            cmds = reconciler.flush()
+        except Exception:
+            with self._lock:
+                current = self._intents.setdefault(mac, {})
+                for field, intent in intents.items():
+                    current.setdefault(field, intent)
+            self._on_change()
+            raise
+        _LOGGER.debug('Delivered %s journaled commands to %s.', len(cmds), mac)
+        return cmds
+
+    def _on_change(self):
+        """Callback function when the intents were changed."""
+        pass
+
+    def as_dict(self):
+        """Casts the instance to a dict."""
+        with self._lock:
+            return {mac: {field: {'value': value, 'expires_at': expires_at}
+                          for field, (value, expires_at) in intents.items()}
+                    for mac, intents in self._intents.items() if intents}
+
+
+class CommandJournalYml(CommandJournal):
+    """Command journal with yml storage."""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        self._write_lock = threading.Lock()
+        try:
+            with open(self.filename, 'r') as stream:
+                config = yaml.safe_load(stream) or {}
+                for mac, intents in config.items():
+                    self._intents[mac] = {field: (intent['value'], intent['expires_at'])
+                                          for field, intent in intents.items()}
+        except FileNotFoundError:
+            pass
+
+    def _on_change(self):
+        """Rewrite the whole file on every change.
+
+        Writes are serialized and each one takes the latest intents, so a slower writer can't store older ones.
+        The file is replaced at once and never partial.
+        """
+        tmp = self.filename + '.tmp'
+        with self._write_lock:
+            with open(tmp, 'w') as stream:
+                yaml.safe_dump(self.as_dict(), stream)
+            os.replace(tmp, self.filename)
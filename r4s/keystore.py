@@ -0,0 +1,79 @@
+import os
+import threading
+
+import yaml
+
+KEY_SIZE = 8
+
+
+def generate_key():
+    """Returns a new random auth key."""
+    return list(os.urandom(KEY_SIZE))
+
+
+class KeyStore:
+    """Keeps auth keys per device MAC.
+
+    A device without a key gets a random one, it's recorded when the device accepts it.
+    The implementation stores the keys in memory, inherit the class to persist them.
+    """
+
+    def __init__(self):
+        self._keys = {}  # MAC to accepted key.
+        self._pending = {}  # MAC to generated key not accepted yet.
+
+    def get(self, mac):
+        """Returns the accepted key of a device or None."""
+        return self._keys.get(mac)
+
+    def key_for(self, mac):
+        """Returns the accepted key or the key to pair the device with."""
+        key = self._keys.get(mac)
+        if key is None:
+            key = self._pending.setdefault(mac, generate_key())
+        return key
+
+    def record(self, mac, key):
+        """Saves the key accepted by a device."""
+        key = list(key)
+        self._pending.pop(mac, None)
+        if self._keys.get(mac) == key:
+            return
+        self._keys[mac] = key
+        self._on_record(mac)
+
+    def _on_record(self, mac):
+        """Callback function when a key was recorded."""
+        pass
+
+    def as_dict(self):
+        """Casts the instance to a dict with hex keys."""
+        return {mac: bytes(key).hex() for mac, key in list(self._keys.items())}
+
+
+class KeyStoreYml(KeyStore):
+    """Key store with yml storage. The file is readable by the owner only."""
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self._lock = threading.Lock()
+        try:
+            with open(self.filename, 'r') as stream:
+                config = yaml.safe_load(stream) or {}
+                for mac, key in config.items():
+                    self._keys[mac] = list(bytes.fromhex(key))
+        except FileNotFoundError:
+            pass
+
+    def _on_record(self, mac):
+        """Rewrite the whole file on every new key.
+
+        The keys are written to a temporary file which replaces the old one, so the file is never partial.
+        """
+        tmp = self.filename + '.tmp'
+        with self._lock:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w') as stream:
+                yaml.safe_dump(self.as_dict(), stream)
+            os.replace(tmp, self.filename)
@@ -1,4 +1,5 @@
 import asyncio
+import threading
 
 try:
     from bluepy.btle import Peripheral, ADDR_TYPE_RANDOM, BTLEException, BTLEDisconnectError
@@ -6,20 +7,38 @@ except ImportError:
     from r4s.test.bluepy_helper import ADDR_TYPE_RANDOM, BTLEException, BTLEDisconnectError
     from r4s.test.peripherals.base import MockPeripheral as Peripheral
 
+from r4s.connection import ConnectionUpdater, DEFAULT_MTU, MAX_MTU
 from r4s.discovery import DeviceDiscovery
-from r4s import UnsupportedDeviceException, R4sAuthFailed
+from r4s.journal import CommandJournal
+from r4s.keystore import KeyStore
+from r4s.timesync import TimeSyncManager
+from r4s.command_queue import CommandQueue, MAX_DEPTH
+from r4s.singleflight import SingleFlight, AsyncSingleFlight
+from r4s.tracing import tracer
+from r4s.watchdog import Watchdog
+from r4s import UnsupportedDeviceException, R4sAuthFailed, R4sUnexpectedResponse, R4sWatchdogTimeout
+from r4s.metrics import Metrics, AUTH_FAILURES, CONNECTS, RECONNECTS
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
 
-# TODO: Make it Singleton.
+# One instance can be shared by processes with r4s.broker.
 class DeviceManager:
-    """Discovers a device and provides a connection if it's known."""
+    """Discovers a device and provides a connection if it's known.
+
+    Connections of one MAC are serialized by a per-MAC lock shared with the device,
+    different devices are used in parallel.
+    A device authenticates with its key from the key store, else with the common key.
+    Without the common key a random key is generated for every new device, see pair_devices.
+    """
     _retry_i = 0
 
-    def __init__(self, key, discovery: DeviceDiscovery, iface=0, ble_timeout=3, retries=10):
-        if len(key) != 8:
+    def __init__(self, key, discovery: DeviceDiscovery, iface=0, ble_timeout=3, retries=10, recorder=None,
+                 time_sync: TimeSyncManager = None, metrics: Metrics = None, snapshot: dict = None,
+                 keystore: KeyStore = None, conn_updater: ConnectionUpdater = None, mtu=MAX_MTU,
+                 journal: CommandJournal = None, watchdog: Watchdog = None):
+        if key is not None and len(key) != 8:
             raise ValueError('Invalid key')
         self._discovery = discovery
         self._devices = {}
@@ -27,20 +46,140 @@ class DeviceManager:
         self._retries = retries
         self._addr_type = ADDR_TYPE_RANDOM
         self._iface = iface
-        # TODO: Make it random on first run.
-        self._key = key
-        # TODO: Add lock on Mac.
+        self._recorder = recorder  # Optional r4s.capture.FrameRecorder.
+        self._time_sync = time_sync if time_sync is not None else TimeSyncManager()
+        self._metrics = metrics
+        self._conn_updater = conn_updater
+        self._mtu = mtu  # ATT MTU to request on connect, None keeps the default.
+        self._journal = journal  # Intents delivered on the next connection.
+        self._watchdog = watchdog  # Limits of peripheral operations.
+        self._connect_flight = SingleFlight()
+        self._async_connect_flight = AsyncSingleFlight()
+        self._queues = {}
+        self._snapshot = dict(snapshot or {})  # MAC to field states restored on device creation.
+        self._locks = {}  # MAC to RLock.
+        self._locks_lock = threading.Lock()
+        self._key = key  # Common key of devices missing in the key store.
+        self._keystore = keystore if keystore is not None else KeyStore()
 
     def connect(self, mac):
-        """Provides connection to a device."""
-        coro = asyncio.coroutine(self.async_connect)
-        future = coro(mac)
+        """Provides connection to a device.
+
+        Concurrent calls for the same device share one connection attempt.
+        """
+        return self._connect_flight.do(mac, self._run_connect, mac)
+
+    def queue(self, mac, max_depth=MAX_DEPTH) -> CommandQueue:
+        """Provides the prioritized command queue of a device, connects if needed."""
+        if mac not in self._queues:
+            device = self.connect(mac)
+            with self._lock(mac):
+                if mac not in self._queues:
+                    self._queues[mac] = CommandQueue(device, max_depth)
+        return self._queues[mac]
+
+    def dump_state(self):
+        """Returns field states by MAC for r4s.snapshot, including restored but not connected devices.
+
+        Restored fields not owned by a device class are returned as restored. Their owners replace them
+        with r4s.snapshot.merge_fields.
+        """
+        states = dict(self._snapshot)
+        for mac, device in list(self._devices.items()):
+            states[mac] = device.dump_state() + [state for state in states.get(mac, [])
+                                                 if not device.owns_state(state.field)]
+        return states
+
+    def get_cached(self, mac):
+        """Returns the connected device or None without locking or connecting."""
+        return self._devices.get(mac)
+
+    def _lock(self, mac):
+        """Provides the lock of a MAC."""
+        lock = self._locks.get(mac)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(mac, threading.RLock())
+        return lock
+
+    async def pair_devices(self, macs, timeout=60, interval=0.5):
+        """Pairs devices in parallel with keys of the key store.
+
+        Every device is asked to auth each interval seconds until it's paired or the timeout expires,
+        so a device is paired right after its pairing mode is turned on.
+        Returns MAC to the accepted key, None if the device wasn't paired.
+        """
+        keys = await asyncio.gather(*[self._pair_device(mac, timeout, interval) for mac in macs])
+        return dict(zip(macs, keys))
+
+    async def _pair_device(self, mac, timeout, interval):
         loop = asyncio.get_event_loop()
-        return loop.run_until_complete(future)
+        deadline = loop.time() + timeout
+        peripheral = self._new_peripheral()
+        attempt = 0
+        while True:
+            attempt += 1
+            key = self._keystore.key_for(mac)
+            try:
+                device, _ = await loop.run_in_executor(None, self._do_connect, peripheral, mac, attempt, key, True)
+            except UnsupportedDeviceException:
+                return None
+            if device is not None:
+                self._devices[mac] = device
+                return device._key
+            if loop.time() + interval > deadline:
+                _LOGGER.debug('Device %s was not paired in %s seconds.', mac, timeout)
+                return None
+            await asyncio.sleep(interval)
 
-    async def async_connect(self, mac):
-        """Provides connection to a device in async way."""
+    def _new_peripheral(self):
+        """Creates a peripheral, guarded by the watchdog if it's set."""
         peripheral = Peripheral()
+        if self._watchdog is not None:
+            peripheral = self._watchdog.wrap(peripheral)
+        return peripheral
+
+    def _key_for(self, mac):
+        """Provides the auth key of a device."""
+        key = self._keystore.get(mac)
+        if key is None:
+            key = self._key if self._key is not None else self._keystore.key_for(mac)
+        return key
+
+    def _negotiate_mtu(self, peripheral):
+        """Requests larger ATT MTU. Returns the MTU of the link."""
+        if self._mtu is None:
+            return DEFAULT_MTU
+        try:
+            resp = peripheral.setMTU(self._mtu)
+        except BTLEException:
+            _LOGGER.debug('MTU exchange failed, using default %s.', DEFAULT_MTU)
+            return DEFAULT_MTU
+        # The response of bluepy helper reports the agreed MTU.
+        mtu = resp.get('mtu') if isinstance(resp, dict) else None
+        return mtu[0] if mtu else self._mtu
+
+    def _run_connect(self, mac):
+        """Runs async connection in the event loop of the thread."""
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            # Not the main thread.
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        return loop.run_until_complete(self.async_connect(mac))
+
+    async def async_connect(self, mac):
+        """Provides connection to a device in async way.
+
+        Concurrent calls for the same device share one connection attempt.
+        """
+        return await self._async_connect_flight.do(mac, self._async_connect, mac)
+
+    async def _async_connect(self, mac):
+        """Connects to a device with retries."""
+        loop = asyncio.get_event_loop()
+        peripheral = self._new_peripheral()
         i = 0
         device = None
         err = None
@@ -48,10 +187,14 @@ class DeviceManager:
             # Retry.
             if i != 0:
                 _LOGGER.debug('Auth failed. Attempt no: %s. Trying again.', i + 1)
-                await asyncio.sleep(self._ble_timeout)
+                if self._metrics is not None:
+                    self._metrics.inc(RECONNECTS, mac)
+                with tracer.span('retry_sleep', mac=mac, attempt=i + 1):
+                    await asyncio.sleep(self._ble_timeout)
 
             # Try connect.
-            device, err = self._do_connect(peripheral, mac)
+            # Blocking BLE calls run in a thread, so the loop serves other devices and the wait can be cancelled.
+            device, err = await loop.run_in_executor(None, self._do_connect, peripheral, mac, i + 1)
             if device is not None:
                 break  # Success.
 
@@ -61,37 +204,93 @@ class DeviceManager:
             raise err
 
         self._devices[mac] = device
+        self._flush_journal(device)
         return device
 
-    def _do_connect(self, peripheral, mac):
-        """Does actual connection and tries to auth the client."""
-        conn_args = (mac, self._addr_type, self._iface)
+    def on_advertisement(self, mac):
+        """Connects a device seen by a scanner if the journal has intents for it.
+
+        Returns whether the device was connected.
+        """
+        if self._journal is None or not self._journal.has_pending(mac):
+            return False
+        self.connect(mac)
+        return True
+
+    def _flush_journal(self, device):
+        """Delivers journaled intents. A failure doesn't fail the connection."""
+        if self._journal is None or not self._journal.supports(device):
+            return
         try:
-            if mac not in self._devices:
-                peripheral.connect(*conn_args)
-                # Get device class and all used characteristics.
-                bt_attrs = self._discovery.discover_device(peripheral, mac)
-                cls = bt_attrs.get_class()
-                device = cls(self._key, peripheral, conn_args, bt_attrs)
-            else:
-                device = self._devices[mac]
-                device.connect()
-
-            # Try auth before any actions.
-            is_auth = device.try_auth()
-            if not is_auth:
-                raise R4sAuthFailed()
-
-            # Success.
-            _LOGGER.debug('Device %s (%s) connected successfully.', mac, device.bt_attrs.name)
-            return device, None
-
-        except (BTLEException, R4sAuthFailed) as err:
-            _LOGGER.exception('connection failed')
-            peripheral.disconnect()
-            return None, err
-
-        except UnsupportedDeviceException as e:
-            _LOGGER.exception('unsupported device')
-            peripheral.disconnect()
-            raise
+            self._journal.flush(device)
+        except (BTLEException, R4sUnexpectedResponse, R4sWatchdogTimeout):
+            _LOGGER.exception('journal flush failed')
+
+    def _do_connect(self, peripheral, mac, attempt=1, key=None, pairing=False):
+        """Does actual connection and tries to auth the client.
+
+        While pairing a refused key is expected and isn't logged as an error.
+        """
+        if key is None:
+            key = self._key_for(mac)
+        conn_args = (mac, self._addr_type, self._iface)
+        device = None
+        with self._lock(mac), tracer.span('connect', mac=mac, attempt=attempt) as span:
+            try:
+                if mac not in self._devices:
+                    with tracer.span('peripheral.connect', mac=mac, attempt=attempt):
+                        peripheral.connect(*conn_args)
+                    mtu = self._negotiate_mtu(peripheral)
+                    # Get device class and all used characteristics.
+                    bt_attrs = self._discovery.discover_device(peripheral, mac)
+                    cls = bt_attrs.get_class()
+                    device = cls(key, peripheral, conn_args, bt_attrs)
+                    device.lock = self._lock(mac)
+                    device.recorder = self._recorder
+                    device.time_sync = self._time_sync
+                    device.metrics = self._metrics
+                    device.conn_updater = self._conn_updater
+                    device.mtu = mtu
+                    device.load_state(self._snapshot.get(mac, []))
+                else:
+                    device = self._devices[mac]
+                    device._key = key
+                    with tracer.span('peripheral.connect', mac=mac, model=device.bt_attrs.name, attempt=attempt):
+                        device.connect()
+                    device.mtu = self._negotiate_mtu(device._peripheral)
+                span.set('model', device.bt_attrs.name)
+
+                # Try auth before any actions.
+                is_auth = device.try_auth()
+                if not is_auth:
+                    if self._metrics is not None:
+                        self._metrics.inc(AUTH_FAILURES, mac)
+                    raise R4sAuthFailed()
+
+                if self._metrics is not None:
+                    self._metrics.inc(CONNECTS, mac)
+                self._keystore.record(mac, key)
+                # The new link starts with parameters picked by the stack.
+                device.link_params = None
+                device.set_link_params(device.idle_link_params())
+
+                # Success.
+                _LOGGER.debug('Device %s (%s) connected successfully.', mac, device.bt_attrs.name)
+                return device, None
+
+            except (BTLEException, R4sAuthFailed, R4sWatchdogTimeout) as err:
+                if pairing and isinstance(err, R4sAuthFailed):
+                    _LOGGER.debug('Device %s refused the key, pairing mode is off.', mac)
+                else:
+                    _LOGGER.exception('connection failed')
+                span.set('error', repr(err))
+                peripheral.disconnect()
+                if device is not None and self._devices.get(mac) is not device:
+                    # The peripheral is reused by the next attempt, the dropped device must not disconnect it.
+                    device._peripheral = None
+                return None, err
+
+            except UnsupportedDeviceException as e:
+                _LOGGER.exception('unsupported device')
+                peripheral.disconnect()
+                raise
@@ -0,0 +1,161 @@
+"""Instrumentation of devices and connections."""
+import threading
+from bisect import bisect_left
+
+# Upper bounds of histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FRAME_SIZE_BUCKETS = (4, 8, 12, 16, 20, 32, 64, 128, 256)
+
+DIRECTION_IN = 'in'
+DIRECTION_OUT = 'out'
+
+# Counter names.
+TIMEOUTS = 'timeouts'
+UNEXPECTED_RESPONSES = 'unexpected_responses'
+AUTH_FAILURES = 'auth_failures'
+CONNECTS = 'connects'
+RECONNECTS = 'reconnects'
+
+# Gauge names.
+# The interval requested from the controller, the device may still agree on another one.
+CONN_INTERVAL = 'requested_connection_interval_seconds'
+
+_PREFIX = 'r4s'
+
+
+class Histogram:
+    """Histogram with fixed buckets."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last is +Inf.
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        """Casts the instance to a dict with cumulative buckets."""
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            'buckets': dict(zip([*self.buckets, float('inf')], cumulative)),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Metrics:
+    """Collects latency histograms per command and MAC, frame sizes and counters.
+
+    Devices don't call the instance at all if metrics aren't passed to DeviceManager.
+    A disabled instance returns right away.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._latency = {}  # (command code, MAC) to Histogram.
+        self._frames = {}  # Direction to Histogram.
+        self._counters = {}  # (name, MAC) to int.
+        self._gauges = {}  # (name, MAC) to the last value.
+
+    def observe_latency(self, code, mac, seconds):
+        """Records write to notify latency of a command."""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (code, mac)
+            if key not in self._latency:
+                self._latency[key] = Histogram(LATENCY_BUCKETS)
+            self._latency[key].observe(seconds)
+
+    def observe_frame(self, direction, size):
+        """Records size of a frame in or out."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if direction not in self._frames:
+                self._frames[direction] = Histogram(FRAME_SIZE_BUCKETS)
+            self._frames[direction].observe(size)
+
+    def inc(self, name, mac=None, value=1):
+        """Increments a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (name, mac)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, mac, value):
+        """Sets the current value of a gauge."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, mac)] = value
+
+    def snapshot(self):
+        """Returns collected values as a dict."""
+        with self._lock:
+            return {
+                'latency': {key: histogram.as_dict() for key, histogram in self._latency.items()},
+                'frames': {key: histogram.as_dict() for key, histogram in self._frames.items()},
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+            }
+
+    def to_prometheus(self):
+        """Returns collected values in Prometheus text format."""
+        snapshot = self.snapshot()
+        lines = []
+        name = _PREFIX + '_command_latency_seconds'
+        lines.append('# HELP {} Latency from command write to response notification.'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for (code, mac), histogram in sorted(snapshot['latency'].items(), key=str):
+            lines.extend(self._histogram_lines(name, {'code': code, 'mac': mac}, histogram))
+
+        name = _PREFIX + '_frame_size_bytes'
+        lines.append('# HELP {} Size of frames written and notified.'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for direction, histogram in sorted(snapshot['frames'].items()):
+            lines.extend(self._histogram_lines(name, {'direction': direction}, histogram))
+
+        counters = snapshot['counters']
+        for counter in sorted({key[0] for key in counters}):
+            name = '{}_{}_total'.format(_PREFIX, counter)
+            lines.append('# TYPE {} counter'.format(name))
+            for (counter_name, mac), value in sorted(counters.items(), key=str):
+                if counter_name == counter:
+                    labels = {'mac': mac} if mac is not None else {}
+                    lines.append('{}{} {}'.format(name, self._labels(labels), value))
+
+        gauges = snapshot['gauges']
+        for gauge in sorted({key[0] for key in gauges}):
+            name = '{}_{}'.format(_PREFIX, gauge)
+            lines.append('# TYPE {} gauge'.format(name))
+            for (gauge_name, mac), value in sorted(gauges.items(), key=str):
+                if gauge_name == gauge:
+                    labels = {'mac': mac} if mac is not None else {}
+                    lines.append('{}{} {}'.format(name, self._labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def _histogram_lines(cls, name, labels, histogram):
+        for bound, count in histogram['buckets'].items():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield '{}_bucket{} {}'.format(name, cls._labels({**labels, 'le': le}), count)
+        yield '{}_sum{} {}'.format(name, cls._labels(labels), histogram['sum'])
+        yield '{}_count{} {}'.format(name, cls._labels(labels), histogram['count'])
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, value) for key, value in labels.items()) + '}'
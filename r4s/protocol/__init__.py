@@ -1,3 +1,5 @@
+from datetime import datetime
+
 BYTE_ORDER = 'little'
 
 
@@ -53,3 +55,8 @@ def float_to_arr(f: float):
         f_abs = d
 
     return int_to_arr((round(f2 * f_abs) & 4095) | ((i & 15) << 12), 4)
+
+
+def host_utc_offset(timestamp):
+    """Returns the host UTC offset in seconds at the timestamp."""
+    return int(datetime.fromtimestamp(timestamp).astimezone().utcoffset().total_seconds())
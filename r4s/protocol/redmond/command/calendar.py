@@ -17,6 +17,7 @@ class Cmd112(RedmondCommand):
 class Cmd113(RedmondCommand):
     CODE = 113
     resp_cls = AddEventResponse
+    write_with_response = True
 
     def __init__(self, event: EventInCalendarResponse):
         self.event = event
@@ -33,6 +34,7 @@ class Cmd115(RedmondCommand):
 class Cmd116DeleteEvent(RedmondCommand):
     CODE = 116
     resp_cls = ErrorResponse
+    write_with_response = True
 
     def __init__(self, uid):
         self.uid = uid
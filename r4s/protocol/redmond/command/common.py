@@ -1,4 +1,6 @@
-from r4s.protocol import int_to_arr
+import time
+
+from r4s.protocol import int_to_arr, host_utc_offset
 from r4s.protocol.redmond.response.common import SuccessResponse, ErrorResponse, VersionResponse
 from r4s.protocol.redmond.response.kettle import KettleResponse
 
@@ -9,6 +11,8 @@ _DATA_END_BYTE = 0xaa
 class RedmondCommand:
     CODE = NotImplemented
     resp_cls = NotImplemented
+    # Control commands are written with an acknowledgement, reads and streamed frames without it.
+    write_with_response = False
 
     @classmethod
     def wrap(cls, counter, cmd, data):
@@ -38,11 +42,13 @@ class CmdFw(RedmondCommand):
 class Cmd3On(RedmondCommand):
     CODE = 3
     resp_cls = SuccessResponse
+    write_with_response = True
 
 
 class Cmd4Off(RedmondCommand):
     CODE = 4
     resp_cls = SuccessResponse
+    write_with_response = True
 
 
 class FullProgram:
@@ -54,6 +60,7 @@ class FullProgram:
 class Cmd5SetProgram(RedmondCommand):
     CODE = 5
     resp_cls = SuccessResponse
+    write_with_response = True
 
     def __init__(self, program: FullProgram):
         self.program = program
@@ -75,6 +82,7 @@ class Cmd6Status(RedmondCommand):
 class Cmd62SwitchSound(RedmondCommand):
     CODE = 60
     resp_cls = SuccessResponse
+    write_with_response = True
 
     def __init__(self, state):
         self.state = state
@@ -86,6 +94,7 @@ class Cmd62SwitchSound(RedmondCommand):
 class Cmd62SwitchLock(RedmondCommand):
     CODE = 62
     resp_cls = SuccessResponse
+    write_with_response = True
 
     def __init__(self, state):
         self.state = state
@@ -97,20 +106,23 @@ class Cmd62SwitchLock(RedmondCommand):
 class CmdSync(RedmondCommand):
     CODE = 110
     resp_cls = ErrorResponse
+    write_with_response = True
 
-    def __init__(self, timezone=4):
-        # TODO: Get real timezone.
-        from datetime import datetime
-        self.now = int(datetime.now().timestamp())
-        self.tmz = timezone * 3600
+    def __init__(self, timezone=None, now=None):
+        """Timezone is in hours, the host one is used if not specified."""
+        if now is None:
+            now = time.time()
+        self.now = int(now)
+        self.tmz = host_utc_offset(self.now) if timezone is None else int(timezone * 3600)
 
     def to_arr(self):
-        return [*int_to_arr(self.now, 4), *int_to_arr(self.tmz, 4)]
+        return [*int_to_arr(self.now, 4), *int_to_arr(self.tmz, 4, signed=True)]
 
 
 class CmdAuth(RedmondCommand):
     CODE = 255
     resp_cls = SuccessResponse
+    write_with_response = True
 
     def __init__(self, key):
         self.key = key
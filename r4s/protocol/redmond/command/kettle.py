@@ -39,6 +39,7 @@ class Kettle200AProgram(FullKettle200Program):
 class Cmd81(RedmondCommand):
     CODE = 81
     resp_cls = FreshWaterSettingsResponse
+    write_with_response = True
 
     def __init__(self, state, hours):
         self.state = 0x01 if state else 0x00
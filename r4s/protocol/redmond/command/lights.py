@@ -12,11 +12,13 @@ class Cmd48Kettle200(RedmondCommand):
 class Cmd50SetLights(RedmondCommand):
     CODE = 50
     resp_cls = ErrorResponse
+    write_with_response = True
 
-    def __init__(self, light_type):
+    def __init__(self, light_type, scheme: ColorSchemeResponse = None):
         self.type = light_type
+        self.scheme = scheme
         # 0x00 - boil light, 0x01 backlight.
-        # TODO: Rework.
+        # Default palette if the scheme is not specified.
         if light_type == 0x00:
             self.percent = [0x28, 0x46, 0x64]
         else:
@@ -27,6 +29,8 @@ class Cmd50SetLights(RedmondCommand):
         self.brightness = 0x5e
 
     def to_arr(self):
+        if self.scheme is not None:
+            return [self.type, *self.scheme.to_arr()[1:]]
         data = [self.type]
         data.extend([self.percent[0], self.brightness])
         data.extend(self.rgb1)
@@ -51,6 +55,7 @@ class Cmd51GetLights(RedmondCommand):
 class Cmd52(RedmondCommand):
     CODE = 52
     resp_cls = ErrorResponse
+    write_with_response = True
 
     def __init__(self, secs):
         self.secs = secs
@@ -80,6 +85,7 @@ class Cmd54(RedmondCommand):
 class Cmd55UseBacklight(RedmondCommand):
     CODE = 55
     resp_cls = ErrorResponse
+    write_with_response = True
 
     def __init__(self, state):
         self.state = 0x01 if state else 0x00
@@ -90,18 +96,27 @@ class Cmd55UseBacklight(RedmondCommand):
 
 
 class Cmd56(RedmondCommand):
+    """Disco frame: the color shown by the light right now."""
     CODE = 56
     resp_cls = ErrorResponse
 
+    def __init__(self, red, green, blue, brightness=0x5e):
+        self.rgb = [red, green, blue]
+        self.brightness = brightness
+
     def to_arr(self):
-        # Disco functionality.
-        raise NotImplemented
+        # TODO: Check layout on a device. Brightness is assumed first, like in the colors of a light scheme.
+        return [self.brightness, *self.rgb]
 
 
 class Cmd57(RedmondCommand):
+    """Disco mode switch."""
     CODE = 57
     resp_cls = ErrorResponse
+    write_with_response = True
+
+    def __init__(self, state):
+        self.state = 0x01 if state else 0x00
 
     def to_arr(self):
-        # Disco functionality.
-        raise NotImplemented
+        return [self.state]
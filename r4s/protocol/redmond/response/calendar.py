@@ -31,7 +31,7 @@ class EventInCalendarResponse(RedmondResponse):
     def to_arr(self):
         data = [0] * 16
         data[0:4] = int_to_arr(self.timezone, 4)
-        data[4:7] = [self.uid, self.recurrence_type, self.repeat_rule, self.repeat_type]
+        data[4:8] = [self.uid, self.recurrence_type, self.repeat_rule, self.repeat_type]
         data[9] = self.action_type
         data[10:15] = int_to_arr(self.timestamp, 5)
         return data
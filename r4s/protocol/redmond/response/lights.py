@@ -8,7 +8,7 @@ class ColorSchemeResponse(RedmondResponse):
 
     def __init__(self, scheme_id, color1, color2, color3):
         if len(color1) != 5 or len(color2) != 5 or len(color3) != 5:
-            ValueError('Incorrect color config')
+            raise ValueError('Incorrect color config')
         self.id = scheme_id
         self.colors = []
         for color in [color1, color2, color3]:
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+from r4s.protocol.redmond.command.common import Cmd3On, Cmd4Off, Cmd5SetProgram
+from r4s.protocol.redmond.command.kettle import FullKettle200Program
+from r4s.protocol.redmond.response.kettle import MODE_BOIL, BOIL_TEMP, STATE_ON, KettleResponse
+
+COALESCE_DELAY = 0.3  # Seconds to collect intents before sending them.
+
+_PROGRAM_FIELDS = ('program', 'trg_temp', 'boil_time')
+
+
+class Kettle200Reconciler:
+    """Desired state layer over RedmondKettle200.
+
+    Intents are merged into a target state until flush, superseded ones never reach the device.
+    On flush the minimal command sequence is sent to reach the target from the last known status.
+    The status is requested only if it is stale.
+    """
+
+    def __init__(self, kettle):
+        self._kettle = kettle
+        self._desired = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Target state not yet sent to the device."""
+        with self._lock:
+            return dict(self._desired)
+
+    def set_mode(self, mode=MODE_BOIL, temp=BOIL_TEMP, boil_time=None):
+        """Requests the program. The boil time is kept if not specified."""
+        if not KettleResponse.is_allowed_temp(mode, temp):
+            raise ValueError('Incorrect temp')
+        with self._lock:
+            self._desired.update(program=mode, trg_temp=temp)
+            if boil_time is not None:
+                self._desired['boil_time'] = boil_time
+            else:
+                self._desired.pop('boil_time', None)
+
+    def switch_on(self):
+        with self._lock:
+            self._desired['on'] = True
+
+    def switch_off(self):
+        with self._lock:
+            self._desired['on'] = False
+
+    def apply(self, desired: dict):
+        """Merges target fields, e.g. restored from r4s.journal."""
+        with self._lock:
+            self._desired.update(desired)
+
+    def plan(self, status):
+        """Returns commands to reach the pending target from the status."""
+        with self._lock:
+            desired = dict(self._desired)
+        return self._plan(desired, status)
+
+    def flush(self):
+        """Sends the pending target to the device.
+
+        Returns the list of sent commands. On failure the target is pending again, intents recorded
+        meanwhile take precedence.
+        """
+        with self._lock:
+            desired, self._desired = self._desired, {}
+        if not desired:
+            return []
+        try:
+            cmds = self._plan(desired, self._kettle.status)
+            if cmds:
+                with self._kettle.interactive():
+                    self._kettle.do_commands(cmds)
+                    self._kettle.fetch_status()
+        except Exception:
+            with self._lock:
+                for field, value in desired.items():
+                    self._desired.setdefault(field, value)
+            raise
+        return cmds
+
+    async def async_flush(self, delay=COALESCE_DELAY):
+        """Waits for more intents and flushes them at once."""
+        await asyncio.sleep(delay)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.flush)
+
+    @staticmethod
+    def _plan(desired, status):
+        """Computes the command sequence."""
+        is_on = status.state == STATE_ON
+        want_on = desired.get('on')
+        cmds = []
+
+        program = {field: desired.get(field, getattr(status, field)) for field in _PROGRAM_FIELDS}
+        if any(program[field] != getattr(status, field) for field in _PROGRAM_FIELDS):
+            # The program is changed only when the kettle is off.
+            if is_on:
+                cmds.append(Cmd4Off())
+                if want_on is None:
+                    want_on = True
+                is_on = False
+            cmds.append(Cmd5SetProgram(FullKettle200Program(**program)))
+
+        if want_on is True and not is_on:
+            cmds.append(Cmd3On())
+        elif want_on is False and is_on:
+            cmds.append(Cmd4Off())
+        return cmds
@@ -0,0 +1,72 @@
+"""Coalescing of concurrent identical calls.
+
+The first caller of a key runs the call, the callers that come while it is in flight
+wait for it and get the same result or exception.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Single flight group for threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Runs fn unless a call with the key is in flight, then waits for it."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key):
+        """Whether a call with the key is running."""
+        with self._lock:
+            return key in self._calls
+
+
+class AsyncSingleFlight:
+    """Single flight group for coroutines of one event loop."""
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        """Runs the coroutine unless one with the key is in flight, then waits for it."""
+        key = (id(asyncio.get_event_loop()), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # The call goes on if one of the callers is cancelled.
+        return await asyncio.shield(task)
@@ -0,0 +1,91 @@
+"""Binary snapshot of device state for warm restarts.
+
+The snapshot starts with a header followed by devices. A device is its MAC and a list of fields,
+every field stores its name, the time it was fetched and the raw bytes of the value.
+Devices and CalendarSync dump and load their fields, unknown fields are skipped on load.
+"""
+import struct
+from collections import namedtuple
+
+from r4s.capture import read_exact
+from r4s.protocol.redmond.response.common import RedmondResponse
+
+SNAPSHOT_MAGIC = b'R4SN'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sBH')  # Magic, version, device count.
+_DEVICE = struct.Struct('<BH')  # MAC length, field count.
+_FIELD = struct.Struct('<BdH')  # Name length, fetch timestamp, data length.
+
+FieldState = namedtuple('FieldState', ['field', 'fetched_at', 'data'])
+
+
+def encode_value(value) -> bytes:
+    """Casts a response or a list of bytes to raw bytes."""
+    if value is None:
+        return b''
+    if isinstance(value, RedmondResponse):
+        value = value.to_arr()
+    return bytes(value)
+
+
+def decode_value(data: bytes, resp_cls=None):
+    """Restores a value encoded by encode_value. Without resp_cls returns a list."""
+    if resp_cls is None:
+        return list(data)
+    return resp_cls.from_bytes(list(data))
+
+
+def merge_fields(states, fields):
+    """Returns field states with the fields of the same names replaced."""
+    names = {state.field for state in fields}
+    return [state for state in states if state.field not in names] + list(fields)
+
+
+def write_snapshot(stream, states: dict):
+    """Writes field states by MAC to a binary stream."""
+    stream.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(states)))
+    for mac, fields in states.items():
+        encoded_mac = str(mac).encode('utf-8')
+        stream.write(_DEVICE.pack(len(encoded_mac), len(fields)))
+        stream.write(encoded_mac)
+        for field, fetched_at, data in fields:
+            name = field.encode('utf-8')
+            stream.write(_FIELD.pack(len(name), fetched_at, len(data)))
+            stream.write(name)
+            stream.write(data)
+
+
+def read_snapshot(stream) -> dict:
+    """Reads field states by MAC from a binary stream."""
+    magic, version, count = _HEADER.unpack(read_exact(stream, _HEADER.size, 'snapshot'))
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('Not a r4s snapshot.')
+    if version != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version {}.'.format(version))
+
+    states = {}
+    for _ in range(count):
+        mac_length, field_count = _DEVICE.unpack(read_exact(stream, _DEVICE.size, 'snapshot'))
+        mac = read_exact(stream, mac_length, 'snapshot').decode('utf-8')
+        fields = []
+        for _ in range(field_count):
+            name_length, fetched_at, data_length = _FIELD.unpack(read_exact(stream, _FIELD.size, 'snapshot'))
+            field = read_exact(stream, name_length, 'snapshot').decode('utf-8')
+            fields.append(FieldState(field, fetched_at, read_exact(stream, data_length, 'snapshot')))
+        states[mac] = fields
+    return states
+
+
+def save_snapshot(filename, states: dict):
+    with open(filename, 'wb') as stream:
+        write_snapshot(stream, states)
+
+
+def load_snapshot(filename) -> dict:
+    """Reads a snapshot file. A missing file is an empty snapshot."""
+    try:
+        with open(filename, 'rb') as stream:
+            return read_snapshot(stream)
+    except FileNotFoundError:
+        return {}
@@ -1,13 +1,25 @@
 """Helpers for test cases."""
+import threading
+import time
 
-from r4s.discovery import UUID_CHAR_GENERIC, UUID_CHAR_CMD, UUID_CHAR_RSP, UUID_CCCD, UUID_SRV_GENERIC, UUID_SRV_R4S
+from r4s.connection import DEFAULT_MTU, MAX_MTU, ConnParams, conn_params_to_bytes
+from r4s.discovery import UUID_CHAR_CONN, UUID_CHAR_GENERIC, UUID_CHAR_CMD, UUID_CHAR_RSP, UUID_CCCD, \
+    UUID_SRV_GENERIC, UUID_SRV_R4S
+from r4s.protocol import int_from_bytes
 from r4s.protocol.redmond.command.common import CmdAuth, CmdFw, CmdSync, Cmd6Status, Cmd5SetProgram, Cmd3On, Cmd4Off, \
     RedmondCommand
+from r4s.protocol.redmond.command.calendar import Cmd112, Cmd113, Cmd115, Cmd116DeleteEvent
+from r4s.protocol.redmond.response.calendar import EventInCalendarResponse, AddEventResponse, CalendarInfoResponse
 from r4s.protocol.redmond.response.common import SuccessResponse, ErrorResponse
 from r4s.protocol.redmond.response.kettle import STATE_ON, STATE_OFF
 from r4s.test.bluepy_helper import *
 
+# Round trips in progress on all mock links and their maximum, see MockPeripheral.round_trip.
+_links = {'in_flight': 0, 'max_in_flight': 0}
+_links_lock = threading.Lock()
+
 _HANDLE_R_GENERIC = 0x0003
+_HANDLE_R_CONN = 0x0005
 _HANDLE_R_CMD = 0x000b
 _HANDLE_W_SUBSCRIBE = 0x000c
 _HANDLE_W_CMD = 0x000e
@@ -28,8 +40,11 @@ class MockPeripheral:
 
         # Read handlers.
         self.cmd_responses = []
+        self.is_response_pending = False
+        self.pushed = []  # Notifications sent by the device without request.
         self.override_read_handles = {
             _HANDLE_R_GENERIC: self.get_device_name,
+            _HANDLE_R_CONN: self.get_conn_params,
             _HANDLE_R_CMD: self.cmd_handle_read,
         }
 
@@ -49,8 +64,22 @@ class MockPeripheral:
             Cmd5SetProgram.CODE: self.cmd_set_mode,
             Cmd3On.CODE: self.cmd_on,
             Cmd4Off.CODE: self.cmd_off,
+            Cmd112.CODE: self.cmd_get_event,
+            Cmd113.CODE: self.cmd_add_event,
+            Cmd115.CODE: self.cmd_calendar_info,
+            Cmd116DeleteEvent.CODE: self.cmd_delete_event,
         }
 
+        # Peripheral preferred connection parameters.
+        self.conn_params = ConnParams(24, 40, 0, 400)  # None if the device has no preference.
+        # Simulated seconds of a link round trip. It's spent between a command write and its response,
+        # on a write response and on every extra packet of a frame longer than the MTU.
+        self.latency = 0
+        self.round_trips = 0  # Simulated round trips, counted even without latency.
+        self.in_flight = 0  # Round trips of this link in progress and their maximum.
+        self.max_in_flight = 0
+        self.mtu = DEFAULT_MTU
+        self.max_mtu = MAX_MTU
         # Current state.
         self.is_available = True
         self.is_connected = False
@@ -65,6 +94,11 @@ class MockPeripheral:
         self.device_cls = NotImplemented
         self.fw_version = NotImplemented
         self.status = NotImplemented
+        # Calendar events by uid.
+        self.calendar = {}
+        self.calendar_size = 16
+        # Device time and UTC offset set by sync.
+        self.time = None
 
         if deviceAddr is not None:
             self.connect(deviceAddr, addrType, iface)
@@ -82,6 +116,16 @@ class MockPeripheral:
         """Returns device name for generic service."""
         raise NotImplemented
 
+    def setMTU(self, mtu):
+        """Imitates MTU exchange."""
+        self.check_connected()
+        self.mtu = min(mtu, self.max_mtu)
+        return {'state': ['conn'], 'mtu': [self.mtu]}
+
+    def get_conn_params(self):
+        """Returns preferred connection parameters for generic service."""
+        return conn_params_to_bytes(self.conn_params)
+
     def connect(self, addr, addrType=ADDR_TYPE_PUBLIC, iface=None):
         """Imitate connect."""
         if self.is_connected:
@@ -95,6 +139,7 @@ class MockPeripheral:
         self.is_connected = False
         self.is_subscribed = False
         self.is_authed = None
+        self.mtu = DEFAULT_MTU
 
     def check_connected(self):
         """helper function to check if the request can be processed."""
@@ -123,17 +168,24 @@ class MockPeripheral:
 
     def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
         """Mock bluetooth characteristics."""
-        return [
+        characteristics = [
             Characteristic(self, UUID_CHAR_GENERIC, _HANDLE_R_GENERIC - 1, 2, _HANDLE_R_GENERIC),
+            Characteristic(self, UUID_CHAR_CONN, _HANDLE_R_CONN - 1, 2, _HANDLE_R_CONN),
             Characteristic(self, UUID_CHAR_CMD, _HANDLE_W_CMD - 1, 12, _HANDLE_W_CMD),
             Characteristic(self, UUID_CHAR_RSP, _HANDLE_R_CMD - 1, 16, _HANDLE_R_CMD),
         ]
+        if self.conn_params is None:
+            # The preferred connection parameters are optional.
+            del characteristics[1]
+        return [char for char in characteristics
+                if startHnd <= char.handle <= endHnd and (uuid is None or char.uuid == UUID(uuid))]
 
     def getDescriptors(self, startHnd=1, endHnd=0xFFFF):
         """Mock bluetooth descriptors."""
-        return [
+        descriptors = [
             Descriptor(self, UUID_CCCD, 12),
         ]
+        return [desc for desc in descriptors if startHnd <= desc.handle <= endHnd]
 
     def withDelegate(self, delegate_):
         """Sets delegate for peripheral."""
@@ -147,10 +199,36 @@ class MockPeripheral:
             return self.override_read_handles[handle]()
         raise ValueError('handle not implemented in mockup')
 
+    def round_trip(self, count=1):
+        """Spends simulated round trips of the link and tracks the links busy at the same time."""
+        if not count:
+            return
+        self.round_trips += count
+        if not self.latency:
+            return
+        with _links_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            _links['in_flight'] += 1
+            _links['max_in_flight'] = max(_links['max_in_flight'], _links['in_flight'])
+        try:
+            time.sleep(self.latency * count)
+        finally:
+            with _links_lock:
+                self.in_flight -= 1
+                _links['in_flight'] -= 1
+
     def waitForNotifications(self, timeout):
         """Wait for notification callback."""
         if not self.is_subscribed:
             return False
+        if self.pushed:
+            self.delegate.handleNotification(_HANDLE_R_CMD, self.pushed.pop(0))
+            return True
+        if not self.is_response_pending:
+            return False
+        self.is_response_pending = False
+        self.round_trip()
         resp = self.readCharacteristic(_HANDLE_R_CMD)
         self.delegate.handleNotification(_HANDLE_R_CMD, resp)
         return True
@@ -159,6 +237,8 @@ class MockPeripheral:
         """Writing handles just stores the results in a list."""
         self.check_connected()
         self.written_handles.append((handle, val))
+        packets = -(-len(val) // (self.mtu - 3))
+        self.round_trip(packets - 1 + (1 if withResponse else 0))
 
         if handle in self.override_write_handles:
             return self.override_write_handles[handle](val)
@@ -189,10 +269,15 @@ class MockPeripheral:
         if cmd in self.cmd_handlers:
             resp = self.cmd_handlers[cmd](data)
             self.cmd_responses.append((self.counter, cmd, resp))
+            self.is_response_pending = True
             return ['wr']
 
         raise ValueError('cmd not implemented in mockup')
 
+    def push_status(self):
+        """Imitates the status notification sent by the device on its own."""
+        self.pushed.append(RedmondCommand.wrap(self.counter, Cmd6Status.CODE, self.status.to_arr()))
+
     def check_key(self, key):
         """Checks whether key is valid and registered."""
         if len(key) != 8:
@@ -218,7 +303,7 @@ class MockPeripheral:
 
     def cmd_sync(self, data):
         """Sync device time handler."""
-        # TODO: Save time.
+        self.time = (int_from_bytes(data[0:4]), int.from_bytes(bytes(data[4:8]), 'little', signed=True))
         return ErrorResponse(0).to_arr()
 
     def cmd_status(self, data):
@@ -250,3 +335,27 @@ class MockPeripheral:
         # TODO: Return 0x00 on some internal error.
         self.status.state = STATE_OFF
         return SuccessResponse(True).to_arr()
+
+    def cmd_calendar_info(self, data):
+        """Calendar info handler."""
+        return CalendarInfoResponse(1, self.calendar_size, len(self.calendar)).to_arr()
+
+    def cmd_get_event(self, data):
+        """Calendar event handler. Empty slot is returned as zeros."""
+        uid = data[0]
+        if uid not in self.calendar:
+            return [0] * 16
+        return self.calendar[uid].to_arr()
+
+    def cmd_add_event(self, data):
+        """Add calendar event handler."""
+        event = EventInCalendarResponse.from_bytes(data)
+        if event.uid not in self.calendar and len(self.calendar) >= self.calendar_size:
+            return AddEventResponse(event.uid, 1).to_arr()
+        self.calendar[event.uid] = event
+        return AddEventResponse(event.uid, 0).to_arr()
+
+    def cmd_delete_event(self, data):
+        """Delete calendar event handler."""
+        self.calendar.pop(data[0], None)
+        return ErrorResponse(0).to_arr()
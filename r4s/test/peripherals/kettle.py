@@ -1,5 +1,5 @@
 from r4s.devices.kettles import RedmondKettle200
-from r4s.protocol.redmond.command.lights import Cmd55UseBacklight, Cmd50SetLights, Cmd51GetLights
+from r4s.protocol.redmond.command.lights import Cmd55UseBacklight, Cmd50SetLights, Cmd51GetLights, Cmd56, Cmd57
 from r4s.protocol.redmond.command.statistics import Cmd71StatsUsage, Cmd80StatsTimes
 from r4s.protocol.redmond.response.common import SuccessResponse, ErrorResponse, VersionResponse
 from r4s.protocol.redmond.response.kettle import MODE_BOIL, STATE_OFF
@@ -17,12 +17,22 @@ class MockKettle200Peripheral(MockPeripheral):
             Cmd55UseBacklight.CODE: self.cmd_set_backlight,
             Cmd50SetLights.CODE: self.cmd_set_lights,
             Cmd51GetLights.CODE: self.cmd_get_lights,
+            Cmd56.CODE: self.cmd_disco_frame,
+            Cmd57.CODE: self.cmd_disco,
             Cmd71StatsUsage.CODE: self.cmd_stats_usage,
             Cmd80StatsTimes.CODE: self.cmd_stats_times,
         })
 
         # Internal status. Firmware version.
         self.fw_version = VersionResponse([3, 10])
+        # Color schemes by light type.
+        self.lights = {
+            0x00: [0x00, 0x28, 0x5e, 0x00, 0x00, 0xff, 0x46, 0x5e, 0x00, 0xff, 0x00, 0x64, 0x5e, 0xff, 0x00, 0x00],
+            0x01: [0x01, 0x00, 0x5e, 0x00, 0x00, 0xff, 0x32, 0x5e, 0x00, 0xff, 0x00, 0x64, 0x5e, 0xff, 0x00, 0x00],
+        }
+        # Disco mode and shown frames.
+        self.is_disco = False
+        self.disco_frames = []
         # Statistics data.
         self.statistics = TenInformationResponse(
             ten_num=0,
@@ -53,13 +63,28 @@ class MockKettle200Peripheral(MockPeripheral):
 
     def cmd_set_lights(self, data):
         """Sets the light."""
-        # TODO: Handle somehow.
+        if len(data) != 16 or data[0] not in self.lights:
+            return ErrorResponse(1).to_arr()
+        self.lights[data[0]] = list(data)
         return ErrorResponse(0).to_arr()
 
     def cmd_get_lights(self, data):
         """Gets current light settings."""
-        # TODO: Return current set values.
-        return [0x00, 0x28, 0x5e, 0x00, 0x00, 0xff, 0x46, 0x5e, 0x00, 0xff, 0x00, 0x64, 0x5e, 0xff, 0x00, 0x00]
+        return self.lights[data[0]]
+
+    def cmd_disco(self, data):
+        """Switches disco mode."""
+        self.is_disco = bool(data[0])
+        return ErrorResponse(0).to_arr()
+
+    def cmd_disco_frame(self, data):
+        """Shows disco frame."""
+        if not self.is_disco:
+            return ErrorResponse(1).to_arr()
+        # The layout of Cmd56, not verified on a device.
+        brightness, red, green, blue = data
+        self.disco_frames.append([brightness, red, green, blue])
+        return ErrorResponse(0).to_arr()
 
     def cmd_stats_usage(self, data):
         """Returns device statistics of usage."""
@@ -0,0 +1,80 @@
+import time
+
+from r4s.capture import DIRECTION_NOTIFY, DIRECTION_WRITE, load_capture
+from .base import MockPeripheral, _HANDLE_W_CMD
+
+
+class ReplayPeripheral(MockPeripheral):
+    """Mock peripheral serving notifications of a captured session.
+
+    Every command write is answered with the next captured notification of the same command code,
+    pushed notifications that answer no write are skipped.
+    The notifications are delivered at the recorded pace divided by speed,
+    the speed None delivers them as fast as possible.
+    """
+
+    def __init__(self, frames, name, *args, speed=1.0):
+        super().__init__(*args)
+        self.name = name
+        self.speed = speed
+        self.frames = list(frames)
+        self.notifications = [frame for frame in self.frames if frame.direction == DIRECTION_NOTIFY]
+        self.expected_writes = [frame for frame in self.frames
+                                if frame.direction == DIRECTION_WRITE and frame.handle == _HANDLE_W_CMD]
+        self.mismatches = []  # Command writes that differ from the capture.
+        self._write_i = 0
+        self._responses = []  # Notifications due for written commands.
+        self._clock_start = None
+
+    @classmethod
+    def from_capture(cls, filename, mac, name, speed=1.0):
+        """Creates the peripheral from a capture file."""
+        return cls(load_capture(filename, mac), name, speed=speed)
+
+    def get_device_name(self):
+        """Returns device name for generic service."""
+        return self.name.encode('utf-8')
+
+    def cmd_handle_write(self, value):
+        """Compares the write with the capture instead of handling the command."""
+        if self._write_i < len(self.expected_writes):
+            expected = self.expected_writes[self._write_i].data
+            if expected != bytes(value):
+                self.mismatches.append((self._write_i, expected, bytes(value)))
+        else:
+            self.mismatches.append((self._write_i, None, bytes(value)))
+        self._write_i += 1
+        response = self._find_response(bytes(value))
+        if response is not None:
+            self._responses.append(response)
+        return ['wr']
+
+    def _find_response(self, value):
+        """Takes the first captured notification answering the command code of the write."""
+        if len(value) < 3:
+            return None
+        for i, frame in enumerate(self.notifications):
+            if len(frame.data) > 2 and frame.data[2] == value[2]:
+                return self.notifications.pop(i)
+        return None
+
+    def waitForNotifications(self, timeout):
+        """Delivers the next captured notification."""
+        if not self.is_subscribed or not self._responses:
+            return False
+        frame = self._responses.pop(0)
+        self._wait_for(frame.timestamp)
+        self.delegate.handleNotification(frame.handle, frame.data)
+        return True
+
+    def _wait_for(self, timestamp):
+        """Sleeps until the frame is due according to the recorded timeline."""
+        if not self.speed:
+            return
+        if self._clock_start is None:
+            self._clock_start = (time.monotonic(), timestamp)
+            return
+        started, first_timestamp = self._clock_start
+        delay = started + (timestamp - first_timestamp) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
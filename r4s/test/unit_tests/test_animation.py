@@ -0,0 +1,53 @@
+"""Tests for the light animation streaming."""
+import unittest
+
+from r4s.animation import LightAnimation
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestLightAnimation(unittest.TestCase):
+    """Tests for LightAnimation."""
+
+    def test_run(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        kettles = [manager.connect('RK-G200S'), manager.connect('RK-G201S')]
+        animation = LightAnimation(kettles, fps=100)
+        stats = animation.run(lambda i, t: (i, int(t * 1000) % 256, 0), 0.1)
+
+        self.assertEqual(len(stats['devices']), 2)
+        for i, (kettle, device_stats) in enumerate(zip(kettles, stats['devices'])):
+            backend = kettle._peripheral
+            self.assertFalse(backend.is_disco)
+            self.assertGreater(device_stats['sent'], 0)
+            self.assertEqual(device_stats['sent'], len(backend.disco_frames))
+            # Frames are brightness, red, green, blue.
+            self.assertTrue(all(frame[0] == 0x5e and frame[1] == i for frame in backend.disco_frames))
+            self.assertGreater(device_stats['fps'], 0)
+
+        # The device is still usable after streaming.
+        kettles[0].fetch_status()
+        self.assertEqual(kettles[0].status, kettles[0]._peripheral.status)
+
+    def test_start_failure(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        kettles = [manager.connect('RK-G200S'), manager.connect('RK-G201S'), manager.connect('RK-G210S')]
+
+        def fail(cmd):
+            raise BTLEException('Device disconnected')
+
+        kettles[2].do_command = fail
+        with self.assertRaises(BTLEException):
+            LightAnimation(kettles).run(lambda i, t: (0, 0, 0), 0.1)
+        # The devices switched before the failure leave disco mode.
+        for kettle in kettles:
+            self.assertFalse(kettle._peripheral.is_disco)
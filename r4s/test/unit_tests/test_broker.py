@@ -0,0 +1,90 @@
+"""Tests for the broker daemon and its client."""
+import asyncio
+import os
+import stat
+import tempfile
+import threading
+import unittest
+
+from r4s import R4sBrokerError
+from r4s.broker import Broker, BrokerClient, main
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.response.kettle import Kettle200Response, STATE_ON
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestBroker(unittest.TestCase):
+    """Tests for Broker and BrokerClient."""
+    model = 'RK-G200S'
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'r4s.sock')
+        self.manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        self.broker = Broker(self.manager, self.path)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.broker.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.broker.close(), self.loop).result(1)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.dir.cleanup()
+
+    def test_calls(self):
+        with BrokerClient(self.path) as client:
+            self.assertIsNone(client.cached(self.model, 'status'))
+            self.assertEqual(client.connect(self.model), 'RK-G200S')
+            kettle = client.device(self.model)
+            kettle.switch_on()
+            status = kettle.status()
+            self.assertIsInstance(status, Kettle200Response)
+            self.assertEqual(status.state, STATE_ON)
+            self.assertEqual(kettle.firmware_version(), [3, 10])
+
+            # The second client shares the connection and the cache.
+            with BrokerClient(self.path) as other:
+                self.assertEqual(other.cached(self.model, 'status'), status)
+            self.assertIs(self.manager.get_cached(self.model), self.manager.connect(self.model))
+
+    def test_errors(self):
+        with BrokerClient(self.path) as client:
+            self.assertRaises(AttributeError, getattr, client.device(self.model), 'disconnect')
+            self.assertRaises(R4sBrokerError, client.call, self.model, 'disconnect')
+            # The connection is still usable after an error.
+            self.assertEqual(client.connect(self.model), 'RK-G200S')
+            # Private attributes of a connected device are not readable from the cache.
+            self.assertRaises(R4sBrokerError, client.cached, self.model, 'key')
+
+    def test_connect_once(self):
+        connects = []
+        connect = self.manager.connect
+        self.manager.connect = lambda mac: connects.append(mac) or connect(mac)
+        with BrokerClient(self.path) as client:
+            kettle = client.device(self.model)
+            kettle.switch_on()
+            kettle.status()
+            self.assertEqual(connects, [self.model])
+
+            # A closed connection is established again.
+            self.manager.get_cached(self.model).disconnect()
+            kettle.switch_off()
+            self.assertEqual(connects, [self.model] * 2)
+
+    def test_permissions(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        # Keys of paired devices are not kept in memory only.
+        with self.assertRaises(SystemExit):
+            main(['--socket', self.path])
@@ -0,0 +1,99 @@
+"""Tests for the calendar synchronization."""
+import unittest
+
+from r4s.calendar_sync import CalendarSync
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.calendar import Cmd112, Cmd113, Cmd116DeleteEvent
+from r4s.protocol.redmond.command.common import RedmondCommand
+from r4s.protocol.redmond.response.calendar import EventInCalendarResponse
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+def make_event(uid, timestamp, action_type=1):
+    return EventInCalendarResponse(
+        timezone=4 * 3600,
+        uid=uid,
+        recurrence_type=1,
+        repeat_rule=0x7f,
+        repeat_type=1,
+        action_type=action_type,
+        timestamp=timestamp,
+    )
+
+
+class TestCalendarSync(unittest.TestCase):
+    """Tests for CalendarSync."""
+
+    model = 'RK-G200S'
+
+    def test_sync(self):
+        kettle = self.get_manager().connect(self.model)
+        backend = kettle._peripheral
+        backend.calendar = {0: make_event(0, 1000), 3: make_event(3, 3000)}
+        calendar = CalendarSync(kettle)
+
+        # The first sync reads the device events and sends only the changes.
+        desired = [make_event(0, 1000), make_event(3, 3500), make_event(5, 5000)]
+        sent = calendar.sync(desired)
+        self.assertEqual(sent, 3)
+        self.assertDictEqual(backend.calendar, {event.uid: event for event in desired})
+        self.assertEqual(self._count(backend, Cmd112), 4)
+        self.assertEqual(self._count(backend, Cmd116DeleteEvent), 1)
+        self.assertEqual(self._count(backend, Cmd113), 2)
+
+        # The next sync uses the cache and sends nothing.
+        written = len(backend.written_handles)
+        self.assertEqual(calendar.sync(desired), 0)
+        self.assertEqual(len(backend.written_handles), written + 1)
+
+        # Removed event is deleted only.
+        self.assertEqual(calendar.sync(desired[:2]), 1)
+        self.assertDictEqual(backend.calendar, {event.uid: event for event in desired[:2]})
+
+    def test_edited_event(self):
+        kettle = self.get_manager().connect(self.model)
+        backend = kettle._peripheral
+        backend.calendar = {0: make_event(0, 1000), 1: make_event(1, 2000)}
+        backend.calendar_size = 2
+        calendar = CalendarSync(kettle)
+        calendar.load()
+
+        # The edited event is deleted first, so it fits even if the calendar is full.
+        written = len(backend.written_handles)
+        desired = [make_event(0, 1000), make_event(1, 2000, action_type=0)]
+        self.assertEqual(calendar.sync(desired), 2)
+        self.assertDictEqual(backend.calendar, {event.uid: event for event in desired})
+        commands = [RedmondCommand.unwrap(value)[1] for _, value in backend.written_handles[written:]
+                    if len(value) > 2]
+        self.assertEqual([code for code in commands if code in (Cmd113.CODE, Cmd116DeleteEvent.CODE)],
+                         [Cmd116DeleteEvent.CODE, Cmd113.CODE])
+
+    def test_event_bytes(self):
+        event = make_event(7, 123456)
+        self.assertEqual(len(event.to_arr()), 16)
+        self.assertEqual(EventInCalendarResponse.from_bytes(event.to_arr()), event)
+
+    @staticmethod
+    def _count(backend, cmd_cls):
+        """Counts written commands of the class."""
+        return len([value for _, value in backend.written_handles
+                    if len(value) > 2 and RedmondCommand.unwrap(value)[1] == cmd_cls.CODE])
+
+    @staticmethod
+    def get_manager():
+        """Provides device manager for tests."""
+        return DeviceManager(
+            key=[0xbb] * 8,
+            discovery=DeviceDiscovery(),
+            ble_timeout=0,
+            retries=1
+        )
@@ -0,0 +1,98 @@
+"""Tests for the frame capture and replay."""
+import io
+import unittest
+
+from r4s.capture import Frame, FrameRecorder, read_frames, DIRECTION_WRITE, DIRECTION_NOTIFY
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.common import CmdSync
+from r4s.protocol.redmond.response.kettle import STATE_ON
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral
+from r4s.test.peripherals.replay import ReplayPeripheral
+
+import r4s.manager
+
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestCapture(unittest.TestCase):
+    """Tests for FrameRecorder and ReplayPeripheral."""
+    model = 'RK-G200S'
+    mac = 'AA:BB:CC:DD:EE:FF'
+
+    def setUp(self):
+        self._peripheral_cls = r4s.manager.Peripheral
+
+    def tearDown(self):
+        r4s.manager.Peripheral = self._peripheral_cls
+
+    def test_record_and_replay(self):
+        stream = io.BytesIO()
+        r4s.manager.Peripheral = MockKettle200Peripheral
+        manager = self.get_manager(FrameRecorder(stream))
+        kettle = manager.connect(self.mac)
+        kettle.warm_up()
+        kettle.switch_on()
+        recorded_status = kettle.status
+
+        stream.seek(0)
+        frames = list(read_frames(stream))
+        writes = [frame for frame in frames if frame.direction == DIRECTION_WRITE]
+        notifies = [frame for frame in frames if frame.direction == DIRECTION_NOTIFY]
+        self.assertTrue(all(frame.mac == self.mac for frame in frames))
+        # CCCD write, auth and 7 commands.
+        self.assertEqual(len(writes), 9)
+        self.assertEqual(len(notifies), 8)
+        self.assertEqual(writes[0].handle, kettle.bt_attrs.ccc)
+
+        # Replay the session without the device logic.
+        replay = ReplayPeripheral(frames, self.model, speed=None)
+        r4s.manager.Peripheral = lambda: replay
+        manager = self.get_manager()
+        kettle = manager.connect(self.mac)
+        kettle.warm_up()
+        kettle.switch_on()
+        self.assertEqual(kettle.status, recorded_status)
+        self.assertEqual(kettle.status.state, STATE_ON)
+        # Only the sync command carries the current time.
+        self.assertTrue(all(actual[2] == CmdSync.CODE for _, _, actual in replay.mismatches))
+
+    def test_replay_skips_pushed_frames(self):
+        stream = io.BytesIO()
+        r4s.manager.Peripheral = MockKettle200Peripheral
+        manager = self.get_manager(FrameRecorder(stream))
+        kettle = manager.connect(self.mac)
+        kettle.fetch_status()
+        recorded_status = kettle.status
+
+        stream.seek(0)
+        frames = list(read_frames(stream))
+        first_notify = next(i for i, frame in enumerate(frames) if frame.direction == DIRECTION_NOTIFY)
+        notify = frames[first_notify]
+        # A frame pushed by the device that answers no write.
+        push = Frame(DIRECTION_NOTIFY, notify.timestamp, self.mac, notify.handle, bytes([0x55, 0x00, 0x47, 0xaa]))
+        frames.insert(first_notify, push)
+
+        replay = ReplayPeripheral(frames, self.model, speed=None)
+        r4s.manager.Peripheral = lambda: replay
+        kettle = self.get_manager().connect(self.mac)
+        kettle.fetch_status()
+        self.assertEqual(kettle.status, recorded_status)
+        self.assertEqual(replay.mismatches, [])
+
+    def test_invalid_capture(self):
+        with self.assertRaises(ValueError):
+            list(read_frames(io.BytesIO(b'NOPE\x01')))
+
+    @staticmethod
+    def get_manager(recorder=None):
+        """Provides device manager for tests."""
+        return DeviceManager(
+            key=[0xbb] * 8,
+            discovery=DeviceDiscovery(),
+            ble_timeout=0,
+            retries=1,
+            recorder=recorder,
+        )
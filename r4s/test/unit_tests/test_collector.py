@@ -0,0 +1,83 @@
+"""Tests for the statistics collector."""
+import os
+import tempfile
+import unittest
+
+from r4s.collector import StatisticsStore, StatisticsCollector, _RECORD, _HEADER
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestStatisticsStore(unittest.TestCase):
+    """Tests for StatisticsStore and StatisticsCollector."""
+    mac = 'AA:BB:CC:DD:EE:FF'
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.store = StatisticsStore(self._dir.name)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_delta_encoding(self):
+        samples = [
+            (1000, 10, 100, 1, 1),
+            (1060, 20, 300, 2, 1),
+            (1120, 25, 0xffffff00, 3, 2),  # Large counter.
+            (1180, 30, 0x10, 4, 2),  # Wraparound.
+            (1240, 0, 0x20, 0, 0),  # Reset.
+        ]
+        for sample in samples:
+            self.store.append(self.mac, *sample)
+        self.assertEqual(os.path.getsize(self.store.filename(self.mac)), _HEADER.size + 4 * _RECORD.size)
+
+        columns = self.store.query(self.mac)
+        self.assertListEqual(list(columns['spent_power']), [sample[2] for sample in samples])
+        self.assertListEqual(list(columns['timestamp']), [sample[0] for sample in samples])
+
+        columns = self.store.query(self.mac, 1060, 1180)
+        self.assertListEqual(list(columns['timestamp']), [1060, 1120])
+
+        # New store continues the existing file.
+        store = StatisticsStore(self._dir.name)
+        store.append(self.mac, 1300, 5, 0x30, 1, 1)
+        aggregate = store.aggregate(self.mac, 1000)
+        self.assertEqual(aggregate['samples'], 6)
+        self.assertEqual(aggregate['work_time'], 10 + 5 + 5 + 0 + 5)
+        self.assertEqual(aggregate['spent_power'], 200 + 0xffffff00 - 300 + 0x110 + 0x10 + 0x10)
+
+    def test_collector(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        collector = StatisticsCollector(manager, self.store, ['RK-G200S'])
+        self.assertListEqual(collector.sample_all(), [])
+        columns = self.store.query('RK-G200S')
+        backend = manager.connect('RK-G200S')._peripheral
+        self.assertListEqual(list(columns['spent_power']), [backend.statistics.spent_power])
+
+    def test_collector_failure(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        connect = manager.connect
+
+        def flaky_connect(mac):
+            if mac == 'RK-M171S':
+                raise BTLEException('Device disconnected')
+            if mac == 'BROKEN':
+                raise TypeError('Not a BLE error')
+            return connect(mac)
+
+        manager.connect = flaky_connect
+        # A BLE failure fails only its own sample, other errors are not swallowed.
+        collector = StatisticsCollector(manager, self.store, ['RK-M171S', 'RK-G200S'])
+        self.assertListEqual(collector.sample_all(), ['RK-M171S'])
+        collector.macs.append('BROKEN')
+        with self.assertRaises(TypeError):
+            collector.sample_all()
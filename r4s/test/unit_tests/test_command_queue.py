@@ -0,0 +1,127 @@
+"""Tests for the prioritized command queue."""
+import asyncio
+import threading
+import unittest
+
+from r4s import R4sQueueFull
+from r4s.command_queue import PRIORITY_INTERACTIVE, PRIORITY_POLLING, PRIORITY_STATISTICS
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.common import Cmd6Status
+from r4s.protocol.redmond.response.kettle import Kettle200Response as StatusResponse
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestCommandQueue(unittest.TestCase):
+    """Tests for CommandQueue."""
+    model = 'RK-G200S'
+
+    def test_priority(self):
+        manager = self.get_manager()
+        queue = manager.queue(self.model)
+        self.assertIs(manager.queue(self.model), queue)
+
+        # Hold the worker until everything is queued.
+        gate = threading.Event()
+        order = []
+        queue.submit(lambda device: gate.wait(), PRIORITY_POLLING)
+        futures = [queue.submit(lambda device, i=i: order.append('stats{}'.format(i)), PRIORITY_STATISTICS)
+                   for i in range(3)]
+        switch = queue.submit(lambda device: order.append('switch_on'), PRIORITY_INTERACTIVE)
+        status = queue.submit(Cmd6Status(StatusResponse), PRIORITY_POLLING)
+        gate.set()
+
+        self.assertIsInstance(status.result(1), StatusResponse)
+        switch.result(1)
+        for future in futures:
+            future.result(1)
+        self.assertEqual(order, ['switch_on', 'stats0', 'stats1', 'stats2'])
+        queue.close()
+
+    def test_merge_and_drop(self):
+        manager = self.get_manager()
+        queue = manager.queue(self.model, max_depth=2)
+        gate = threading.Event()
+        started = threading.Event()
+        queue.submit(lambda device: started.set() or gate.wait(), PRIORITY_POLLING)
+        started.wait(1)
+
+        # Stale polls are merged and the merged request takes the higher priority.
+        poll = queue.submit(Cmd6Status(StatusResponse), PRIORITY_STATISTICS, key='status')
+        self.assertIs(queue.submit(Cmd6Status(StatusResponse), PRIORITY_POLLING, key='status'), poll)
+        stats = queue.submit(lambda device: 'stats', PRIORITY_STATISTICS)
+        self.assertEqual(len(queue), 2)
+
+        # Full queue drops the newest lower priority request.
+        switch = queue.submit(lambda device: 'switch_on', PRIORITY_INTERACTIVE)
+        self.assertRaises(R4sQueueFull, stats.result, 1)
+        self.assertRaises(R4sQueueFull, queue.submit, lambda device: None, PRIORITY_STATISTICS)
+
+        gate.set()
+        self.assertEqual(switch.result(1), 'switch_on')
+        self.assertIsInstance(poll.result(1), StatusResponse)
+        queue.close()
+
+    def test_merge_after_priority_bump(self):
+        manager = self.get_manager()
+        queue = manager.queue(self.model)
+        gate = threading.Event()
+        started = threading.Event()
+        queue.submit(lambda device: started.set() or gate.wait(), PRIORITY_POLLING)
+        started.wait(1)
+
+        calls = []
+        first = queue.submit(lambda device: calls.append(1), PRIORITY_STATISTICS, key='status')
+        self.assertIs(queue.submit(lambda device: calls.append(2), PRIORITY_POLLING, key='status'), first)
+        # The bumped request still merges later submits.
+        self.assertIs(queue.submit(lambda device: calls.append(3), PRIORITY_STATISTICS, key='status'), first)
+        gate.set()
+        first.result(1)
+        queue.close()
+        self.assertEqual(calls, [1])
+
+    def test_cancelled_requests(self):
+        manager = self.get_manager()
+        queue = manager.queue(self.model, max_depth=2)
+        gate = threading.Event()
+        started = threading.Event()
+        queue.submit(lambda device: started.set() or gate.wait(), PRIORITY_POLLING)
+        started.wait(1)
+
+        # Cancelled requests are dropped and closed without errors.
+        dropped = queue.submit(lambda device: 'stats', PRIORITY_STATISTICS)
+        closed = queue.submit(lambda device: 'poll', PRIORITY_POLLING)
+        self.assertTrue(dropped.cancel())
+        self.assertTrue(closed.cancel())
+        switch = queue.submit(lambda device: 'switch_on', PRIORITY_INTERACTIVE)
+        queue.close(wait=False)
+        gate.set()
+        self.assertTrue(dropped.cancelled())
+        self.assertTrue(closed.cancelled())
+        with self.assertRaises(R4sQueueFull):
+            switch.result(1)
+        queue.close()
+
+    def test_async_submit(self):
+        manager = self.get_manager()
+        queue = manager.queue(self.model)
+        loop = asyncio.new_event_loop()
+        try:
+            status = loop.run_until_complete(queue.async_submit(Cmd6Status(StatusResponse), PRIORITY_INTERACTIVE))
+        finally:
+            loop.close()
+        self.assertIsInstance(status, StatusResponse)
+        queue.close()
+
+    @staticmethod
+    def get_manager():
+        """Provides device manager for tests."""
+        return DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
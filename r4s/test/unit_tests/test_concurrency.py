@@ -0,0 +1,89 @@
+"""Stress tests for concurrent usage of devices."""
+import threading
+import unittest
+
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.common import Cmd6Status, RedmondCommand
+from r4s.protocol.redmond.response.kettle import Kettle200Response
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.base import _links
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestConcurrency(unittest.TestCase):
+    """Drives many threads across many mock devices."""
+    devices = 8
+    threads_per_device = 4
+    commands_per_thread = 10
+    latency = 0.005
+
+    def test_stress(self):
+        manager = self.get_manager()
+        macs = ['RK-G200S-{}'.format(i) for i in range(self.devices)]
+        for mac in macs:
+            manager.connect(mac)._peripheral.latency = self.latency
+
+        errors = []
+        results = []
+        is_done = threading.Event()
+        barrier = threading.Barrier(self.devices * self.threads_per_device + 1)
+
+        def work(mac):
+            try:
+                barrier.wait()
+                kettle = manager.connect(mac)
+                for _ in range(self.commands_per_thread):
+                    results.append(kettle.do_command(Cmd6Status(kettle.status_resp_cls)))
+            except Exception as err:
+                errors.append(err)
+
+        def read():
+            # Cached state is read without locks while commands run.
+            barrier.wait()
+            while not is_done.is_set():
+                for mac in macs:
+                    status = manager.get_cached(mac).cached('status')
+                    if status is not None and not isinstance(status, Kettle200Response):
+                        errors.append(status)
+
+        threads = [threading.Thread(target=work, args=(mac,))
+                   for mac in macs for _ in range(self.threads_per_device)]
+        reader = threading.Thread(target=read)
+        reader.start()
+        _links['max_in_flight'] = 0
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        is_done.set()
+        reader.join()
+
+        self.assertEqual(errors, [])
+        per_device = self.threads_per_device * self.commands_per_thread
+        self.assertEqual(len(results), self.devices * per_device)
+
+        # Frames of every device are numbered without gaps or repeats.
+        for mac in macs:
+            backend = manager.get_cached(mac)._peripheral
+            counters = [RedmondCommand.unwrap(value)[0] for handle, value in backend.written_handles
+                        if handle == manager.get_cached(mac).bt_attrs.cmd]
+            self.assertEqual(counters, [i % 256 for i in range(len(counters))])
+            self.assertEqual(len(counters), per_device + 1)  # With auth.
+            # Commands of one device are serialized.
+            self.assertEqual(backend.max_in_flight, 1)
+
+        # Devices work in parallel.
+        self.assertGreater(_links['max_in_flight'], 1)
+
+    @staticmethod
+    def get_manager():
+        """Provides device manager for tests."""
+        return DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
@@ -0,0 +1,108 @@
+"""Tests for the connection parameters."""
+import os
+import stat
+import tempfile
+import unittest
+
+from r4s.connection import ConnectionUpdater, ConnParams, HcitoolConnectionUpdater, PROFILE_IDLE, PROFILE_INTERACTIVE
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.metrics import Metrics, CONN_INTERVAL
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+_HCITOOL = """#!/bin/sh
+if [ "$3" = "con" ]; then
+    echo "Connections:"
+    echo "	< LE AA:BB:CC:DD:EE:FF handle 64 state 1 lm MASTER"
+    exit 0
+fi
+echo "$@" > "$0.args"
+"""
+
+
+class RecordingUpdater(ConnectionUpdater):
+    def __init__(self):
+        self.updates = []
+
+    def update(self, mac, params):
+        self.updates.append((mac, params))
+        return True
+
+
+class NoPreferencePeripheral(Peripheral):
+    """Kettle without the preferred connection parameters characteristic."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.conn_params = None
+
+
+class TestConnection(unittest.TestCase):
+    """Tests for connection parameters negotiation."""
+    model = 'RK-G200S'
+
+    def test_profiles(self):
+        updater = RecordingUpdater()
+        metrics = Metrics()
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                                metrics=metrics, conn_updater=updater)
+        kettle = manager.connect(self.model)
+        preferred = ConnParams(24, 40, 0, 400)
+        self.assertEqual(kettle.bt_attrs.conn_params, list(preferred))
+        self.assertEqual(kettle.bt_attrs.as_dict()['conn_params'], list(preferred))
+        self.assertEqual(updater.updates, [(self.model, preferred)])
+
+        with kettle.interactive():
+            with kettle.interactive():
+                kettle.fetch_status()
+            self.assertEqual(kettle.link_params, PROFILE_INTERACTIVE)
+            self.assertEqual(metrics.snapshot()['gauges'][(CONN_INTERVAL, self.model)], 0.015)
+        self.assertEqual([params for _, params in updater.updates], [preferred, PROFILE_INTERACTIVE, preferred])
+        self.assertEqual(metrics.snapshot()['gauges'][(CONN_INTERVAL, self.model)], 0.05)
+        self.assertIn('r4s_requested_connection_interval_seconds{mac="RK-G200S"} 0.05', metrics.to_prometheus())
+
+    def test_no_preference(self):
+        updater = RecordingUpdater()
+        discovery = DeviceDiscovery()
+        manager = DeviceManager(key=[0xbb] * 8, discovery=discovery, ble_timeout=0, retries=1,
+                                conn_updater=updater)
+        r4s.manager.Peripheral = NoPreferencePeripheral
+        try:
+            kettle = manager.connect(self.model)
+        finally:
+            r4s.manager.Peripheral = Peripheral
+        # The missing characteristic is remembered and the idle profile is used.
+        self.assertEqual(kettle.bt_attrs.conn_params, [])
+        self.assertEqual(discovery.as_dict()[self.model]['conn_params'], [])
+        self.assertEqual(updater.updates, [(self.model, PROFILE_IDLE)])
+
+    def test_base_updater(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                                conn_updater=ConnectionUpdater())
+        kettle = manager.connect(self.model)
+        # Nothing is requested and the link keeps the parameters of the stack.
+        self.assertIsNone(kettle.link_params)
+        with kettle.interactive():
+            self.assertIsNone(kettle.link_params)
+
+    def test_hcitool(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            hcitool = os.path.join(dirname, 'hcitool')
+            with open(hcitool, 'w') as stream:
+                stream.write(_HCITOOL)
+            os.chmod(hcitool, stat.S_IRWXU)
+
+            updater = HcitoolConnectionUpdater(iface=1, hcitool=hcitool)
+            self.assertFalse(updater.update('11:22:33:44:55:66', PROFILE_INTERACTIVE))
+            self.assertTrue(updater.update('aa:bb:cc:dd:ee:ff', PROFILE_INTERACTIVE))
+            with open(hcitool + '.args') as stream:
+                self.assertEqual(stream.read().split(), ['-i', 'hci1', 'lecup', '--handle', '64', '--min', '6',
+                                                         '--max', '12', '--latency', '0', '--timeout', '200'])
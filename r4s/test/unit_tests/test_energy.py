@@ -0,0 +1,58 @@
+"""Tests for the energy accounting."""
+import time
+import unittest
+
+from r4s.collector import COUNTER_MOD
+from r4s.energy import EnergyLedger, BY_MODEL, BUCKET_DAY, BUCKET_MONTH
+from r4s.protocol.redmond.response.statistics import TenInformationResponse
+
+DAY = 86400
+JAN_31 = 1706659200  # 2024-01-31 00:00 UTC.
+
+
+class TestEnergyLedger(unittest.TestCase):
+    """Tests for EnergyLedger."""
+
+    def test_intervals(self):
+        ledger = EnergyLedger(capacity=2)
+        # Samples come out of order and mixed between devices.
+        ledger.add('a', 'RK-G200S', JAN_31 + DAY, 150, 20)
+        ledger.add('b', 'RK-M171S', JAN_31, COUNTER_MOD - 10, 5)
+        ledger.add('a', 'RK-G200S', JAN_31, 100, 10)
+        ledger.add('b', 'RK-M171S', JAN_31 + DAY, 15, 8)  # Wraparound.
+        ledger.add('a', 'RK-G200S', JAN_31 + 2 * DAY, 30, 3)  # Reset.
+        stats = TenInformationResponse(ten_num=0, err=0, work_time=9, spent_power=40, relay_turn_on_amount=0)
+        ledger.add_response('a', 'RK-G200S', JAN_31 + 3 * DAY, stats)
+
+        intervals = ledger.intervals()
+        self.assertEqual([ledger.macs[device] for device in intervals['device']], ['a', 'a', 'a', 'b'])
+        self.assertEqual(list(intervals['spent_power']), [50, 30, 10, 25])
+        self.assertEqual(list(intervals['work_time']), [10, 3, 6, 3])
+
+        self.assertEqual(ledger.aggregate(), {
+            'a': {'spent_power': 90, 'work_time': 19, 'intervals': 3},
+            'b': {'spent_power': 25, 'work_time': 3, 'intervals': 1},
+        })
+        self.assertEqual(ledger.aggregate(by=None), {None: {'spent_power': 115, 'work_time': 22, 'intervals': 4}})
+        by_month = ledger.aggregate(by=BY_MODEL, bucket=BUCKET_MONTH)
+        feb = JAN_31 + DAY
+        self.assertEqual(set(by_month), {('RK-G200S', feb), ('RK-M171S', feb)})
+        self.assertEqual(by_month[('RK-G200S', feb)]['spent_power'], 90)
+        by_day = ledger.aggregate(by=None, bucket=BUCKET_DAY, start=feb + DAY)
+        self.assertEqual(by_day, {
+            feb + DAY: {'spent_power': 30, 'work_time': 3, 'intervals': 1},
+            feb + 2 * DAY: {'spent_power': 10, 'work_time': 6, 'intervals': 1},
+        })
+
+    def test_fleet(self):
+        ledger = EnergyLedger()
+        devices = 1000
+        for day in range(30):
+            for i in range(devices):
+                ledger.add(i, 'model{}'.format(i % 5), JAN_31 + day * DAY, day * i, day)
+
+        started = time.perf_counter()
+        report = ledger.aggregate(by=BY_MODEL, bucket=BUCKET_MONTH)
+        elapsed = time.perf_counter() - started
+        self.assertEqual(sum(value['intervals'] for value in report.values()), devices * 29)
+        self.assertLess(elapsed, 0.2)
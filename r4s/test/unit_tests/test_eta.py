@@ -0,0 +1,50 @@
+"""Tests for the boil ETA estimator."""
+import time
+import unittest
+
+from r4s.eta import BoilEtaEstimator
+from r4s.protocol.redmond.response.kettle import Kettle200Response, MODE_BOIL, MODE_HEAT, STATE_ON, STATE_OFF
+
+
+def make_status(curr_temp, state=STATE_ON, program=MODE_BOIL, trg_temp=0):
+    return Kettle200Response(program=program, trg_temp=trg_temp, state=state, curr_temp=curr_temp)
+
+
+class TestBoilEta(unittest.TestCase):
+    """Tests for BoilEtaEstimator."""
+
+    def test_linear_heating(self):
+        estimator = BoilEtaEstimator()
+        for i in range(2):
+            estimator.add('mac', make_status(40 + i), timestamp=1000 + 2 * i)
+        self.assertIsNone(estimator.eta('mac', now=1002))
+        self.assertEqual(estimator.next_poll_delay('mac', now=1002), 5.0)
+
+        # 0.5 degrees per second, 56 degrees left.
+        for i in range(2, 5):
+            estimator.add('mac', make_status(40 + i), timestamp=1000 + 2 * i)
+        self.assertAlmostEqual(estimator.eta('mac', now=1008), 112)
+        self.assertAlmostEqual(estimator.eta('mac', now=1010), 110)
+        self.assertEqual(estimator.next_poll_delay('mac', now=1008), 60.0)
+        self.assertEqual(estimator.next_poll_delay('mac', now=1119), 1.0)
+
+        # New target starts a new curve, switch off forgets the device.
+        estimator.add('mac', make_status(44, program=MODE_HEAT, trg_temp=60), timestamp=1010)
+        self.assertIsNone(estimator.eta('mac'))
+        estimator.add('mac', make_status(45, state=STATE_OFF), timestamp=1012)
+        self.assertEqual(estimator.estimate(), {})
+
+    def test_fleet(self):
+        estimator = BoilEtaEstimator(capacity=4)
+        devices = 2000
+        for step in range(4):
+            for i in range(devices):
+                rate = 0.1 + i / devices
+                estimator.add(i, make_status(int(20 + rate * step * 10)), timestamp=step * 10)
+
+        started = time.perf_counter()
+        estimates = estimator.estimate()
+        elapsed = time.perf_counter() - started
+        self.assertEqual(len(estimates), devices)
+        self.assertLess(estimates[devices - 1], estimates[0])
+        self.assertLess(elapsed, 0.1)
@@ -0,0 +1,45 @@
+"""Tests for the frame logging helpers."""
+import logging
+import unittest
+
+from r4s.devices.base import RedmondDevice
+from r4s.discovery import DeviceDiscovery
+from r4s.frame_log import FrameLogSampler, LazyHex
+from r4s.manager import DeviceManager
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestFrameLog(unittest.TestCase):
+    """Tests for lazy frame formatting and sampling."""
+
+    def test_lazy_hex(self):
+        self.assertEqual(str(LazyHex(b'\x55\x00\x0a\xaa')), '55 00 0A AA')
+        self.assertEqual(str(LazyHex(None)), 'None')
+        self.assertEqual(RedmondDevice._format_bytes([0x01, 0xff]), '01 FF')
+
+    def test_sampler(self):
+        sampler = FrameLogSampler(every=3)
+        self.assertListEqual([sampler.sample() for _ in range(6)], [True, False, False, True, False, False])
+
+    def test_sampled_logging(self):
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+        kettle = manager.connect('RK-G200S')
+        sampler = RedmondDevice.frame_log_sampler
+        RedmondDevice.frame_log_sampler = FrameLogSampler(every=2)
+        try:
+            with self.assertLogs('r4s.devices.base', logging.DEBUG) as logs:
+                for _ in range(4):
+                    kettle._peripheral.push_status()
+                    kettle.wait_for_push(0)
+            self.assertEqual(len(logs.records), 2)
+            self.assertIn('55 00 06 00', logs.output[0])
+        finally:
+            RedmondDevice.frame_log_sampler = sampler
@@ -0,0 +1,84 @@
+"""Tests for the offline command journal."""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from r4s.discovery import DeviceDiscovery
+from r4s.journal import CommandJournal, CommandJournalYml
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.common import Cmd3On, Cmd4Off, Cmd5SetProgram, RedmondCommand
+from r4s.protocol.redmond.response.kettle import MODE_HEAT, STATE_ON
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestCommandJournal(unittest.TestCase):
+    """Tests for CommandJournal."""
+    model = 'RK-G200S'
+
+    def test_merge_and_expiry(self):
+        journal = CommandJournal()
+        journal.switch_off('a')
+        journal.set_mode('a', MODE_HEAT, 70, boil_time=2)
+        journal.switch_on('a')
+        journal.set_mode('a', MODE_HEAT, 80)
+        self.assertEqual(journal.pending('a'), {'on': True, 'program': MODE_HEAT, 'trg_temp': 80})
+
+        journal.switch_off('b', ttl=10)
+        self.assertTrue(journal.has_pending('b'))
+        self.assertEqual(journal.pending('b', now=time.time() + 20), {})
+
+    def test_flush_on_connect(self):
+        journal = CommandJournal()
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                                journal=journal)
+        self.assertFalse(manager.on_advertisement(self.model))
+
+        # The device is out of range, automation records intents.
+        journal.switch_off(self.model)
+        journal.switch_on(self.model)
+        journal.set_mode(self.model, MODE_HEAT, 70)
+
+        self.assertTrue(manager.on_advertisement(self.model))
+        kettle = manager.get_cached(self.model)
+        backend = kettle._peripheral
+        codes = [RedmondCommand.unwrap(value)[1] for handle, value in backend.written_handles
+                 if handle == kettle.bt_attrs.cmd]
+        self.assertEqual(codes[-3:-1], [Cmd5SetProgram.CODE, Cmd3On.CODE])
+        self.assertNotIn(Cmd4Off.CODE, codes)
+        self.assertEqual((backend.status.program, backend.status.trg_temp), (MODE_HEAT, 70))
+        self.assertEqual(backend.status.state, STATE_ON)
+        self.assertFalse(journal.has_pending(self.model))
+        self.assertFalse(manager.on_advertisement(self.model))
+        self.assertTrue(journal.supports(kettle))
+        self.assertFalse(journal.supports(object()))
+
+    def test_yml(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, 'journal.yml')
+            journal = CommandJournalYml(filename)
+            journal.set_mode('a', MODE_HEAT, 70)
+            journal.switch_off('b', ttl=-1)
+            restored = CommandJournalYml(filename)
+            self.assertEqual(restored.pending('a'), {'program': MODE_HEAT, 'trg_temp': 70})
+            self.assertEqual(restored.pending('b'), {})
+            restored.discard('a')
+            self.assertEqual(CommandJournalYml(filename).pending('a'), {})
+
+            # Concurrent changes leave the latest intents in the file.
+            threads = [threading.Thread(target=restored.switch_on, args=('mac{}'.format(i),)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(CommandJournalYml(filename).as_dict(), restored.as_dict())
+            self.assertEqual(os.listdir(dirname), ['journal.yml'])
@@ -3,8 +3,12 @@ import unittest
 
 from r4s import R4sAuthFailed
 from r4s.discovery import DeviceDiscovery
+from r4s.devices.kettles import STATS_MAX_AGE
 from r4s.manager import DeviceManager
+from r4s.reconciler import Kettle200Reconciler
+from r4s.protocol.redmond.command.common import Cmd3On, Cmd4Off, Cmd5SetProgram
 
+from r4s.protocol.redmond.response.lights import LIGHT_TYPE_BOIL, LIGHT_TYPE_BACKLIGHT
 from r4s.protocol.redmond.response.kettle import MODE_BOIL, BOIL_TEMP, STATE_ON, STATE_OFF, MODE_HEAT, MAX_TEMP
 from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
 from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
@@ -31,14 +35,14 @@ class TestKettle200(unittest.TestCase):
             self.assertTrue(kettle._is_auth)
             self.assertTrue(kettle._peripheral.check_key(kettle._key))
             # Check data.
-            self.assertListEqual(kettle._firmware_version, kettle._peripheral.fw_version.version)
+            self.assertListEqual(kettle.firmware_version, kettle._peripheral.fw_version.version)
             self.assertIsNotNone(kettle.status)
             self.assertIsNotNone(kettle.stats_ten)
             self.assertEqual(kettle.stats_ten, kettle._peripheral.statistics)
             self.assertEqual(kettle.status, kettle._peripheral.status)
 
         # When key is not authenticated.
-        manager._key = [0xaa] * 8
+        manager._keystore.record(self.model, [0xaa] * 8)
         try:
             with manager.connect(self.model) as kettle:
                 kettle.first_connect()
@@ -51,6 +55,42 @@ class TestKettle200(unittest.TestCase):
         # TODO: Imitate and test be busy.
         # TODO: Test all data structures creates correct bytes (size, possible content).
 
+    def test_lazy_fetch(self):
+        """Tests that the data is requested on demand."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+
+        written = len(backend.written_handles)
+        kettle.first_connect()
+        self.assertEqual(len(backend.written_handles), written)
+
+        # Statistics are requested once with both commands.
+        self.assertEqual(kettle.stats_ten, backend.statistics)
+        self.assertIsNotNone(kettle.stats_times)
+        self.assertEqual(len(backend.written_handles), written + 2)
+        self.assertListEqual(kettle.firmware_version, backend.fw_version.version)
+        self.assertListEqual(kettle.firmware_version, backend.fw_version.version)
+        self.assertEqual(len(backend.written_handles), written + 3)
+        kettle.ensure_sync()
+        kettle.ensure_sync()
+        self.assertEqual(len(backend.written_handles), written + 4)
+
+        # Session fields are requested again in a new session, statistics are not.
+        kettle.first_connect()
+        self.assertIsNotNone(kettle.firmware_version)
+        self.assertIsNotNone(kettle.stats_ten)
+        self.assertEqual(len(backend.written_handles), written + 5)
+
+        # Stale statistics are requested again.
+        kettle._fetched_at['stats_ten'] -= STATS_MAX_AGE + 1
+        self.assertIsNotNone(kettle.stats_ten)
+        self.assertEqual(len(backend.written_handles), written + 7)
+
+        # The time synced in this session is not sent again.
+        kettle.warm_up()
+        self.assertEqual(len(backend.written_handles), written + 11)
+
     def test_set_mode(self):
         """Tests kettle set mode and switch on/off."""
         # Register kettle.
@@ -89,6 +129,145 @@ class TestKettle200(unittest.TestCase):
         # TODO: Test status == off when boiled. on when heat.
         # TODO: Test all responses.
 
+    def test_status_changes(self):
+        """Tests that only changed status fields are reported."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+        deltas = []
+        unsubscribe = kettle.subscribe_changes(deltas.append, deadbands={'curr_temp': 2})
+
+        kettle.fetch_status()
+        self.assertEqual(deltas[0].mac, self.model)
+        self.assertEqual(deltas[0].changes, vars(kettle.status))
+
+        # Nothing changed or the temperature is within the deadband.
+        kettle.fetch_status()
+        backend.status.curr_temp += 2
+        kettle.fetch_status()
+        self.assertEqual(len(deltas), 1)
+
+        # The drift from the reported value exceeds the deadband.
+        backend.status.curr_temp += 1
+        kettle.switch_on()
+        self.assertEqual(deltas[-1].changes, {'curr_temp': backend.status.curr_temp, 'state': STATE_ON})
+
+        unsubscribe()
+        kettle.switch_off()
+        self.assertEqual(len(deltas), 2)
+
+    def test_push_status(self):
+        """Tests status updates pushed by the device."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+        updates = []
+        unsubscribe = kettle.subscribe_status(updates.append)
+
+        kettle.switch_on()
+        self.assertEqual(len(updates), 1)
+
+        # Pushed status is handled without request.
+        written = len(backend.written_handles)
+        backend.status.curr_temp = 70
+        backend.push_status()
+        self.assertTrue(kettle.wait_for_push(0))
+        self.assertFalse(kettle.wait_for_push(0))
+        self.assertEqual(len(backend.written_handles), written)
+        self.assertEqual(updates[-1].curr_temp, 70)
+
+        # Pushed status arrives before the command response.
+        backend.status.curr_temp = 80
+        backend.push_status()
+        kettle.switch_off()
+        self.assertEqual([status.curr_temp for status in updates[-2:]], [80, 80])
+        self.assertEqual(kettle.status.state, STATE_OFF)
+
+        # Fallback poll when nothing is pushed.
+        unsubscribe()
+        kettle.watch_status(0.01, poll_interval=0, listen_timeout=0)
+        self.assertEqual(len(updates), 4)
+        self.assertGreater(len(backend.written_handles), written + 4)
+
+    def test_reconciler(self):
+        """Tests that superseded intents are not sent."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+        reconciler = Kettle200Reconciler(kettle)
+
+        reconciler.set_mode(MODE_HEAT, 50)
+        reconciler.switch_on()
+        reconciler.set_mode(MODE_HEAT, MAX_TEMP)
+        reconciler.switch_off()
+        cmds = reconciler.flush()
+        self.assertListEqual([type(cmd) for cmd in cmds], [Cmd5SetProgram])
+        self.assertEqual(backend.status.trg_temp, MAX_TEMP)
+        self.assertEqual(kettle.status, backend.status)
+        self.assertDictEqual(reconciler.pending, {})
+
+        # Nothing to send when the target is reached.
+        written = len(backend.written_handles)
+        reconciler.set_mode(MODE_HEAT, MAX_TEMP)
+        reconciler.switch_off()
+        self.assertListEqual(reconciler.flush(), [])
+        self.assertEqual(len(backend.written_handles), written)
+
+        # The kettle is switched off to change the program and on again.
+        kettle.switch_on()
+        reconciler.set_mode(MODE_BOIL)
+        cmds = reconciler.flush()
+        self.assertListEqual([type(cmd) for cmd in cmds], [Cmd4Off, Cmd5SetProgram, Cmd3On])
+        self.assertEqual(kettle.status.state, STATE_ON)
+        self.assertEqual(kettle.status.program, MODE_BOIL)
+
+    def test_reconciler_failure(self):
+        """Tests that the target survives a failed flush."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        reconciler = Kettle200Reconciler(kettle)
+        kettle.fetch_status()
+
+        def fail(cmds):
+            # A newer intent arrives while the batch is being sent.
+            reconciler.switch_off()
+            raise BTLEException('Device disconnected')
+
+        kettle.do_commands = fail
+        reconciler.set_mode(MODE_HEAT, 50)
+        reconciler.switch_on()
+        with self.assertRaises(BTLEException):
+            reconciler.flush()
+        self.assertDictEqual(reconciler.pending, {'program': MODE_HEAT, 'trg_temp': 50, 'on': False})
+
+        del kettle.do_commands
+        self.assertListEqual([type(cmd) for cmd in reconciler.flush()], [Cmd5SetProgram])
+        self.assertEqual((kettle.status.program, kettle.status.trg_temp), (MODE_HEAT, 50))
+        self.assertDictEqual(reconciler.pending, {})
+
+    def test_lights(self):
+        """Tests that the palette is written only when changed."""
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+
+        current = kettle.fetch_lights(LIGHT_TYPE_BOIL)
+        self.assertEqual(kettle.lights[LIGHT_TYPE_BOIL], current)
+        colors = [[color['percent'], color['brightness'], color['red'], color['green'], color['blue']]
+                  for color in current.colors]
+        written = len(backend.written_handles)
+        self.assertFalse(kettle.set_lights(LIGHT_TYPE_BOIL, colors))
+        self.assertEqual(len(backend.written_handles), written)
+
+        colors[1][2:5] = [0x10, 0x20, 0x30]
+        self.assertTrue(kettle.set_lights(LIGHT_TYPE_BOIL, colors))
+        self.assertFalse(kettle.set_lights(LIGHT_TYPE_BOIL, colors))
+        self.assertEqual(len(backend.written_handles), written + 1)
+        self.assertEqual(kettle.fetch_lights(LIGHT_TYPE_BOIL), kettle.lights[LIGHT_TYPE_BOIL])
+        self.assertEqual(kettle.lights[LIGHT_TYPE_BOIL].colors[1]['green'], 0x20)
+        # Other light type is not affected.
+        self.assertNotIn(LIGHT_TYPE_BACKLIGHT, kettle.lights)
+
     @staticmethod
     def get_manager():
         """Provides device manager for tests."""
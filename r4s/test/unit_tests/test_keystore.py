@@ -0,0 +1,79 @@
+"""Tests for the key store and the bulk pairing."""
+import asyncio
+import os
+import tempfile
+import unittest
+
+from r4s.discovery import DeviceDiscovery
+from r4s.keystore import KeyStore, KeyStoreYml
+from r4s.manager import DeviceManager
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral
+
+import r4s.manager
+
+
+class PairingPeripheral(MockKettle200Peripheral):
+    """Kettle which pairing mode is turned on after a few auth attempts, unless its MAC ends with 'off'."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.auth_attempts = 0
+        self.auth_keys = set()
+        self.mac = None
+
+    def connect(self, addr, addrType=ADDR_TYPE_RANDOM, iface=None):
+        super().connect(addr, addrType, iface)
+        self.mac = addr
+
+    def cmd_auth(self, data):
+        self.auth_attempts += 1
+        self.ready_to_pair = self.auth_attempts >= 3 and not self.mac.endswith('off')
+        return super().cmd_auth(data)
+
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = MockKettle200Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestKeyStore(unittest.TestCase):
+    """Tests for KeyStore and DeviceManager.pair_devices."""
+
+    def test_pair_devices(self):
+        keystore = KeyStore()
+        manager = DeviceManager(key=None, discovery=DeviceDiscovery(), ble_timeout=0, retries=1, keystore=keystore)
+        macs = ['RK-G200S-{}'.format(i) for i in range(4)] + ['RK-G200S-off']
+
+        r4s.manager.Peripheral = PairingPeripheral
+        loop = asyncio.new_event_loop()
+        try:
+            with self.assertLogs('r4s.manager', 'DEBUG') as logs:
+                keys = loop.run_until_complete(manager.pair_devices(macs, timeout=0.5, interval=0.01))
+        finally:
+            loop.close()
+            r4s.manager.Peripheral = MockKettle200Peripheral
+        # Refused keys are expected while pairing.
+        self.assertFalse([record for record in logs.records if record.levelname == 'ERROR'])
+
+        self.assertIsNone(keys.pop('RK-G200S-off'))
+        self.assertIsNone(keystore.get('RK-G200S-off'))
+        self.assertEqual(len({bytes(key) for key in keys.values()}), len(keys))
+        for mac, key in keys.items():
+            self.assertEqual(keystore.get(mac), key)
+            kettle = manager.connect(mac)
+            self.assertEqual(kettle._peripheral.auth_keys, {bytes(key)})
+            self.assertEqual(kettle._peripheral.auth_attempts, 3)
+
+    def test_yml(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, 'keys.yml')
+            keystore = KeyStoreYml(filename)
+            key = keystore.key_for('mac')
+            self.assertIsNone(keystore.get('mac'))
+            self.assertEqual(keystore.key_for('mac'), key)
+            keystore.record('mac', key)
+            self.assertEqual(KeyStoreYml(filename).get('mac'), key)
+            self.assertEqual(os.stat(filename).st_mode & 0o777, 0o600)
+            self.assertEqual(os.listdir(dirname), ['keys.yml'])
@@ -0,0 +1,65 @@
+"""Tests for the instrumentation."""
+import unittest
+
+from r4s import R4sAuthFailed
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.metrics import Metrics, AUTH_FAILURES, CONNECTS, DIRECTION_IN, DIRECTION_OUT
+from r4s.protocol.redmond.command.common import Cmd6Status
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for Metrics."""
+    model = 'RK-G200S'
+
+    def test_device_metrics(self):
+        metrics = Metrics()
+        manager = self.get_manager([0xbb] * 8, metrics)
+        kettle = manager.connect(self.model)
+        kettle.fetch_status()
+        kettle.fetch_status()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['latency'][(Cmd6Status.CODE, self.model)]['count'], 2)
+        self.assertEqual(snapshot['counters'][(CONNECTS, self.model)], 1)
+        # CCCD write, auth and 2 status requests.
+        self.assertEqual(snapshot['frames'][DIRECTION_OUT]['count'], 4)
+        self.assertEqual(snapshot['frames'][DIRECTION_IN]['count'], 3)
+
+        text = metrics.to_prometheus()
+        self.assertIn('r4s_command_latency_seconds_count{{code="6",mac="{}"}} 2'.format(self.model), text)
+        self.assertIn('r4s_connects_total{{mac="{}"}} 1'.format(self.model), text)
+        self.assertIn('r4s_frame_size_bytes_bucket{direction="in",le="+Inf"} 3', text)
+
+    def test_auth_failures(self):
+        metrics = Metrics()
+        manager = self.get_manager([0xaa] * 8, metrics)
+        with self.assertRaises(R4sAuthFailed):
+            manager.connect(self.model)
+        self.assertEqual(metrics.snapshot()['counters'][(AUTH_FAILURES, self.model)], 1)
+
+    def test_disabled(self):
+        metrics = Metrics(enabled=False)
+        manager = self.get_manager([0xbb] * 8, metrics)
+        manager.connect(self.model).fetch_status()
+        self.assertDictEqual(metrics.snapshot(), {'latency': {}, 'frames': {}, 'counters': {}, 'gauges': {}})
+
+    @staticmethod
+    def get_manager(key, metrics):
+        """Provides device manager for tests."""
+        return DeviceManager(
+            key=key,
+            discovery=DeviceDiscovery(),
+            ble_timeout=0,
+            retries=1,
+            metrics=metrics,
+        )
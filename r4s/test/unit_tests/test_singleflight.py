@@ -0,0 +1,109 @@
+"""Tests for the request coalescing."""
+import asyncio
+import threading
+import unittest
+
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.metrics import Metrics, CONNECTS
+from r4s.protocol.redmond.command.common import Cmd6Status, RedmondCommand
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class WaitingPeripheral(Peripheral):
+    """Kettle which connects when released by the event loop or after a second."""
+    started = None
+    released = None
+    was_released = None
+
+    def connect(self, addr, addrType=ADDR_TYPE_RANDOM, iface=None):
+        WaitingPeripheral.started.set()
+        WaitingPeripheral.was_released = WaitingPeripheral.released.wait(1)
+        super().connect(addr, addrType, iface)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for SingleFlight and its usage in devices."""
+    model = 'RK-G200S'
+
+    def test_concurrent_status(self):
+        manager = self.get_manager()
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+        backend.latency = 0.05
+        written = len(backend.written_handles)
+
+        callers = 5
+        barrier = threading.Barrier(callers)
+        results = []
+
+        def fetch():
+            barrier.wait()
+            kettle.fetch_status()
+            results.append(kettle.status)
+
+        threads = [threading.Thread(target=fetch) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        status_writes = [value for _, value in backend.written_handles[written:]
+                         if RedmondCommand.unwrap(value)[1] == Cmd6Status.CODE]
+        self.assertEqual(len(status_writes), 1)
+        self.assertEqual(len(results), callers)
+        self.assertTrue(all(status is results[0] for status in results))
+
+    def test_concurrent_async_connect(self):
+        metrics = Metrics()
+        manager = self.get_manager(metrics)
+
+        async def connect_all():
+            return await asyncio.gather(*[manager.async_connect(self.model) for _ in range(3)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            devices = loop.run_until_complete(connect_all())
+        finally:
+            loop.close()
+        self.assertTrue(all(device is devices[0] for device in devices))
+        self.assertEqual(metrics.snapshot()['counters'][(CONNECTS, self.model)], 1)
+
+    def test_async_connect_in_thread(self):
+        manager = self.get_manager()
+        WaitingPeripheral.started = threading.Event()
+        WaitingPeripheral.released = threading.Event()
+
+        async def release():
+            while not WaitingPeripheral.started.is_set():
+                await asyncio.sleep(0.01)
+            WaitingPeripheral.released.set()
+
+        async def connect():
+            device, _ = await asyncio.gather(manager.async_connect(self.model), release())
+            return device
+
+        r4s.manager.Peripheral = WaitingPeripheral
+        loop = asyncio.new_event_loop()
+        try:
+            device = loop.run_until_complete(connect())
+        finally:
+            loop.close()
+            r4s.manager.Peripheral = Peripheral
+        # The loop kept running while the connection was blocked.
+        self.assertTrue(WaitingPeripheral.was_released)
+        self.assertIs(manager.get_cached(self.model), device)
+
+    @staticmethod
+    def get_manager(metrics=None):
+        """Provides device manager for tests."""
+        return DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                             metrics=metrics)
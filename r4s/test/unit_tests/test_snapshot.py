@@ -0,0 +1,130 @@
+"""Tests for warm restart snapshots."""
+import io
+import unittest
+
+from r4s.calendar_sync import CalendarSync
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.calendar import Cmd115
+from r4s.protocol.redmond.command.common import CmdAuth, RedmondCommand
+from r4s.protocol.redmond.response.calendar import EventInCalendarResponse
+from r4s.protocol.redmond.response.common import SuccessResponse
+from r4s.snapshot import merge_fields, write_snapshot, read_snapshot
+from r4s.timesync import TimeSyncManager
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+EVENT = EventInCalendarResponse(timezone=0, uid=2, recurrence_type=1, repeat_rule=0x7f, repeat_type=1,
+                                action_type=1, timestamp=1000)
+COLORS = ([0, 94, 0, 0, 255], [50, 94, 0, 255, 0], [100, 94, 255, 0, 0])
+
+
+class RefusingKettlePeripheral(Peripheral):
+    """Kettle which refuses the first auth."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.auth_attempts = 0
+
+    def cmd_auth(self, data):
+        self.auth_attempts += 1
+        if self.auth_attempts == 1:
+            return SuccessResponse(False).to_arr()
+        return super().cmd_auth(data)
+
+
+class TestSnapshot(unittest.TestCase):
+    """Tests for device snapshots."""
+    model = 'RK-G200S'
+
+    def test_warm_restart(self):
+        # Discovery and time sync are persisted on their own.
+        discovery = DeviceDiscovery()
+        time_sync = TimeSyncManager()
+        manager = self.get_manager(discovery, time_sync=time_sync)
+        kettle = manager.connect(self.model)
+        kettle.warm_up()
+        kettle.set_lights(0, COLORS)
+        calendar = CalendarSync(kettle)
+        calendar.sync([EVENT])
+
+        states = manager.dump_state()
+        states[self.model] += calendar.dump_state()
+        stream = io.BytesIO()
+        write_snapshot(stream, states)
+        stream.seek(0)
+        restored = read_snapshot(stream)
+        self.assertEqual(restored, states)
+
+        # The restart costs one auth.
+        manager = self.get_manager(discovery, restored, time_sync)
+        kettle = manager.connect(self.model)
+        backend = kettle._peripheral
+        self.assertEqual(kettle.firmware_version, [3, 10])
+        self.assertEqual(kettle.status, backend.status)
+        self.assertEqual(kettle.stats_ten, backend.statistics)
+        self.assertIsNotNone(kettle.stats_times)
+        self.assertFalse(kettle.set_lights(0, COLORS))
+        kettle.ensure_sync()
+        calendar = CalendarSync(kettle)
+        calendar.load_state(restored[self.model])
+        backend.calendar = {EVENT.uid: EVENT}
+        self.assertEqual(calendar.sync([EVENT]), 0)
+        codes = [RedmondCommand.unwrap(value)[1] for handle, value in backend.written_handles
+                 if handle == kettle.bt_attrs.cmd]
+        self.assertEqual(codes, [CmdAuth.CODE, Cmd115.CODE])
+
+        # The events restored for CalendarSync survive the connect and are replaced by its dump.
+        events = [state for state in restored[self.model] if state.field == 'calendar_event']
+        self.assertEqual([state for state in manager.dump_state()[self.model] if not kettle.owns_state(state.field)],
+                         events)
+        states = merge_fields(manager.dump_state()[self.model], calendar.dump_state())
+        self.assertEqual(sorted(states), sorted(kettle.dump_state() + calendar.dump_state()))
+
+        # Devices not connected yet are kept.
+        self.assertEqual(self.get_manager(discovery, restored).dump_state(), restored)
+
+    def test_stale(self):
+        manager = self.get_manager(DeviceDiscovery())
+        kettle = manager.connect(self.model)
+        kettle.fetch_status()
+        kettle.set_lights(0, COLORS)
+        states = [state._replace(fetched_at=state.fetched_at - 3600) for state in kettle.dump_state()]
+
+        kettle = self.get_manager(DeviceDiscovery(), {self.model: states}).connect(self.model)
+        # Restored schemes keep the time they were set.
+        self.assertEqual([state for state in kettle.dump_state() if state.field == 'lights'],
+                         [state for state in states if state.field == 'lights'])
+        self.assertTrue(kettle.is_stale('status'))
+        self.assertIsNotNone(kettle.status)
+        self.assertFalse(kettle.is_stale('status'))
+
+    def test_failed_auth(self):
+        kettle = self.get_manager(DeviceDiscovery()).connect(self.model)
+        kettle.fetch_status()
+        states = {self.model: kettle.dump_state()}
+
+        r4s.manager.Peripheral = RefusingKettlePeripheral
+        try:
+            manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=2,
+                                    snapshot=states)
+            kettle = manager.connect(self.model)
+        finally:
+            r4s.manager.Peripheral = Peripheral
+        # The state survives the refused attempt.
+        self.assertEqual(kettle._peripheral.auth_attempts, 2)
+        self.assertFalse(kettle.is_stale('status'))
+        self.assertEqual(manager.dump_state(), {self.model: kettle.dump_state()})
+
+    @staticmethod
+    def get_manager(discovery, snapshot=None, time_sync=None):
+        """Provides device manager for tests."""
+        return DeviceManager(key=[0xbb] * 8, discovery=discovery, ble_timeout=0, retries=1, time_sync=time_sync,
+                             snapshot=snapshot)
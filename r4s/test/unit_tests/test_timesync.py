@@ -0,0 +1,37 @@
+"""Tests for the time sync manager."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from r4s.protocol.redmond.command.common import CmdSync
+from r4s.timesync import TimeSyncManager, TimeSyncManagerYml
+
+
+class TestTimeSyncManager(unittest.TestCase):
+    """Tests for TimeSyncManager."""
+    mac = 'AA:BB:CC:DD:EE:FF'
+
+    def test_needs_sync(self):
+        manager = TimeSyncManager(max_drift=30, drift_rate=1e-4)
+        self.assertTrue(manager.needs_sync(self.mac))
+        cmd = CmdSync(now=1000000)
+        manager.record(self.mac, cmd.now, cmd.tmz)
+        self.assertFalse(manager.needs_sync(self.mac, now=cmd.now + 1000))
+        # Estimated drift exceeds the limit.
+        self.assertTrue(manager.needs_sync(self.mac, now=cmd.now + 300001))
+        # Host timezone changed.
+        with mock.patch('r4s.timesync.host_utc_offset', return_value=cmd.tmz + 3600):
+            self.assertTrue(manager.needs_sync(self.mac, now=cmd.now + 1000))
+
+    def test_yml(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'sync.yml')
+            manager = TimeSyncManagerYml(filename)
+            manager.record(self.mac, 1000000, 3600)
+            self.assertDictEqual(TimeSyncManagerYml(filename).as_dict(), manager.as_dict())
+
+    def test_cmd_sync(self):
+        cmd = CmdSync(timezone=-5, now=1000000)
+        self.assertEqual(cmd.tmz, -5 * 3600)
+        self.assertEqual(len(cmd.to_arr()), 8)
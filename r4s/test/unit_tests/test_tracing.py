@@ -0,0 +1,55 @@
+"""Tests for the tracing hooks."""
+import unittest
+
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.tracing import SpanRecorder, Tracer, tracer
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestTracing(unittest.TestCase):
+    """Tests for Tracer and SpanRecorder."""
+    model = 'RK-G200S'
+
+    def test_connection_timeline(self):
+        recorder = SpanRecorder()
+        try:
+            manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1)
+            kettle = manager.connect(self.model)
+            kettle.fetch_status()
+        finally:
+            recorder.close()
+
+        spans = recorder.timeline(self.model)
+        self.assertListEqual([span.name for span in spans], [
+            'connect', 'peripheral.connect', 'discover', 'auth', 'enable_notifications', 'command', 'command',
+        ])
+        connect = spans[0]
+        self.assertEqual(connect.attrs, {'mac': self.model, 'attempt': 1, 'model': self.model})
+        self.assertListEqual([span.depth for span in spans], [0, 1, 1, 1, 2, 2, 0])
+        self.assertEqual(spans[-1].attrs['cmd'], 'Cmd6Status')
+        self.assertTrue(all(span.duration >= 0 for span in spans))
+        self.assertEqual(len(recorder.dump(self.model).splitlines()), len(spans))
+
+        # Nothing is recorded after close.
+        kettle.fetch_status()
+        self.assertEqual(len(recorder.timeline()), len(spans))
+
+    def test_error(self):
+        tracer_ = Tracer()
+        recorder = SpanRecorder(tracer_)
+        with self.assertRaises(ValueError):
+            with tracer_.span('failing', mac='mac'):
+                raise ValueError()
+        self.assertIsInstance(recorder.timeline('mac')[0].error, ValueError)
+
+    def test_no_listeners(self):
+        self.assertIs(tracer.span('a'), tracer.span('b'))
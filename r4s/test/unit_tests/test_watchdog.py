@@ -0,0 +1,127 @@
+"""Tests for the watchdog of peripheral operations."""
+import threading
+import time
+import unittest
+
+from r4s import R4sWatchdogTimeout
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.test.bluepy_helper import BTLEException, BTLEInternalError, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral
+from r4s.watchdog import Watchdog, WatchedPeripheral
+
+import r4s.manager
+
+
+class FakeHelper:
+    """Imitates bluepy-helper process."""
+
+    def __init__(self):
+        self.killed = threading.Event()
+
+    def kill(self):
+        self.killed.set()
+
+    def poll(self):
+        return -9 if self.killed.is_set() else None
+
+
+class HangingPeripheral(MockKettle200Peripheral):
+    """Kettle which writes hang until the helper is killed if is_hung is set."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._helper = FakeHelper()
+        self.is_hung = False
+
+    def connect(self, addr, addrType=ADDR_TYPE_RANDOM, iface=None):
+        if self._helper is None:
+            self._helper = FakeHelper()
+        super().connect(addr, addrType, iface)
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        if self.is_hung:
+            self._helper.killed.wait(5)
+            raise BTLEInternalError('Helper exited')
+        return super().writeCharacteristic(handle, val, withResponse)
+
+
+class HangingDiscoveryPeripheral(HangingPeripheral):
+    """Kettle which characteristics discovery hangs until the helper is killed."""
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        self._helper.killed.wait(5)
+        raise BTLEInternalError('Helper exited')
+
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = MockKettle200Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestWatchdog(unittest.TestCase):
+    """Tests for Watchdog."""
+    limit = 0.1
+
+    def test_hung_device(self):
+        watchdog = Watchdog({'writeCharacteristic': self.limit})
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                                watchdog=watchdog)
+        r4s.manager.Peripheral = HangingPeripheral
+        try:
+            hung, healthy = manager.connect('hung'), manager.connect('healthy')
+        finally:
+            r4s.manager.Peripheral = MockKettle200Peripheral
+        self.assertIsInstance(hung._peripheral, WatchedPeripheral)
+        hung._peripheral.is_hung = True
+        helper = hung._peripheral._helper
+
+        errors = []
+
+        def fetch():
+            try:
+                hung.fetch_status()
+            except R4sWatchdogTimeout as err:
+                errors.append(err)
+
+        started = time.monotonic()
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        # Other devices keep working.
+        for _ in range(3):
+            healthy.fetch_status()
+        thread.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(helper.killed.is_set())
+        self.assertFalse(healthy._peripheral._helper.killed.is_set())
+        self.assertEqual(watchdog.expired, 1)
+
+        # The next connection starts a new helper.
+        hung._peripheral.is_hung = False
+        hung.disconnect()
+        self.assertIs(manager.connect('hung'), hung)
+        self.assertIsNot(hung._peripheral._helper, helper)
+        hung.fetch_status()
+
+    def test_hung_discovery(self):
+        watchdog = Watchdog({'getCharacteristics': self.limit})
+        manager = DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1,
+                                watchdog=watchdog)
+        r4s.manager.Peripheral = HangingDiscoveryPeripheral
+        started = time.monotonic()
+        try:
+            with self.assertRaises(R4sWatchdogTimeout):
+                manager.connect('hung')
+        finally:
+            r4s.manager.Peripheral = MockKettle200Peripheral
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(watchdog.expired, 1)
+
+    def test_limit(self):
+        watchdog = Watchdog({'waitForNotifications': 2})
+        self.assertEqual(watchdog.limit('waitForNotifications', (1,)), 3)
+        self.assertEqual(watchdog.limit('waitForNotifications', (), {'timeout': 0.5}), 2.5)
+        self.assertEqual(watchdog.limit('connect'), 20)
@@ -0,0 +1,69 @@
+"""Tests of the MTU and the write modes on the mock link."""
+import unittest
+
+from r4s.connection import DEFAULT_MTU, MAX_MTU
+from r4s.discovery import DeviceDiscovery
+from r4s.manager import DeviceManager
+from r4s.protocol.redmond.command.common import Cmd6Status, RedmondCommand
+from r4s.test.bluepy_helper import BTLEException, ADDR_TYPE_RANDOM
+from r4s.test.peripherals.kettle import MockKettle200Peripheral as Peripheral
+
+import r4s.manager
+
+# Override module dependencies to imitate Peripheral.
+r4s.manager.Peripheral = Peripheral
+r4s.manager.ADDR_TYPE_RANDOM = ADDR_TYPE_RANDOM
+r4s.manager.BTLEException = BTLEException
+
+
+class TestWriteMode(unittest.TestCase):
+    """Tests for MTU negotiation and write modes."""
+    model = 'RK-G200S'
+    rounds = 10
+
+    def test_mtu(self):
+        kettle = self.get_manager().connect(self.model)
+        self.assertEqual(kettle.mtu, MAX_MTU)
+        self.assertEqual(kettle._peripheral.mtu, MAX_MTU)
+        kettle.disconnect()
+        kettle = self.get_manager(mtu=None).connect(self.model)
+        self.assertEqual(kettle.mtu, DEFAULT_MTU)
+
+    def test_unacknowledged_reads(self):
+        kettle = self.get_manager().connect(self.model)
+        backend = kettle._peripheral
+
+        unacknowledged = self.measure(backend, kettle.fetch_status)
+        Cmd6Status.write_with_response = True
+        try:
+            acknowledged = self.measure(backend, kettle.fetch_status)
+        finally:
+            Cmd6Status.write_with_response = False
+
+        # A read skips the write response round trip.
+        self.assertEqual(unacknowledged, self.rounds)
+        self.assertEqual(acknowledged, 2 * self.rounds)
+
+    def test_large_frames(self):
+        frame = RedmondCommand.wrap(0, Cmd6Status.CODE, [0] * 60)
+        round_trips = {}
+        for mtu in (None, MAX_MTU):
+            kettle = self.get_manager(mtu=mtu).connect(self.model)
+            round_trips[kettle.mtu] = self.measure(
+                kettle._peripheral, lambda: kettle._write_handle(kettle.bt_attrs.cmd, frame))
+            kettle.disconnect()
+
+        # The frame is split into 4 packets with the default MTU.
+        self.assertEqual(round_trips, {DEFAULT_MTU: 3 * self.rounds, MAX_MTU: 0})
+
+    def measure(self, backend, fn):
+        """Returns the link round trips spent by the rounds of fn."""
+        started = backend.round_trips
+        for _ in range(self.rounds):
+            fn()
+        return backend.round_trips - started
+
+    @staticmethod
+    def get_manager(**kwargs):
+        """Provides device manager for tests."""
+        return DeviceManager(key=[0xbb] * 8, discovery=DeviceDiscovery(), ble_timeout=0, retries=1, **kwargs)
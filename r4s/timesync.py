@@ -0,0 +1,66 @@
+import time
+
+import yaml
+
+from r4s.protocol import host_utc_offset
+
+MAX_DRIFT = 30  # Seconds of estimated clock drift before the device is synced again.
+DRIFT_RATE = 50e-6  # Estimated device clock drift, seconds per second.
+
+
+class TimeSyncManager:
+    """Decides when device clocks must be synced.
+
+    Keeps when and with what UTC offset every device was last synced.
+    The device is synced again when the estimated drift or the host timezone changes.
+    The implementation stores the records in memory, inherit the class to persist them.
+    """
+
+    def __init__(self, max_drift=MAX_DRIFT, drift_rate=DRIFT_RATE):
+        self.max_drift = max_drift
+        self.drift_rate = drift_rate
+        self._synced = {}  # MAC to (sync timestamp, UTC offset).
+
+    def needs_sync(self, mac, now=None):
+        """Whether the device clock must be synced."""
+        if mac not in self._synced:
+            return True
+        if now is None:
+            now = time.time()
+        synced_at, offset = self._synced[mac]
+        if offset != host_utc_offset(now):
+            return True
+        return abs(now - synced_at) * self.drift_rate > self.max_drift
+
+    def record(self, mac, synced_at, offset):
+        """Saves successful sync."""
+        self._synced[mac] = (synced_at, offset)
+        self._on_record(mac)
+
+    def _on_record(self, mac):
+        """Callback function when the sync was recorded."""
+        pass
+
+    def as_dict(self):
+        """Casts the instance to a dict."""
+        return {mac: {'synced_at': synced_at, 'offset': offset} for mac, (synced_at, offset) in self._synced.items()}
+
+
+class TimeSyncManagerYml(TimeSyncManager):
+    """Time sync manager with yml storage."""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        try:
+            with open(self.filename, 'r') as stream:
+                config = yaml.safe_load(stream) or {}
+                for mac, record in config.items():
+                    self._synced[mac] = (record['synced_at'], record['offset'])
+        except FileNotFoundError:
+            pass
+
+    def _on_record(self, mac):
+        """Rewrite the whole file on every sync."""
+        with open(self.filename, 'w+') as stream:
+            yaml.safe_dump(self.as_dict(), stream)
@@ -0,0 +1,144 @@
+"""Tracing hooks around connection phases and commands.
+
+Listeners registered on the module tracer are called on span start and end.
+Without listeners a span is a shared no-op object.
+"""
+import threading
+import time
+
+
+class Span:
+    """Timed phase with attributes, e.g. mac, model and attempt."""
+    __slots__ = ('name', 'attrs', 'start', 'end', 'depth', 'error', '_tracer')
+
+    def __init__(self, tracer, name, attrs):
+        self._tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.error = None
+
+    @property
+    def duration(self):
+        return None if self.end is None else self.end - self.start
+
+    def set(self, key, value):
+        """Sets an attribute known only after the start."""
+        self.attrs[key] = value
+
+    def __enter__(self):
+        self._tracer._start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is not None:
+            self.error = exc_val
+        self._tracer._end(self)
+
+
+class _NullSpan:
+    """Span used when nobody listens."""
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Creates spans and notifies listeners."""
+
+    def __init__(self):
+        self._listeners = []
+        self._local = threading.local()
+
+    def add_listener(self, on_start=None, on_end=None):
+        """Registers span callbacks. Returns a function to remove them."""
+        listener = (on_start, on_end)
+        self._listeners = [*self._listeners, listener]
+
+        def remove():
+            self._listeners = [item for item in self._listeners if item is not listener]
+
+        return remove
+
+    def span(self, name, **attrs):
+        """Returns a context manager timing the phase."""
+        if not self._listeners:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def _start(self, span):
+        stack = self._stack()
+        span.depth = len(stack)
+        stack.append(span)
+        span.start = time.monotonic()
+        for on_start, _ in self._listeners:
+            if on_start is not None:
+                on_start(span)
+
+    def _end(self, span):
+        span.end = time.monotonic()
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        for _, on_end in self._listeners:
+            if on_end is not None:
+                on_end(span)
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+
+class SpanRecorder:
+    """Keeps finished spans to dump connection timelines."""
+
+    def __init__(self, tracer_=None, limit=10000):
+        self.spans = []
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._remove = (tracer_ or tracer).add_listener(on_end=self.on_end)
+
+    def on_end(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if len(self.spans) > self.limit:
+                del self.spans[:len(self.spans) - self.limit]
+
+    def close(self):
+        """Stops recording."""
+        self._remove()
+
+    def timeline(self, mac=None):
+        """Returns recorded spans of a device ordered by start."""
+        with self._lock:
+            spans = [span for span in self.spans if mac is None or span.attrs.get('mac') == mac]
+        return sorted(spans, key=lambda span: (span.start, span.depth))
+
+    def dump(self, mac=None):
+        """Returns the timeline as text, offsets and durations in milliseconds."""
+        spans = self.timeline(mac)
+        if not spans:
+            return ''
+        origin = spans[0].start
+        lines = []
+        for span in spans:
+            attrs = ' '.join('{}={}'.format(key, value) for key, value in span.attrs.items())
+            lines.append('{:>9.1f} {:>9.1f}  {}{}  {}{}'.format(
+                (span.start - origin) * 1000, span.duration * 1000, '  ' * span.depth, span.name, attrs,
+                '  error={!r}'.format(span.error) if span.error is not None else ''))
+        return '\n'.join(lines)
+
+
+tracer = Tracer()  # Tracer used by the library.
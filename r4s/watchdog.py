@@ -0,0 +1,141 @@
+"""Wall-clock limits of peripheral operations.
+
+Bluepy calls block on the output of the bluepy-helper process and may hang when it wedges.
+On expiry the watchdog kills the helper of the peripheral. The blocked call fails, and only the
+device of that peripheral is affected because bluepy runs a helper per peripheral.
+The next connect starts a new helper.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from r4s import R4sWatchdogTimeout
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds allowed per operation. The timeout of waitForNotifications is added to its limit.
+DEFAULT_LIMITS = {
+    'connect': 20,
+    'disconnect': 5,
+    'discoverServices': 15,
+    'getServiceByUUID': 15,
+    'getCharacteristics': 10,
+    'getDescriptors': 10,
+    'readCharacteristic': 5,
+    'writeCharacteristic': 5,
+    'setMTU': 5,
+    'waitForNotifications': 5,
+}
+
+
+class _Operation:
+    __slots__ = ('name', 'peripheral', 'deadline', 'is_expired')
+
+    def __init__(self, name, peripheral, deadline):
+        self.name = name
+        self.peripheral = peripheral
+        self.deadline = deadline
+        self.is_expired = False
+
+
+class Watchdog:
+    """Tracks deadlines of running operations in one monitor thread."""
+
+    def __init__(self, limits=None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.expired = 0  # Number of expired operations.
+        self._running = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def wrap(self, peripheral):
+        """Returns the peripheral with guarded operations."""
+        return WatchedPeripheral(peripheral, self)
+
+    def limit(self, name, args=(), kwargs=None):
+        """Returns the limit of an operation call."""
+        limit = self.limits[name]
+        if name == 'waitForNotifications':
+            timeout = args[0] if args else (kwargs or {}).get('timeout')
+            if timeout is not None:
+                limit += timeout
+        return limit
+
+    @contextmanager
+    def guard(self, peripheral, name, limit):
+        """Fails the operation with R4sWatchdogTimeout if it runs longer than limit seconds."""
+        op = _Operation(name, peripheral, time.monotonic() + limit)
+        with self._cond:
+            self._running.add(op)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        try:
+            yield
+        except Exception as err:
+            if op.is_expired:
+                raise R4sWatchdogTimeout('{} exceeded {} seconds.'.format(name, limit)) from err
+            raise
+        finally:
+            with self._cond:
+                self._running.discard(op)
+            if op.is_expired:
+                self._reset_helper(peripheral)
+        if op.is_expired:
+            # The call returned after the helper was killed.
+            raise R4sWatchdogTimeout('{} exceeded {} seconds.'.format(name, limit))
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                for op in self._running:
+                    if not op.is_expired and op.deadline <= now:
+                        op.is_expired = True
+                        self.expired += 1
+                        self._kill_helper(op)
+                deadlines = [op.deadline for op in self._running if not op.is_expired]
+                self._cond.wait(min(deadlines) - now if deadlines else None)
+
+    @staticmethod
+    def _kill_helper(op):
+        _LOGGER.warning('%s hung, killing the bluepy helper.', op.name)
+        helper = getattr(op.peripheral, '_helper', None)
+        if helper is None:
+            _LOGGER.warning('No helper process to kill, %s keeps running.', op.name)
+            return
+        try:
+            helper.kill()
+        except OSError:
+            _LOGGER.exception('failed to kill the helper')
+
+    @staticmethod
+    def _reset_helper(peripheral):
+        """Forgets the killed helper, so the next connect starts a new one."""
+        helper = getattr(peripheral, '_helper', None)
+        if helper is not None and helper.poll() is not None:
+            peripheral._helper = None
+
+
+class WatchedPeripheral:
+    """Peripheral proxy guarding the operations with limits."""
+
+    def __init__(self, peripheral, watchdog: Watchdog):
+        object.__setattr__(self, '_peripheral', peripheral)
+        object.__setattr__(self, '_watchdog', watchdog)
+
+    def __getattr__(self, name):
+        attr = getattr(self._peripheral, name)
+        if name not in self._watchdog.limits or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._watchdog.guard(self._peripheral, name, self._watchdog.limit(name, args, kwargs)):
+                return attr(*args, **kwargs)
+
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._peripheral, name, value)